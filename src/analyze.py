@@ -0,0 +1,156 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import os
+import sys
+import time
+
+from chessboard import ChessBoard
+from stats import SearchStats
+from transposition import TranspositionTable, DEFAULT_SIZE_MB
+import move
+import search
+
+"""
+Bulk analysis of the positions in an EPD file, over a pool of worker processes
+
+Usage: python analyze.py FILE [--depth N] [--movetime SECONDS] [--workers N] [--hash MB] [--output FILE]
+
+The file is read lazily, with only a few positions per worker in flight, so it can be arbitrarily large.
+Each result is written as soon as its search finishes, so not necessarily in input order. Results are
+EPD lines: the position and its original operations, with these added
+    bm  - best move, in coordinate notation (e.g. e7e8q) rather than SAN
+    ce  - score in centipawns for the side to move
+    acd - depth of the last completed iteration
+    acn - nodes searched
+    acs - seconds spent
+Positions without legal moves get only ce. Lines that can't be parsed are reported on stderr and skipped.
+"""
+
+DEFAULT_DEPTH = 4
+IN_FLIGHT_PER_WORKER = 4
+
+# Per process state, set up by init_worker
+_worker_tt = None
+
+def init_worker(tt_mb):
+    global _worker_tt
+    _worker_tt = TranspositionTable(tt_mb)
+
+def analyze_position(epd, depth, movetime=None, tt=None):
+    """
+    Searches the position in line epd to depth, or until movetime seconds have passed
+    Returns the result line (see above)
+    """
+    board, ops = ChessBoard.from_epd(epd)
+    if tt is None:
+        tt = TranspositionTable()
+    else:
+        tt.clear() # so the result doesn't depend on which positions the worker saw before
+    stats = SearchStats()
+    best, score, reached = search.limited_search(board, time_limit=movetime, max_depth=depth, tt=tt, stats=stats)
+    if best is None:
+        ops["ce"] = search.no_moves_score(board)
+    else:
+        ops["bm"] = move.to_uci(best)
+        if score is not None:
+            ops["ce"] = score
+        ops["acd"] = reached
+        ops["acn"] = stats.nodes
+        ops["acs"] = "%.3f" % stats.elapsed()
+    return board.to_epd(ops)
+
+def analyze_task(epd, depth, movetime):
+    return analyze_position(epd, depth, movetime, _worker_tt)
+
+def read_positions(lines):
+    """
+    Yields (line number, EPD line), skipping blank lines and # comments
+    """
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if line and not line.startswith("#"):
+            yield n, line
+
+def analyze(lines, write, depth=DEFAULT_DEPTH, movetime=None, workers=None, tt_mb=DEFAULT_SIZE_MB):
+    """
+    Analyzes every position in lines (an iterable of EPD lines, e.g. an open file)
+    write is called with each result line as it completes
+    Returns (positions analyzed, positions that failed to parse)
+    """
+    workers = workers or os.cpu_count() or 1
+    done_count, errors = 0, 0
+
+    def report(n, result=None, error=None):
+        nonlocal done_count, errors
+        if error is not None:
+            errors += 1
+            print("line %d: %s" % (n, error), file=sys.stderr)
+        else:
+            done_count += 1
+            write(result)
+
+    if workers == 1:
+        tt = TranspositionTable(tt_mb)
+        for n, epd in read_positions(lines):
+            try:
+                result = analyze_position(epd, depth, movetime, tt)
+            except ValueError as e:
+                report(n, error=e)
+            else:
+                report(n, result)
+        return done_count, errors
+
+    def collect(futures):
+        for future in futures:
+            n = pending.pop(future)
+            error = future.exception()
+            if error is not None and not isinstance(error, ValueError):
+                raise error
+            report(n, None if error else future.result(), error)
+
+    pending = {} # future -> line number
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(tt_mb,)) as executor:
+        for n, epd in read_positions(lines):
+            if len(pending) >= workers * IN_FLIGHT_PER_WORKER:
+                finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(finished)
+            pending[executor.submit(analyze_task, epd, depth, movetime)] = n
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(finished)
+    return done_count, errors
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Analyze every position of an EPD file")
+    parser.add_argument("file", help="EPD file, - for stdin")
+    parser.add_argument("--depth", type=int, default=DEFAULT_DEPTH, help="maximum search depth")
+    parser.add_argument("--movetime", type=float, help="seconds per position (the search stops at --depth regardless)")
+    parser.add_argument("--workers", type=int, help="number of processes, defaults to the number of CPUs")
+    parser.add_argument("--hash", type=float, default=DEFAULT_SIZE_MB, metavar="MB",
+            help="transposition table size per worker")
+    parser.add_argument("--output", help="write results to this file instead of stdout")
+    args = parser.parse_args(args)
+
+    infile = sys.stdin if args.file == "-" else open(args.file)
+    outfile = open(args.output, "w") if args.output else sys.stdout
+    def write(line):
+        outfile.write(line + "\n")
+        outfile.flush()
+
+    start = time.perf_counter()
+    try:
+        count, errors = analyze(infile, write, args.depth, args.movetime, args.workers, args.hash)
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+    elapsed = time.perf_counter() - start
+    print("Analyzed %d positions in %.1fs (%.2f/s), %d errors" % (count, elapsed,
+            count / elapsed if elapsed > 0 else 0.0, errors), file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
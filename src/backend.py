@@ -0,0 +1,37 @@
+import os
+import numpy as np
+
+"""
+Selects how bitboards are represented, using the SNAKEFISH_BACKEND environment variable
+It's read once at import, so it has to be set before any engine module is imported
+
+numpy - bitboards are np.uint64 scalars and tables are numpy arrays (default)
+int   - bitboards are Python ints masked to 64 bits and tables are lists of ints
+        Native int arithmetic avoids the per-operation overhead of numpy scalars
+
+Both backends produce identical results, so they can be benchmarked against each other on perft
+"""
+
+NUMPY = "numpy"
+INT = "int"
+
+NAME = os.environ.get("SNAKEFISH_BACKEND", NUMPY)
+
+if NAME == NUMPY:
+    BB = np.uint64 # bitboard type
+    INDEX = np.uint8 # square index type
+elif NAME == INT:
+    BB = int
+    INDEX = int
+else:
+    raise ValueError("Unknown SNAKEFISH_BACKEND: %s" % NAME)
+
+FULL_BB = BB(0xFFFFFFFFFFFFFFFF)
+
+def to_table(arr):
+    """
+    Converts a numpy array of precomputed values into the backend's table type
+    """
+    if NAME == INT:
+        return arr.tolist()
+    return arr
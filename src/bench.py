@@ -0,0 +1,212 @@
+import argparse
+import json
+import sys
+import time
+import numpy as np
+
+import backend
+import bitboard
+from chessboard import ChessBoard
+from stats import SearchStats
+import evaluation
+import movegen
+import perft
+import search
+
+"""
+Benchmark suite: times the main engine components over a fixed set of positions
+
+Usage: python bench.py [--quick] [--output FILE] [--baseline FILE] [--threshold FRACTION]
+
+Results are printed (or written to --output) as JSON, with micro-benchmarks of the bitboard primitives
+under "primitives". With --baseline, nodes per second for every
+position/phase is compared against a previous run, and the exit status is 1 if any of them dropped by
+more than the threshold.
+"""
+
+# Castling rights and en passant squares are left out, since the engine doesn't have either
+POSITIONS = {
+    "start": "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1",
+    "midgame": "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1",
+    "endgame": "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+}
+
+# Per phase settings: (iterations, depth) for a full run and for --quick
+SETTINGS = {
+    "full": {"movegen": 200, "apply_move": 200, "evaluate": 200, "sliders": 200, "search_depth": 3, "perft_depth": 3,
+        "primitives": 200},
+    "quick": {"movegen": 20, "apply_move": 20, "evaluate": 20, "sliders": 20, "search_depth": 2, "perft_depth": 2,
+        "primitives": 20},
+}
+
+DEFAULT_THRESHOLD = 0.10
+
+def timed(fn):
+    """
+    Runs fn, which returns the number of nodes it processed
+    Returns a result dict with nodes, time (seconds) and nps
+    """
+    start = time.perf_counter()
+    nodes = fn()
+    elapsed = time.perf_counter() - start
+    return {"nodes": nodes, "time": elapsed, "nps": nodes / elapsed if elapsed > 0 else 0.0}
+
+def bench_movegen(board, iterations):
+    def run():
+        nodes = 0
+        for _ in range(iterations):
+            nodes += sum(1 for _ in movegen.gen_legal_moves(board))
+        return nodes
+    return timed(run)
+
+def bench_apply_move(board, iterations):
+    moves = list(movegen.gen_legal_moves(board))
+    def run():
+        for _ in range(iterations):
+            for m in moves:
+                board.apply_move(m)
+        return iterations * len(moves)
+    return timed(run)
+
+def bench_evaluate(board, iterations):
+    def run():
+        for _ in range(iterations):
+            evaluation.evaluate(board)
+        return iterations
+    return timed(run)
+
+def bench_sliders(board, iterations, magic=True):
+    """
+    Rook and bishop attacks from every square for the board's occupancy, either with the magic tables or
+    with the FIRST_RANK_MOVES lookups (one per line through the square)
+    """
+    occ = board.combined_all
+    squares = [backend.INDEX(i) for i in range(64)]
+    def run():
+        if magic:
+            for _ in range(iterations):
+                for i in squares:
+                    movegen.get_rook_attacks_bb(i, occ)
+                    movegen.get_bishop_attacks_bb(i, occ)
+        else:
+            for _ in range(iterations):
+                for i in squares:
+                    movegen.get_rank_moves_bb(i, occ) ^ movegen.get_file_moves_bb(i, occ)
+                    movegen.get_diag_moves_bb(i, occ) ^ movegen.get_antidiag_moves_bb(i, occ)
+        return iterations * 2 * len(squares)
+    return timed(run)
+
+# Without null move pruning, late move reductions and futility pruning, to measure what they save
+FULL_WIDTH = search.SearchOptions(null_move=False, reductions=False, futility=False)
+
+def bench_search(board, depth, options=search.DEFAULT_OPTIONS):
+    stats = SearchStats()
+    def run():
+        search.best_move(board, depth, options=options, stats=stats)
+        return stats.nodes
+    return timed(run)
+
+def bench_perft(board, depth):
+    return timed(lambda: perft.perft(board, depth))
+
+def bench_primitives(iterations):
+    """
+    Micro-benchmarks of the bitboard primitives against the implementations they replaced
+    (De Bruijn bitscans and Kernighan popcount on numpy scalars, byte table popcount on arrays)
+    """
+    rng = np.random.default_rng(0)
+    values = rng.integers(1, 2**64 - 1, size=64, dtype=np.uint64, endpoint=True)
+    numpy_bbs = list(values)
+    bbs = [backend.BB(int(v)) for v in values]
+    arr = rng.integers(0, 2**64 - 1, size=(256, 2, 6), dtype=np.uint64, endpoint=True)
+
+    def scalar(fn, inputs):
+        def run():
+            for _ in range(iterations):
+                for bb in inputs:
+                    fn(bb)
+            return iterations * len(inputs)
+        return timed(run)
+
+    def vectorized(fn):
+        def run():
+            for _ in range(iterations):
+                fn(arr)
+            return iterations * arr.size
+        return timed(run)
+
+    return {
+        "lsb_bitscan_debruijn": scalar(bitboard.lsb_bitscan_numpy, numpy_bbs),
+        "lsb_bitscan": scalar(bitboard.lsb_bitscan, bbs),
+        "msb_bitscan_debruijn": scalar(bitboard.msb_bitscan_numpy, numpy_bbs),
+        "msb_bitscan": scalar(bitboard.msb_bitscan, bbs),
+        "pop_count_kernighan": scalar(bitboard.pop_count_numpy, numpy_bbs),
+        "pop_count": scalar(bitboard.pop_count, bbs),
+        "pop_count_array_bytes": vectorized(bitboard.pop_count_array_bytes),
+        "pop_count_array": vectorized(bitboard.pop_count_array),
+    }
+
+def run_benchmarks(settings, positions=POSITIONS):
+    results = {}
+    for name, fen in positions.items():
+        board = ChessBoard.from_fen(fen)
+        results[name] = {
+            "movegen": bench_movegen(board, settings["movegen"]),
+            "apply_move": bench_apply_move(board, settings["apply_move"]),
+            "evaluate": bench_evaluate(board, settings["evaluate"]),
+            "sliders_magic": bench_sliders(board, settings["sliders"]),
+            "sliders_first_rank": bench_sliders(board, settings["sliders"], magic=False),
+            "search": bench_search(board, settings["search_depth"]),
+            "search_full_width": bench_search(board, settings["search_depth"], FULL_WIDTH),
+            "perft": bench_perft(board, settings["perft_depth"]),
+        }
+    results["primitives"] = bench_primitives(settings["primitives"])
+    return {"backend": backend.NAME, "settings": settings, "results": results}
+
+
+def compare(report, baseline, threshold=DEFAULT_THRESHOLD):
+    """
+    Returns a list of (position, phase, baseline nps, nps) for every phase that got slower by more than threshold
+    Phases missing from either report are ignored
+    """
+    regressions = []
+    for name, phases in report["results"].items():
+        for phase, result in phases.items():
+            base = baseline.get("results", {}).get(name, {}).get(phase)
+            if base is None or base["nps"] <= 0:
+                continue
+            if result["nps"] < base["nps"] * (1 - threshold):
+                regressions.append((name, phase, base["nps"], result["nps"]))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Benchmark snakefish over a fixed set of positions")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations and shallower depths")
+    parser.add_argument("--output", help="write the JSON report to this file instead of stdout")
+    parser.add_argument("--baseline", help="JSON report from a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+            help="fractional drop in nodes per second that counts as a regression")
+    args = parser.parse_args(args)
+
+    report = run_benchmarks(SETTINGS["quick" if args.quick else "full"])
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        for name, phase, base_nps, nps in regressions:
+            print("REGRESSION %s/%s: %.0f -> %.0f nps" % (name, phase, base_nps, nps), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
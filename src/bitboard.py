@@ -1,9 +1,12 @@
 import numpy as np
+
+import backend
 from square import Square
 from constants import Rank, File
 
 """
-This file contains a variety of functions for manipulating bitboards (represented using uint64 in numpy)
+This file contains a variety of functions for manipulating bitboards (represented using uint64 in numpy,
+or masked Python ints, depending on the backend - see backend.py)
 
 Note that we use a little-endian rank-file mapping, i.e.:
 
@@ -20,7 +23,7 @@ where least to most significant bit ranges from 0 to 63.
 """
 
 # May want to move this to tables.py
-EMPTY_BB = np.uint64(0)
+EMPTY_BB = backend.BB(0)
 
 # Clever bit manipulation wizardry to count trailing/leading zeros
 # See https://www.chessprogramming.wikispaces.com/BitScan#Bitscan forward-De Bruijn Multiplication-With Isolated LS1B
@@ -49,10 +52,10 @@ msb_lookup = np.array(
          13, 18,  8, 12,  7,  6,  5, 63],
         dtype=np.uint8)
 
-def lsb_bitscan(bb):
+def lsb_bitscan_numpy(bb):
     return lsb_lookup[((bb & -bb) * debruijn) >> np.uint8(58)]
 
-def msb_bitscan(bb):
+def msb_bitscan_numpy(bb):
     bb |= bb >> np.uint8(1)
     bb |= bb >> np.uint8(2)
     bb |= bb >> np.uint8(4)
@@ -61,6 +64,29 @@ def msb_bitscan(bb):
     bb |= bb >> np.uint8(32)
     return msb_lookup[(bb * debruijn) >> np.uint8(58)]
 
+# Python ints know their own bit length, so no lookup is needed
+def lsb_bitscan_int(bb):
+    return (bb & -bb).bit_length() - 1
+
+def msb_bitscan_int(bb):
+    return bb.bit_length() - 1
+
+# Each numpy scalar operation costs far more than converting to an int once and using the int versions,
+# so these are what the numpy backend uses (the versions above are kept for computing tables and benchmarks)
+def lsb_bitscan_via_int(bb):
+    bb = int(bb)
+    return (bb & -bb).bit_length() - 1
+
+def msb_bitscan_via_int(bb):
+    return int(bb).bit_length() - 1
+
+if backend.NAME == backend.INT:
+    lsb_bitscan = lsb_bitscan_int
+    msb_bitscan = msb_bitscan_int
+else:
+    lsb_bitscan = lsb_bitscan_via_int
+    msb_bitscan = msb_bitscan_via_int
+
 
 # Generator that returns corresponding square for each bit set in the bitboard
 def occupied_squares(bb):
@@ -69,15 +95,34 @@ def occupied_squares(bb):
         yield lsb_square
         bb ^= lsb_square.to_bitboard()
 
+def occupied_indices(bb):
+    # Like occupied_squares, but yields plain int square indices
+    while bb != EMPTY_BB:
+        yield int(lsb_bitscan(bb))
+        bb &= bb - 1
+
 # Counts number of bits set using Kernighan's way
-# (may want to replace this with faster method)
-def pop_count(bb):
+def pop_count_numpy(bb):
     count = np.uint8(0)
     while bb != EMPTY_BB:
         count += np.uint8(1)
         bb &= bb - np.uint64(1)
     return count
 
+if hasattr(int, "bit_count"): # python 3.10+
+    pop_count_int = int.bit_count
+else:
+    def pop_count_int(bb):
+        return bin(bb).count("1")
+
+def pop_count_via_int(bb):
+    return pop_count_int(int(bb))
+
+if backend.NAME == backend.INT:
+    pop_count = pop_count_int
+else:
+    pop_count = pop_count_via_int
+
 def is_set(bb, sq):
     return (sq.to_bitboard() & bb) != EMPTY_BB
 
@@ -98,3 +143,26 @@ def clear_square(bb, sq):
 
 def set_square(bb, sq):
     return sq.to_bitboard() | bb
+
+# Number of bits set in each byte value, used to popcount whole arrays of bitboards at once
+BYTE_POP_COUNTS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def pop_count_array_bytes(arr):
+    """
+    Counts the bits set in each element of a uint64 array, by looking up each of its bytes
+    Returns an int32 array of the same shape
+    """
+    arr = np.ascontiguousarray(arr, dtype=np.uint64)
+    byte_counts = BYTE_POP_COUNTS[arr.view(np.uint8)]
+    return byte_counts.reshape(arr.shape + (8,)).sum(axis=-1, dtype=np.int32)
+
+def pop_count_array_native(arr):
+    """
+    Same as pop_count_array_bytes, using numpy's own popcount (numpy 2.0+), which is several times faster
+    """
+    return np.bitwise_count(np.asarray(arr, dtype=np.uint64)).astype(np.int32)
+
+if hasattr(np, "bitwise_count"):
+    pop_count_array = pop_count_array_native
+else:
+    pop_count_array = pop_count_array_bytes
@@ -0,0 +1,282 @@
+import argparse
+import os
+import re
+import struct
+import sys
+import numpy as np
+
+from chessboard import ChessBoard, START_FEN
+from constants import Piece
+import move
+import movegen
+
+"""
+Opening book: a sorted binary file of (position hash, move, weight) entries
+
+The file is a 16 byte header (magic, format version and the Zobrist hash of the starting position, which
+catches books built with different Zobrist keys) followed by three columns for n entries sorted by hash:
+n uint64 hashes, n uint16 moves, then n uint16 weights (12 bytes an entry). It's memory mapped rather than
+read, so opening even a large book is instant, and since the hashes are contiguous a lookup is a binary
+search that only touches the pages it needs.
+
+Usage: python book.py FILE... [--output FILE] [--plies N] [--min-count N]
+builds a book from PGN games (the first --plies moves of each) and EPD positions (their bm moves). A move's
+weight is the number of times it was seen. Games are followed until the first castling or en passant
+move, which the engine can't play.
+"""
+
+MAGIC = b"SFBK"
+BOOK_VERSION = 1
+HEADER = struct.Struct("<4sIQ")
+COLUMNS = [("keys", np.dtype("<u8")), ("move_codes", np.dtype("<u2")), ("weights", np.dtype("<u2"))]
+ENTRY_BYTES = sum(dtype.itemsize for _, dtype in COLUMNS)
+
+BOOK_PATH = os.environ.get("SNAKEFISH_BOOK",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "book.bin"))
+DEFAULT_PLIES = 20
+MAX_WEIGHT = 0xFFFF
+
+def start_key():
+    return int(ChessBoard.from_fen(START_FEN).hash)
+
+
+class OpeningBook(object):
+    def __init__(self, path):
+        """
+        Raises ValueError if path isn't a book, or was built with other Zobrist keys
+        """
+        with open(path, "rb") as f:
+            header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            raise ValueError("Not an opening book: %s" % path)
+        magic, version, key = HEADER.unpack(header)
+        if magic != MAGIC or version != BOOK_VERSION:
+            raise ValueError("Not an opening book, or an old format: %s" % path)
+        if key != start_key():
+            raise ValueError("Opening book was built with different Zobrist keys: %s" % path)
+        self.size = (os.path.getsize(path) - HEADER.size) // ENTRY_BYTES
+        offset = HEADER.size
+        for name, dtype in COLUMNS:
+            if self.size:
+                column = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=(self.size,))
+            else:
+                column = np.zeros(0, dtype=dtype) # np.memmap can't map an empty range
+            setattr(self, name, column)
+            offset += self.size * dtype.itemsize
+
+    def __len__(self):
+        return self.size
+
+    def moves(self, board):
+        """
+        Returns [(move, weight), ...] for the legal book moves of board, heaviest first
+        """
+        key = np.uint64(board.hash)
+        lo = np.searchsorted(self.keys, key, side="left")
+        hi = np.searchsorted(self.keys, key, side="right")
+        if lo == hi:
+            return []
+        info = movegen.CheckInfo(board)
+        found = zip(self.move_codes[lo:hi].tolist(), self.weights[lo:hi].tolist())
+        legal = [(m, w) for m, w in found # guards against hash collisions
+                if movegen.is_pseudo_legal(board, m) and info.is_legal(board, m)]
+        return sorted(legal, key=lambda mw: -mw[1])
+
+    def pick(self, board, rng=None):
+        """
+        Returns a book move for board, or None if it's out of book
+        With rng (a random.Random), moves are picked at random in proportion to their weights,
+        otherwise the heaviest one is
+        """
+        moves = self.moves(board)
+        if not moves:
+            return None
+        if rng is None:
+            return moves[0][0]
+        return rng.choices([m for m, _ in moves], weights=[w for _, w in moves])[0]
+
+def load_book(path=None):
+    """
+    Returns the OpeningBook at path (BOOK_PATH by default), or None if there's no such file
+    """
+    path = BOOK_PATH if path is None else path
+    if not path or not os.path.exists(path):
+        return None
+    return OpeningBook(path)
+
+def write_book(path, counts):
+    """
+    Writes a book from counts, a dict of (position hash, move) -> number of times seen
+    """
+    keys = np.array([key for key, _ in counts], dtype=np.uint64)
+    moves = np.array([m for _, m in counts], dtype=np.uint16)
+    weights = np.array([min(c, MAX_WEIGHT) for c in counts.values()], dtype=np.uint16)
+    order = np.lexsort((moves, keys))
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, BOOK_VERSION, start_key()))
+        for column, (_, dtype) in zip((keys, moves, weights), COLUMNS):
+            f.write(column[order].astype(dtype).tobytes())
+    os.replace(tmp, path)
+
+
+# PGN / EPD READING
+
+def parse_san(board, san):
+    """
+    Returns the legal move of board written san in Standard Algebraic Notation, e.g. Nf3, exd5, e8=Q+
+    Raises ValueError if there's no such move (castling never matches, since the engine doesn't have it)
+    """
+    text = san.rstrip("+#!?")
+    if text.startswith(("O-O", "0-0")):
+        raise ValueError("Castling isn't supported: %s" % san)
+    promo = None
+    if "=" in text:
+        text, p = text.split("=", 1)
+        promo = Piece.from_char(p.lower())
+    elif len(text) > 2 and text[-1] in "QRBN" and text[-2] in "18":
+        text, promo = text[:-1], Piece.from_char(text[-1].lower())
+    piece = Piece.PAWN
+    if text and text[0] in "NBRQK":
+        piece, text = Piece.from_char(text[0].lower()), text[1:]
+    text = text.replace("x", "").replace("-", "")
+    if len(text) < 2 or text[-2] not in "abcdefgh" or text[-1] not in "12345678":
+        raise ValueError("Bad move: %s" % san)
+    dest = 8 * (int(text[-1]) - 1) + "abcdefgh".index(text[-2])
+    hint = text[:-2] # disambiguating file and/or rank
+
+    candidates = []
+    for m in movegen.gen_legal_moves(board):
+        src = move.get_src(m)
+        if (move.get_dest(m) != dest or move.get_promo(m) != promo
+                or board.piece_at(src) != piece):
+            continue
+        src_file, src_rank = "abcdefgh"[src & 7], str(1 + (src >> 3))
+        if any(ch not in (src_file, src_rank) for ch in hint):
+            continue
+        candidates.append(m)
+    if len(candidates) != 1:
+        raise ValueError("%s move: %s" % ("Ambiguous" if candidates else "Illegal", san))
+    return candidates[0]
+
+def parse_move(board, text):
+    """
+    Accepts either coordinate notation (e2e4) or SAN
+    """
+    try:
+        m = move.from_uci(text)
+    except ValueError:
+        return parse_san(board, text)
+    if m not in movegen.gen_legal_moves(board):
+        raise ValueError("Illegal move: %s" % text)
+    return m
+
+RESULTS = {"1-0", "0-1", "1/2-1/2", "*"}
+MOVE_NUMBER = re.compile(r"^\d+\.+")
+
+def movetext_tokens(text):
+    """
+    Splits PGN movetext into SAN moves, dropping comments, variations, NAGs, move numbers and results
+    """
+    text = re.sub(r"\{[^}]*\}", " ", text)
+    text = re.sub(r";[^\n]*", " ", text)
+    flat, depth = [], 0
+    for ch in text:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth = max(depth - 1, 0)
+        elif depth == 0:
+            flat.append(ch)
+    moves = []
+    for token in "".join(flat).split():
+        token = MOVE_NUMBER.sub("", token)
+        if token and not token.startswith("$") and token not in RESULTS:
+            moves.append(token)
+    return moves
+
+def read_pgn(lines):
+    """
+    Yields (tags, moves) for each game in lines, tags being a dict and moves a list of SAN strings
+    """
+    tags, movetext = {}, []
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("["):
+            if movetext:
+                yield tags, movetext_tokens("\n".join(movetext))
+                tags, movetext = {}, []
+            match = re.match(r'\[(\w+)\s+"(.*)"\]', stripped)
+            if match:
+                tags[match.group(1)] = match.group(2)
+        elif stripped and not stripped.startswith("%"):
+            movetext.append(line)
+            if stripped.split()[-1] in RESULTS: # games without tags are only separated by their results
+                yield tags, movetext_tokens("\n".join(movetext))
+                tags, movetext = {}, []
+    if movetext:
+        yield tags, movetext_tokens("\n".join(movetext))
+
+def add_pgn(lines, counts, plies=DEFAULT_PLIES):
+    for tags, moves in read_pgn(lines):
+        try:
+            board = ChessBoard.from_fen(tags.get("FEN", START_FEN))
+        except ValueError:
+            continue
+        for san in moves[:plies]:
+            try:
+                m = parse_san(board, san)
+            except ValueError:
+                break
+            key = (int(board.hash), m)
+            counts[key] = counts.get(key, 0) + 1
+            board.make_move(m)
+
+def add_epd(lines, counts):
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            board, ops = ChessBoard.from_epd(line)
+        except ValueError:
+            continue
+        for text in ops.get("bm", "").split():
+            try:
+                m = parse_move(board, text)
+            except ValueError:
+                continue
+            key = (int(board.hash), m)
+            counts[key] = counts.get(key, 0) + 1
+
+def build(paths, plies=DEFAULT_PLIES, min_count=1):
+    """
+    Returns the (position hash, move) -> count dict for the given PGN and EPD files (told apart by extension)
+    Moves seen fewer than min_count times are left out
+    """
+    counts = {}
+    for path in paths:
+        with open(path) as f:
+            if path.lower().endswith(".epd"):
+                add_epd(f, counts)
+            else:
+                add_pgn(f, counts, plies)
+    return {k: c for k, c in counts.items() if c >= min_count}
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Build an opening book from PGN and EPD files")
+    parser.add_argument("files", nargs="+", help="PGN files, and EPD files (*.epd) with bm operations")
+    parser.add_argument("--output", default=BOOK_PATH, help="book file to write")
+    parser.add_argument("--plies", type=int, default=DEFAULT_PLIES, help="moves of each game to take")
+    parser.add_argument("--min-count", type=int, default=1, help="leave out moves seen fewer times")
+    args = parser.parse_args(args)
+
+    counts = build(args.files, args.plies, args.min_count)
+    write_book(args.output, counts)
+    print("Wrote %d entries for %d positions to %s" % (len(counts), len({k for k, _ in counts}), args.output))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,82 @@
 import numpy as np
 
+import backend
 import bitboard
+import tables
 from constants import Color, File, Rank, Piece
 from square import Square
 
+PIECES = tuple(Piece) # indexed by piece value, cheaper than calling Piece()
+
+START_FEN = "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w - - 0 1"
+COLOR_CHARS = ("w", "b") # indexed by Color
+EPD_STRING_OPCODES = {"id"} | {"c%d" % n for n in range(10)} # operands written in quotes
+
+def split_epd_operations(text):
+    """
+    Parses the operations after the first four fields of an EPD line, e.g. 'bm e4; id "test 1";'
+    Returns a dict of opcode -> operand string (quotes removed, several operands joined by spaces)
+    """
+    ops = {}
+    op = []
+    token = None # the token being read, None between tokens
+    quoted = False
+    for ch in text + ";":
+        if quoted:
+            if ch == '"':
+                quoted = False
+            else:
+                token += ch
+        elif ch == '"':
+            quoted = True
+            token = token or ""
+        elif ch.isspace() or ch == ";":
+            if token is not None:
+                op.append(token)
+                token = None
+            if ch == ";" and op:
+                ops[op[0]] = " ".join(op[1:])
+                op = []
+        else:
+            token = (token or "") + ch
+    if quoted:
+        raise ValueError("Unterminated string in EPD operations: %s" % text)
+    if op:
+        raise ValueError("EPD operation missing ';': %s" % text)
+    return ops
+
 class ChessBoard(object):
-    def __init__(self):
-        self.pieces = np.zeros((2,6), dtype=np.uint64) # 2 sides, 6 piece bitboards per side
-        self.combined_color = np.zeros(2, dtype=np.uint64) # Combined bitboard for all pieces of given side
-        self.combined_all = np.uint64(0) # Combined bitboard for all pieces on the board
+    """
+    Bitboards are kept in plain lists of backend.BB values (ints with the int backend), so reading one is
+    two list indexings rather than two numpy indexings
+
+    The mailbox is a 64 entry list of the Piece on each square (None if empty), which makes piece_at O(1)
+    It's kept up to date by every method that changes the board. Pass mailbox=False to do without it, in
+    which case piece_at tests the piece bitboards one by one
+    """
+    __slots__ = ("pieces", "combined_color", "combined_all", "color", "hash", "history",
+            "material", "psq", "mailbox")
+
+    def __init__(self, mailbox=True):
+        self.pieces = [[backend.BB(0)] * 6 for _ in Color] # 2 sides, 6 piece bitboards per side
+        self.combined_color = [backend.BB(0)] * 2 # Combined bitboard for all pieces of given side
+        self.combined_all = backend.BB(0) # Combined bitboard for all pieces on the board
         self.color = Color.WHITE # Color to move
+        self.hash = backend.BB(0) # Zobrist hash of the position, kept up to date by set_square / clear_square
+        self.history = [] # Undo stack for make_move / unmake_move
+        self.material = [0, 0] # Running material score per side, see tables.PIECE_VALUES
+        self.psq = [0, 0] # Running piece-square score per side, see tables.PIECE_SQUARE
+        self.mailbox = [None] * 64 if mailbox else None # Piece on each square, either color
+
+    def __eq__(self, other):
+        # Same position: the move history doesn't matter
+        if not isinstance(other, ChessBoard):
+            return NotImplemented
+        return (self.hash == other.hash and self.color == other.color
+                and self.pieces == other.pieces)
+
+    def __hash__(self):
+        return int(self.hash)
 
     def  __str__(self):
         board_str = []
@@ -37,12 +104,24 @@ class ChessBoard(object):
 
     def piece_on(self, sq, color=None):
         # NOTE: Defaults to current color
+        return self.piece_at(sq.index, color)
+
+    def piece_at(self, i, color=None):
+        """
+        Like piece_on, but takes a square index
+        """
         if color is None:
             color = self.color
-        return next(
-            (p for p in Piece if 
-                bitboard.is_set(self.get_piece_bb(p, color), sq)),
-            None)
+        sq_bb = tables.SQUARES[i]
+        if self.mailbox is not None:
+            if sq_bb & self.combined_color[color] == bitboard.EMPTY_BB:
+                return None
+            return self.mailbox[i]
+        pieces = self.pieces[color]
+        for p in Piece:
+            if pieces[p] & sq_bb != bitboard.EMPTY_BB:
+                return p
+        return None
 
     def set_square(self, sq, piece, color=None):
         # NOTE: Defaults to current color
@@ -55,6 +134,11 @@ class ChessBoard(object):
         self.pieces[color][piece] = bitboard.set_square(piece_bb, sq)
         self.combined_color[color] = bitboard.set_square(combined_bb, sq)
         self.combined_all = bitboard.set_square(all_bb, sq)
+        self.hash ^= tables.ZOBRIST_PIECES[color][piece][sq.index]
+        self.material[color] += tables.PIECE_VALUES[piece]
+        self.psq[color] += tables.PIECE_SQUARE[piece][sq.index]
+        if self.mailbox is not None:
+            self.mailbox[sq.index] = piece
 
     def clear_square(self, sq, color=None):
         # NOTE: Defaults to current color
@@ -72,44 +156,323 @@ class ChessBoard(object):
         self.pieces[color][piece] = bitboard.clear_square(piece_bb, sq)
         self.combined_color[color] = bitboard.clear_square(combined_bb, sq)
         self.combined_all = bitboard.clear_square(all_bb, sq)
+        self.hash ^= tables.ZOBRIST_PIECES[color][piece][sq.index]
+        self.material[color] -= tables.PIECE_VALUES[piece]
+        self.psq[color] -= tables.PIECE_SQUARE[piece][sq.index]
+        if self.mailbox is not None:
+            self.mailbox[sq.index] = None
+
+    def copy(self):
+        """
+        Returns a copy of the position, with an empty move history
+        """
+        board = ChessBoard.__new__(ChessBoard)
+        board.pieces = [self.pieces[Color.WHITE][:], self.pieces[Color.BLACK][:]]
+        board.combined_color = self.combined_color[:]
+        board.combined_all = self.combined_all
+        board.color = self.color
+        board.hash = self.hash
+        board.history = []
+        board.material = self.material[:]
+        board.psq = self.psq[:]
+        board.mailbox = self.mailbox[:] if self.mailbox is not None else None
+        return board
 
     def apply_move(self, move):
         """
-        Applies move to chess board
+        Applies move (an int, see move.py) to chess board
         Returns a new board, doesn't modify original
         """
-        new_board = ChessBoard()
-        new_board.pieces = np.copy(self.pieces)
-        new_board.combined_color = np.copy(self.combined_color)
-        new_board.combined_all = np.copy(self.combined_all)
-        new_board.color = self.color
-
-        piece = self.piece_on(move.src)
-        new_board.clear_square(move.src)
-        new_board.clear_square(move.dest, ~new_board.color) # in event of a capture
-        new_board.set_square(move.dest, piece if move.promo is None else move.promo)
-        
-        new_board.color = ~new_board.color
+        new_board = self.copy()
+        new_board.make_move(move)
+        new_board.history.pop()
         return new_board
 
+    def make_move(self, move):
+        """
+        Applies move (an int, see move.py) to chess board in place
+        Pushes what's needed to undo it onto the history stack, see unmake_move
+        """
+        color = self.color
+        opp_color = ~color
+        src = move & 63
+        dest = (move >> 6) & 63
+        src_bb = tables.SQUARES[src]
+        dest_bb = tables.SQUARES[dest]
+
+        mailbox = self.mailbox
+        if mailbox is not None:
+            # dest can't hold a piece of the side to move
+            piece = mailbox[src]
+            captured = mailbox[dest]
+            mailbox[src] = None
+        else:
+            piece = self.piece_at(src, color)
+            captured = None
+            if dest_bb & self.combined_color[opp_color] != bitboard.EMPTY_BB:
+                captured = self.piece_at(dest, opp_color)
+        placed = PIECES[move >> 12] if move >> 12 else piece
+        if mailbox is not None:
+            mailbox[dest] = placed
+        self.history.append((move, piece, captured, self.hash))
+
+        self.pieces[color][piece] ^= src_bb
+        self.pieces[color][placed] ^= dest_bb
+        self.combined_color[color] ^= src_bb | dest_bb
+        h = self.hash ^ tables.ZOBRIST_PIECES[color][piece][src] \
+                ^ tables.ZOBRIST_PIECES[color][placed][dest] \
+                ^ tables.ZOBRIST_BLACK_TO_MOVE
+        if captured is None:
+            self.combined_all ^= src_bb | dest_bb
+        else:
+            self.pieces[opp_color][captured] ^= dest_bb
+            self.combined_color[opp_color] ^= dest_bb
+            self.combined_all ^= src_bb
+            h ^= tables.ZOBRIST_PIECES[opp_color][captured][dest]
+            self.material[opp_color] -= tables.PIECE_VALUES[captured]
+            self.psq[opp_color] -= tables.PIECE_SQUARE[captured][dest]
+        self.hash = h
+        self.psq[color] += tables.PIECE_SQUARE[placed][dest] - tables.PIECE_SQUARE[piece][src]
+        if placed != piece:
+            self.material[color] += tables.PIECE_VALUES[placed] - tables.PIECE_VALUES[piece]
+        self.color = opp_color
+
+    def make_null_move(self):
+        """
+        Passes the turn to the other side, for null move pruning in the search
+        Undone with unmake_move like any other move
+        """
+        self.history.append((None, None, None, self.hash))
+        self.hash ^= tables.ZOBRIST_BLACK_TO_MOVE
+        self.color = ~self.color
+
+    def unmake_move(self):
+        """
+        Undoes the last move made with make_move (or make_null_move)
+        Returns the move that was undone (None for a null move)
+        """
+        move, piece, captured, h = self.history.pop()
+        if move is None:
+            self.hash = h
+            self.color = ~self.color
+            return None
+        opp_color = self.color
+        color = ~opp_color
+        src = move & 63
+        dest = (move >> 6) & 63
+        src_bb = tables.SQUARES[src]
+        dest_bb = tables.SQUARES[dest]
+        placed = PIECES[move >> 12] if move >> 12 else piece
+        if self.mailbox is not None:
+            self.mailbox[src] = piece
+            self.mailbox[dest] = captured
+
+        self.pieces[color][piece] ^= src_bb
+        self.pieces[color][placed] ^= dest_bb
+        self.combined_color[color] ^= src_bb | dest_bb
+        if captured is None:
+            self.combined_all ^= src_bb | dest_bb
+        else:
+            self.pieces[opp_color][captured] ^= dest_bb
+            self.combined_color[opp_color] ^= dest_bb
+            self.combined_all ^= src_bb
+            self.material[opp_color] += tables.PIECE_VALUES[captured]
+            self.psq[opp_color] += tables.PIECE_SQUARE[captured][dest]
+        self.psq[color] -= tables.PIECE_SQUARE[placed][dest] - tables.PIECE_SQUARE[piece][src]
+        if placed != piece:
+            self.material[color] -= tables.PIECE_VALUES[placed] - tables.PIECE_VALUES[piece]
+        self.hash = h
+        self.color = color
+        return move
+
+    def compute_hash(self):
+        """
+        Computes the Zobrist hash of the board from scratch
+        Only needed when bitboards are assigned directly, otherwise the hash is updated incrementally
+        """
+        h = backend.BB(0)
+        for c in Color:
+            for p in Piece:
+                for i in bitboard.occupied_indices(self.pieces[c][p]):
+                    h ^= tables.ZOBRIST_PIECES[c][p][i]
+        if self.color == Color.BLACK:
+            h ^= tables.ZOBRIST_BLACK_TO_MOVE
+        return h
+
+    def compute_scores(self):
+        """
+        Computes material and psq from scratch
+        Like compute_hash, only needed when bitboards are assigned directly
+        """
+        self.material = [0, 0]
+        self.psq = [0, 0]
+        for c in Color:
+            for p in Piece:
+                for i in bitboard.occupied_indices(self.pieces[c][p]):
+                    self.material[c] += tables.PIECE_VALUES[p]
+                    self.psq[c] += tables.PIECE_SQUARE[p][i]
+
+    def compute_mailbox(self):
+        """
+        Fills in the mailbox from scratch
+        Like compute_hash, only needed when bitboards are assigned directly
+        """
+        if self.mailbox is None:
+            return
+        self.mailbox = [None] * 64
+        for c in Color:
+            for p in Piece:
+                for i in bitboard.occupied_indices(self.pieces[c][p]):
+                    self.mailbox[i] = p
+
+    def to_tuple(self):
+        """
+        Returns the position as a tuple of plain ints: the 12 piece bitboards (white then black) and the color to move
+        Much cheaper to send to another process than the board itself
+        """
+        return tuple(int(self.pieces[c][p]) for c in Color for p in Piece) + (int(self.color),)
+
+    @classmethod
+    def from_tuple(cls, position):
+        """
+        Inverse of to_tuple
+        """
+        board = cls()
+        for c in Color:
+            for p in Piece:
+                board.pieces[c][p] = backend.BB(position[6*c + p])
+                board.combined_color[c] |= board.pieces[c][p]
+        board.combined_all = board.combined_color[Color.WHITE] | board.combined_color[Color.BLACK]
+        board.color = Color(position[12])
+        board.hash = board.compute_hash()
+        board.compute_scores()
+        board.compute_mailbox()
+        return board
+
+
+    @classmethod
+    def from_fen(cls, fen):
+        """
+        Parses a position in Forsyth-Edwards Notation
+        The engine has no castling or en passant, so those fields are checked but otherwise ignored,
+        as are the move counters (which may be left out, as in EPD)
+        Raises ValueError if fen is malformed
+        """
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError("FEN needs 4 or 6 fields: %s" % fen)
+        placement, color, castling, ep = fields[:4]
+        if color not in COLOR_CHARS:
+            raise ValueError("Bad side to move in FEN: %s" % fen)
+        if castling != "-" and not set(castling) <= set("KQkq"):
+            raise ValueError("Bad castling rights in FEN: %s" % fen)
+        if ep != "-" and not (len(ep) == 2 and ep[0] in "abcdefgh" and ep[1] in "36"):
+            raise ValueError("Bad en passant square in FEN: %s" % fen)
+        if len(fields) == 6 and not (fields[4].isdigit() and fields[5].isdigit()):
+            raise ValueError("Bad move counters in FEN: %s" % fen)
+
+        rows = placement.split("/")
+        if len(rows) != 8:
+            raise ValueError("FEN placement needs 8 ranks: %s" % fen)
+        bbs = [0] * 12
+        for r, row in enumerate(reversed(rows)):
+            f = 0
+            for ch in row:
+                if ch in "12345678":
+                    f += int(ch)
+                    continue
+                if f > 7:
+                    raise ValueError("FEN rank %d has more than 8 files: %s" % (r + 1, fen))
+                color_offset = 0 if ch.isupper() else 6
+                bbs[color_offset + Piece.from_char(ch.lower())] |= 1 << (8*r + f)
+                f += 1
+            if f != 8:
+                raise ValueError("FEN rank %d doesn't have 8 files: %s" % (r + 1, fen))
+        if bitboard.pop_count_int(bbs[Piece.KING]) != 1 or bitboard.pop_count_int(bbs[6 + Piece.KING]) != 1:
+            raise ValueError("FEN needs one king per side: %s" % fen)
+        return cls.from_tuple(tuple(bbs) + (COLOR_CHARS.index(color),))
+
+    def to_fen(self):
+        """
+        Inverse of from_fen, with no castling rights or en passant square and the move counters reset
+        """
+        return "%s 0 1" % self.fen_fields()
+
+    def fen_fields(self):
+        """
+        The first four fields of the FEN (placement, side to move, castling, en passant), as used in EPD
+        """
+        rows = []
+        for r in reversed(range(8)):
+            row = []
+            empty = 0
+            for f in range(8):
+                i = 8*r + f
+                white_piece = self.piece_at(i, Color.WHITE)
+                black_piece = self.piece_at(i, Color.BLACK)
+                if white_piece is None and black_piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    row.append(str(empty))
+                    empty = 0
+                if white_piece is not None:
+                    row.append(white_piece.to_char().upper())
+                else:
+                    row.append(black_piece.to_char())
+            if empty:
+                row.append(str(empty))
+            rows.append("".join(row))
+        return "%s %s - -" % ("/".join(rows), COLOR_CHARS[self.color])
+
+    @classmethod
+    def from_epd(cls, epd):
+        """
+        Parses a line of Extended Position Description
+        Returns (board, ops) where ops is a dict of opcode -> operand string, see split_epd_operations
+        """
+        fields = epd.split(None, 4)
+        if len(fields) < 4:
+            raise ValueError("EPD needs at least 4 fields: %s" % epd)
+        board = cls.from_fen(" ".join(fields[:4]))
+        ops = split_epd_operations(fields[4]) if len(fields) > 4 else {}
+        return board, ops
+
+    def to_epd(self, ops=None):
+        """
+        Inverse of from_epd, ops being a dict of opcode -> operand (written with str, None for no operand)
+        """
+        parts = [self.fen_fields()]
+        for opcode, operand in (ops or {}).items():
+            if operand is None or operand == "":
+                parts.append("%s;" % opcode)
+            elif opcode in EPD_STRING_OPCODES:
+                parts.append('%s "%s";' % (opcode, operand))
+            else:
+                parts.append("%s %s;" % (opcode, operand))
+        return " ".join(parts)
 
     def init_game(self):
-        self.pieces[Color.WHITE][Piece.PAWN] = np.uint64(0x000000000000FF00)
-        self.pieces[Color.WHITE][Piece.KNIGHT] = np.uint64(0x0000000000000042)
-        self.pieces[Color.WHITE][Piece.BISHOP] = np.uint64(0x0000000000000024)
-        self.pieces[Color.WHITE][Piece.ROOK] = np.uint64(0x0000000000000081)
-        self.pieces[Color.WHITE][Piece.QUEEN] = np.uint64(0x0000000000000008)
-        self.pieces[Color.WHITE][Piece.KING] = np.uint64(0x0000000000000010)
-
-        self.pieces[Color.BLACK][Piece.PAWN] = np.uint64(0x00FF000000000000)
-        self.pieces[Color.BLACK][Piece.KNIGHT] = np.uint64(0x4200000000000000)
-        self.pieces[Color.BLACK][Piece.BISHOP] = np.uint64(0x2400000000000000)
-        self.pieces[Color.BLACK][Piece.ROOK] = np.uint64(0x8100000000000000)
-        self.pieces[Color.BLACK][Piece.QUEEN] = np.uint64(0x0800000000000000)
-        self.pieces[Color.BLACK][Piece.KING] = np.uint64(0x1000000000000000)
+        self.pieces[Color.WHITE][Piece.PAWN] = backend.BB(0x000000000000FF00)
+        self.pieces[Color.WHITE][Piece.KNIGHT] = backend.BB(0x0000000000000042)
+        self.pieces[Color.WHITE][Piece.BISHOP] = backend.BB(0x0000000000000024)
+        self.pieces[Color.WHITE][Piece.ROOK] = backend.BB(0x0000000000000081)
+        self.pieces[Color.WHITE][Piece.QUEEN] = backend.BB(0x0000000000000008)
+        self.pieces[Color.WHITE][Piece.KING] = backend.BB(0x0000000000000010)
+
+        self.pieces[Color.BLACK][Piece.PAWN] = backend.BB(0x00FF000000000000)
+        self.pieces[Color.BLACK][Piece.KNIGHT] = backend.BB(0x4200000000000000)
+        self.pieces[Color.BLACK][Piece.BISHOP] = backend.BB(0x2400000000000000)
+        self.pieces[Color.BLACK][Piece.ROOK] = backend.BB(0x8100000000000000)
+        self.pieces[Color.BLACK][Piece.QUEEN] = backend.BB(0x0800000000000000)
+        self.pieces[Color.BLACK][Piece.KING] = backend.BB(0x1000000000000000)
 
         for p in Piece:
             for c in Color:
                 self.combined_color[c] |= self.pieces[c][p]
 
         self.combined_all = self.combined_color[Color.WHITE] | self.combined_color[Color.BLACK]
+
+        self.hash = self.compute_hash()
+        self.compute_scores()
+        self.compute_mailbox()
@@ -1,4 +1,5 @@
-from enum import IntEnum
+from enum import Enum, IntEnum
+import numpy as np
 
 class Color(IntEnum):
     WHITE = 0
@@ -33,6 +34,16 @@ class Piece(IntEnum):
         elif self == Piece.KING:
             return 'k'
 
+    @classmethod
+    def from_char(cls, ch):
+        """
+        Inverse of to_char
+        """
+        for p in cls:
+            if p.to_char() == ch:
+                return p
+        raise ValueError("Unknown piece: %s" % ch)
+
 class Rank(IntEnum):
     ONE = 0
     TWO = 1
@@ -52,3 +63,15 @@ class File(IntEnum):
     F = 5
     G = 6
     H = 7
+
+
+class Score(Enum):
+    PAWN = np.int32(100)
+    KNIGHT = np.int32(300)
+    BISHOP = np.int32(300)
+    ROOK = np.int32(500)
+    QUEEN = np.int32(900)
+    CHECKMATE = np.int32(-1000000)
+    DRAW = np.int32(0)
+    CENTER = np.int32(5)
+    MOVE = np.int32(5)
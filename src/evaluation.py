@@ -1,41 +1,145 @@
-from enum import Enum
 import numpy as np
 
 from chessboard import ChessBoard
-from constants import Piece
+from constants import Color, File, Piece, Rank, Score
 import tables
 import bitboard
 import movegen
 
-class Score(Enum):
-    PAWN = np.int32(100)
-    KNIGHT = np.int32(300)
-    BISHOP = np.int32(300)
-    ROOK = np.int32(500)
-    QUEEN = np.int32(900)
-    CHECKMATE = np.int32(-1000000)
-    CENTER = np.int32(5)
-    MOVE = np.int32(5)
-
 def evaluate(board):
     return eval_pieces(board) + eval_center(board) + eval_moves(board)
 
-def piece_diff(board, piece):
-    return np.int32(bitboard.pop_count(board.pieces[board.color][piece])) - np.int32(bitboard.pop_count(board.pieces[~board.color][piece]))
-
 def eval_pieces(board):
-    return (Score.PAWN.value * piece_diff(board, Piece.PAWN)
-        + Score.KNIGHT.value * piece_diff(board, Piece.KNIGHT)
-        + Score.BISHOP.value * piece_diff(board, Piece.BISHOP)
-        + Score.ROOK.value * piece_diff(board, Piece.ROOK)
-        + Score.QUEEN.value * piece_diff(board, Piece.QUEEN))
+    # material is kept up to date by ChessBoard as pieces are placed and captured
+    return board.material[board.color] - board.material[~board.color]
 
 def eval_center(board):
-    return Score.CENTER.value * bitboard.pop_count(board.combined_color[board.color] & tables.CENTER)
+    return board.psq[board.color]
 
 def eval_moves(board):
-    num = len(list(movegen.gen_legal_moves(board)))
-    if num == 0:
-        return Score.CHECKMATE.value
-    else:
-        return Score.MOVE.value * np.int32(num)
+    return Score.MOVE.value * np.int32(mobility(board))
+
+def mobility(board):
+    """
+    Number of pseudo-legal moves of the side to move, counted straight from the moveset bitboards
+    Moves that leave the king in check are included and a promotion counts once, but no Move objects are
+    generated, which makes this far cheaper than generating legal moves at every leaf
+    Positions without legal moves (checkmate / stalemate) are left to the search
+    """
+    count = 0
+    for p in Piece:
+        for i in bitboard.occupied_indices(board.pieces[board.color][p]):
+            count += bitboard.pop_count(movegen.get_moves_bb(i, board, p))
+    return count
+
+
+# Batch evaluation
+# Scores many positions in one go, so numpy's per-call overhead is spread over the whole batch
+
+PIECE_SCORES = np.array(tables.PIECE_VALUES, dtype=np.int32)
+
+NOT_A_FILE = ~np.uint64(int(tables.FILES[File.A]))
+NOT_H_FILE = ~np.uint64(int(tables.FILES[File.H]))
+CENTER_BB = np.uint64(int(tables.CENTER))
+RANK_3 = np.uint64(int(tables.RANKS[Rank.THREE]))
+RANK_6 = np.uint64(int(tables.RANKS[Rank.SIX]))
+
+# (shift, mask applied after shifting to stop wrapping around the board)
+NORTH = (8, ~np.uint64(0))
+SOUTH = (-8, ~np.uint64(0))
+EAST = (1, NOT_A_FILE)
+WEST = (-1, NOT_H_FILE)
+NORTH_EAST = (9, NOT_A_FILE)
+NORTH_WEST = (7, NOT_H_FILE)
+SOUTH_EAST = (-7, NOT_A_FILE)
+SOUTH_WEST = (-9, NOT_H_FILE)
+
+KNIGHT_DIRS = [(17, NOT_A_FILE), (15, NOT_H_FILE), (-15, NOT_A_FILE), (-17, NOT_H_FILE),
+        (10, NOT_A_FILE & (NOT_A_FILE << np.uint64(1))), (6, NOT_H_FILE & (NOT_H_FILE >> np.uint64(1))),
+        (-6, NOT_A_FILE & (NOT_A_FILE << np.uint64(1))), (-10, NOT_H_FILE & (NOT_H_FILE >> np.uint64(1)))]
+KING_DIRS = [NORTH, SOUTH, EAST, WEST, NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST]
+BISHOP_DIRS = [NORTH_EAST, NORTH_WEST, SOUTH_EAST, SOUTH_WEST]
+ROOK_DIRS = [NORTH, SOUTH, EAST, WEST]
+
+def shift(arr, direction):
+    s, mask = direction
+    if s > 0:
+        return (arr << np.uint64(s)) & mask
+    return (arr >> np.uint64(-s)) & mask
+
+def slider_attacks(sliders, empty, directions):
+    """
+    Kogge-Stone occluded fill: union of squares attacked by the sliders in the given directions
+    """
+    attacks = np.zeros_like(sliders)
+    for d in directions:
+        s, mask = d
+        gen = sliders
+        pro = empty & mask
+        for step in (1, 2, 4):
+            ds = (s * step, np.uint64(0xFFFFFFFFFFFFFFFF))
+            gen = gen | (pro & shift(gen, ds))
+            pro = pro & shift(pro, ds)
+        attacks |= shift(gen, d)
+    return attacks
+
+def mobility_batch(own, own_occ, opp_occ, colors):
+    """
+    Approximate mobility: counts squares attacked (or pushed to) by each piece type
+    Squares reached by several pieces of the same type are only counted once, and legality is ignored
+    """
+    occ = own_occ | opp_occ
+    empty = ~occ
+    targets = ~own_occ
+
+    pawns = own[:, Piece.PAWN]
+    white = colors == Color.WHITE
+    pushes = np.where(white, shift(pawns, NORTH), shift(pawns, SOUTH)) & empty
+    double_pushes = np.where(white,
+            shift(pushes & RANK_3, NORTH),
+            shift(pushes & RANK_6, SOUTH)) & empty
+    captures = np.where(white,
+            shift(pawns, NORTH_EAST) | shift(pawns, NORTH_WEST),
+            shift(pawns, SOUTH_EAST) | shift(pawns, SOUTH_WEST)) & opp_occ
+
+    knights = np.zeros_like(pawns)
+    for d in KNIGHT_DIRS:
+        knights |= shift(own[:, Piece.KNIGHT], d)
+    king = np.zeros_like(pawns)
+    for d in KING_DIRS:
+        king |= shift(own[:, Piece.KING], d)
+
+    queens = own[:, Piece.QUEEN]
+    diagonal = slider_attacks(own[:, Piece.BISHOP] | queens, empty, BISHOP_DIRS)
+    straight = slider_attacks(own[:, Piece.ROOK] | queens, empty, ROOK_DIRS)
+
+    attacked = np.stack([pushes, double_pushes, captures, knights & targets, king & targets,
+        diagonal & targets, straight & targets], axis=1)
+    return bitboard.pop_count_array(attacked).sum(axis=1)
+
+def evaluate_batch(pieces, colors=None):
+    """
+    pieces is an N x 2 x 6 uint64 array of piece bitboards (indexed like ChessBoard.pieces)
+    colors is a length N array with the side to move in each position, defaults to white
+    Returns an array of N scores, each from the point of view of the side to move
+
+    Unlike evaluate, mobility counts each square once per piece type rather than once per piece
+    As with evaluate, positions without legal moves must be handled by the search
+    """
+    pieces = np.asarray(pieces, dtype=np.uint64)
+    n = pieces.shape[0]
+    if colors is None:
+        colors = np.zeros(n, dtype=np.intp)
+    colors = np.asarray(colors, dtype=np.intp)
+    rows = np.arange(n)
+    own = pieces[rows, colors]
+    opp = pieces[rows, 1 - colors]
+
+    counts = bitboard.pop_count_array(own) - bitboard.pop_count_array(opp)
+    material = counts @ PIECE_SCORES
+
+    own_occ = np.bitwise_or.reduce(own, axis=1)
+    opp_occ = np.bitwise_or.reduce(opp, axis=1)
+    center = Score.CENTER.value * bitboard.pop_count_array(own_occ & CENTER_BB)
+    mobility = Score.MOVE.value * mobility_batch(own, own_occ, opp_occ, colors)
+    return (material + center + mobility).astype(np.int32)
@@ -1,8 +1,16 @@
+import random
+
+from book import load_book
 from chessboard import ChessBoard
+import move
 from move import Move
 from square import Square
 from constants import Piece
 import search
+from tablebase import load_tablebases
+from transposition import TranspositionTable
+
+MOVE_TIME = 5.0 # seconds the engine spends per move
 
 
 def get_move():
@@ -12,13 +20,17 @@ def get_move():
     promo_piece = next(
             (p for p in Piece if p.to_char() == promo),
             None)
-    return Move(Square.from_str(src), Square.from_str(dest), promo_piece)
+    return Move(Square.from_str(src), Square.from_str(dest), promo_piece).to_int()
 
 def main():
     # NOTE: currently doesn't validate move or stop at checkmate, just plays
     # This is really just for generating example game gif
     board = ChessBoard()
     board.init_game()
+    tt = TranspositionTable() # kept across moves so earlier searches aren't wasted
+    book = load_book() # None if there's no book file, see book.py
+    rng = random.Random()
+    options = search.SearchOptions(tablebases=load_tablebases()) # likewise, see tablebase.py
     print("Initial board")
     print("\n")
     print(board)
@@ -34,8 +46,12 @@ def main():
         print(board)
         print("\n")
 
-        engine_move = search.best_move(board, 3)
-        print(engine_move)
+        engine_move = book.pick(board, rng) if book is not None else None
+        if engine_move is not None:
+            print("%s (book)" % move.to_str(engine_move))
+        else:
+            engine_move, _, _ = search.limited_search(board, time_limit=MOVE_TIME, tt=tt, options=options)
+            print(move.to_str(engine_move))
         board = board.apply_move(engine_move)
         print("\n")
         print("Board is now:")
@@ -1,3 +1,58 @@
+from constants import Piece
+from square import Square
+
+"""
+The engine passes moves around as plain ints rather than Move objects, so that generating and making
+a move doesn't allocate anything: src in bits 0-5, dest in bits 6-11, promo piece in bits 12-14 (0 for none)
+There's no castling or en passant, so a promotion is the only special move and needs no separate flags
+
+Move is kept for reading moves in and printing them, see Move.to_int / Move.from_int
+"""
+
+NO_MOVE = 0 # a move from A1 to A1, which can't be legal
+
+def encode(src, dest, promo=None):
+    """
+    src and dest are square indices, promo the Piece promoted to if any
+    """
+    return src | (dest << 6) | ((0 if promo is None else int(promo)) << 12)
+
+def get_src(move):
+    return move & 63
+
+def get_dest(move):
+    return (move >> 6) & 63
+
+def get_promo(move):
+    promo = move >> 12
+    return Piece(promo) if promo else None
+
+def to_str(move):
+    return str(Move.from_int(move))
+
+def to_uci(move):
+    """
+    Coordinate notation, as used by UCI and in our EPD output: e.g. e2e4, or e7e8q for a promotion
+    """
+    src, dest, promo = move & 63, (move >> 6) & 63, move >> 12
+    uci = "%s%d%s%d" % ("abcdefgh"[src & 7], 1 + (src >> 3), "abcdefgh"[dest & 7], 1 + (dest >> 3))
+    return uci + Piece(promo).to_char() if promo else uci
+
+def from_uci(uci):
+    """
+    Inverse of to_uci, raises ValueError if uci isn't a well formed move (legality isn't checked)
+    """
+    if (len(uci) not in (4, 5) or uci[0] not in "abcdefgh" or uci[1] not in "12345678"
+            or uci[2] not in "abcdefgh" or uci[3] not in "12345678"):
+        raise ValueError("Bad move: %s" % uci)
+    src = 8 * (int(uci[1]) - 1) + "abcdefgh".index(uci[0])
+    dest = 8 * (int(uci[3]) - 1) + "abcdefgh".index(uci[2])
+    promo = Piece.from_char(uci[4]) if len(uci) == 5 else None
+    if promo in (Piece.PAWN, Piece.KING):
+        raise ValueError("Bad promotion: %s" % uci)
+    return encode(src, dest, promo)
+
+
 class Move(object):
     def __init__(self, src, dest, promo=None):
         """
@@ -16,3 +71,19 @@ class Move(object):
             return "%s -> %s" % (str(self.src), str(self.dest))
 
 
+
+    def __eq__(self, other):
+        return isinstance(other, Move) and self.to_int() == other.to_int()
+
+    def __hash__(self):
+        return self.to_int()
+
+    def to_int(self):
+        """
+        Packs move into the 16 bit int used by the engine (see above)
+        """
+        return encode(int(self.src.index), int(self.dest.index), self.promo)
+
+    @classmethod
+    def from_int(cls, code):
+        return cls(Square(get_src(code)), Square(get_dest(code)), get_promo(code))
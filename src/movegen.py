@@ -1,11 +1,12 @@
+import array
 import itertools
+import time
 import numpy as np
 
+import backend
 import tables
 import bitboard
 from constants import Rank, File, Color, Piece
-from move import Move
-from square import Square
 from chessboard import ChessBoard
 
 
@@ -64,96 +65,346 @@ def get_file_moves_bb(i, occ):
     return (tables.FILES[File.H] & occ) >> (f ^ np.uint8(7))
 
 
+if backend.NAME == backend.INT:
+    # Same lookups with Python ints, which don't wrap on overflow so products are masked back to 64 bits
+    # (products that are immediately ANDed with a mask are already in range)
+    FULL_BB = backend.FULL_BB
+
+    def get_diag_moves_bb(i, occ):
+        f = i & 7
+        occ = tables.DIAG_MASKS[i] & occ
+        occ = ((tables.FILES[File.A] * occ) & FULL_BB) >> 56
+        return tables.DIAG_MASKS[i] & (tables.FILES[File.A] * tables.FIRST_RANK_MOVES[f][occ])
+
+    def get_antidiag_moves_bb(i, occ):
+        f = i & 7
+        occ = tables.ANTIDIAG_MASKS[i] & occ
+        occ = ((tables.FILES[File.A] * occ) & FULL_BB) >> 56
+        return tables.ANTIDIAG_MASKS[i] & (tables.FILES[File.A] * tables.FIRST_RANK_MOVES[f][occ])
+
+    def get_rank_moves_bb(i, occ):
+        f = i & 7
+        occ = tables.RANK_MASKS[i] & occ
+        occ = ((tables.FILES[File.A] * occ) & FULL_BB) >> 56
+        return tables.RANK_MASKS[i] & (tables.FILES[File.A] * tables.FIRST_RANK_MOVES[f][occ])
+
+    def get_file_moves_bb(i, occ):
+        f = i & 7
+        occ = tables.FILES[File.A] & (occ >> f)
+        occ = ((tables.A1H8_DIAG * occ) & FULL_BB) >> 56
+        first_rank_index = (i ^ 56) >> 3
+        occ = tables.A1H8_DIAG * tables.FIRST_RANK_MOVES[first_rank_index][occ]
+        return (tables.FILES[File.H] & occ) >> (f ^ 7)
+
+
+# Magic bitboard lookups (see tables.py), one per slider instead of one per line
+
+def get_bishop_attacks_bb(i, occ):
+    """
+    i is index of square
+    occ is the combined occupancy of the board
+    """
+    return tables.BISHOP_ATTACKS[tables.BISHOP_OFFSETS[i]
+            + (((occ & tables.BISHOP_MASKS[i]) * tables.BISHOP_MAGICS[i]) >> tables.BISHOP_SHIFTS[i])]
+
+def get_rook_attacks_bb(i, occ):
+    return tables.ROOK_ATTACKS[tables.ROOK_OFFSETS[i]
+            + (((occ & tables.ROOK_MASKS[i]) * tables.ROOK_MAGICS[i]) >> tables.ROOK_SHIFTS[i])]
+
+if backend.NAME == backend.INT:
+    def get_bishop_attacks_bb(i, occ):
+        return tables.BISHOP_ATTACKS[tables.BISHOP_OFFSETS[i]
+                + ((((occ & tables.BISHOP_MASKS[i]) * tables.BISHOP_MAGICS[i]) & FULL_BB) >> tables.BISHOP_SHIFTS[i])]
+
+    def get_rook_attacks_bb(i, occ):
+        return tables.ROOK_ATTACKS[tables.ROOK_OFFSETS[i]
+                + ((((occ & tables.ROOK_MASKS[i]) * tables.ROOK_MAGICS[i]) & FULL_BB) >> tables.ROOK_SHIFTS[i])]
+
+
 # Moveset functions for each piece
+# Squares are given by index, and moves are generated as ints (see move.py)
 
-def get_king_moves_bb(sq, board):
-    return tables.KING_MOVES[sq.index] & ~board.combined_color[board.color]
+def get_king_moves_bb(i, board):
+    return tables.KING_MOVES[i] & ~board.combined_color[board.color]
 
-def get_knight_moves_bb(sq, board):
-    return tables.KNIGHT_MOVES[sq.index] & ~board.combined_color[board.color]
+def get_knight_moves_bb(i, board):
+    return tables.KNIGHT_MOVES[i] & ~board.combined_color[board.color]
 
-def get_pawn_moves_bb(sq, board):
-    attacks = tables.PAWN_ATTACKS[board.color][sq.index] & board.combined_color[~board.color]
+def get_pawn_moves_bb(i, board):
+    attacks = tables.PAWN_ATTACKS[board.color][i] & board.combined_color[~board.color]
     quiets = tables.EMPTY_BB
-    white_free = Square(sq.index + np.uint8(8)).to_bitboard() & board.combined_all == tables.EMPTY_BB 
-    black_free = Square(sq.index - np.uint8(8)).to_bitboard() & board.combined_all == tables.EMPTY_BB 
-    if (board.color == Color.WHITE and white_free) or (board.color == Color.BLACK and black_free):
-        quiets = tables.PAWN_QUIETS[board.color][sq.index] & ~board.combined_all
+    if tables.PAWN_PUSHES[board.color][i] & board.combined_all == tables.EMPTY_BB:
+        # double advance is only possible if the single push square is free
+        quiets = tables.PAWN_QUIETS[board.color][i] & ~board.combined_all
     return attacks | quiets
 
-def get_bishop_moves_bb(sq, board):
-    return ((get_diag_moves_bb(sq.index, board.combined_all) 
-        ^ get_antidiag_moves_bb(sq.index, board.combined_all))
-        & ~board.combined_color[board.color])
-
-def get_rook_moves_bb(sq, board):
-    return ((get_rank_moves_bb(sq.index, board.combined_all)
-        ^ get_file_moves_bb(sq.index, board.combined_all))
-        & ~board.combined_color[board.color])
+def get_bishop_moves_bb(i, board):
+    return get_bishop_attacks_bb(i, board.combined_all) & ~board.combined_color[board.color]
 
-def get_queen_moves_bb(sq, board):
-    return get_rook_moves_bb(sq, board) | get_bishop_moves_bb(sq, board)
+def get_rook_moves_bb(i, board):
+    return get_rook_attacks_bb(i, board.combined_all) & ~board.combined_color[board.color]
 
+def get_queen_moves_bb(i, board):
+    return get_rook_moves_bb(i, board) | get_bishop_moves_bb(i, board)
 
-# Move generators
-
-def gen_piece_moves(src, board, piece):
+def get_moves_bb(src, board, piece):
     if piece == Piece.PAWN:
-        moveset = get_pawn_moves_bb(src, board)
-        # Handle promotion moves
-        white_promote = src.to_bitboard() & tables.RANKS[Rank.SEVEN] != tables.EMPTY_BB
-        black_promote = src.to_bitboard() & tables.RANKS[Rank.TWO] != tables.EMPTY_BB
-        if (board.color == Color.WHITE and white_promote) or (board.color == Color.BLACK and black_promote):
-            for dest in bitboard.occupied_squares(moveset):
-                yield Move(src, dest, Piece.QUEEN)
-                yield Move(src, dest, Piece.ROOK)
-                yield Move(src, dest, Piece.KNIGHT)
-                yield Move(src, dest, Piece.BISHOP)
-            return
+        return get_pawn_moves_bb(src, board)
     elif piece == Piece.KNIGHT:
-        moveset = get_knight_moves_bb(src, board)
+        return get_knight_moves_bb(src, board)
     elif piece == Piece.BISHOP:
-        moveset = get_bishop_moves_bb(src, board)
+        return get_bishop_moves_bb(src, board)
     elif piece == Piece.ROOK:
-        moveset = get_rook_moves_bb(src, board)
+        return get_rook_moves_bb(src, board)
     elif piece == Piece.QUEEN:
-        moveset = get_queen_moves_bb(src, board)
+        return get_queen_moves_bb(src, board)
     elif piece == Piece.KING:
-        moveset = get_king_moves_bb(src, board)
+        return get_king_moves_bb(src, board)
     else:
         # This should never happen
         raise RuntimeError("Invalid piece: %s" % str(piece))
 
+def is_promoting(src, board):
+    """
+    Returns True iff a pawn of the side to move on square index src would promote when moved
+    """
+    if board.color == Color.WHITE:
+        return src >= 48 # seventh rank
+    return src < 16 # second rank
+
+
+# Move generators
+# NOTE: moves are yielded as ints, see move.py
+
+PROMOTIONS = (Piece.QUEEN << 12, Piece.ROOK << 12, Piece.KNIGHT << 12, Piece.BISHOP << 12)
+
+def gen_piece_moves(src, board, piece, targets=None):
+    """
+    targets optionally restricts the destination squares
+    """
+    moveset = get_moves_bb(src, board, piece)
+    if targets is not None:
+        moveset &= targets
+
+    # Handle promotion moves
+    if piece == Piece.PAWN and is_promoting(src, board):
+        for dest in bitboard.occupied_indices(moveset):
+            code = src | (dest << 6)
+            for promo in PROMOTIONS:
+                yield code | promo
+        return
+
     # Handle non-promotion moves
-    for dest in bitboard.occupied_squares(moveset):
-        yield Move(src, dest)
+    for dest in bitboard.occupied_indices(moveset):
+        yield src | (dest << 6)
 
 
 def gen_moves(board):
     # NOTE: generates pseudo-legal moves
     for piece in Piece:
         piece_bb = board.get_piece_bb(piece)
-        for src in bitboard.occupied_squares(piece_bb):
+        for src in bitboard.occupied_indices(piece_bb):
             yield from gen_piece_moves(src, board, piece)
 
 
-def gen_legal_moves(board):
-    return itertools.filterfalse(lambda m: leaves_in_check(board, m), gen_moves(board))
+def gen_captures(board):
+    """
+    Generates pseudo-legal captures and promotions (including non-capturing ones)
+    """
+    opp_bb = board.combined_color[~board.color]
+    for piece in Piece:
+        piece_bb = board.get_piece_bb(piece)
+        for src in bitboard.occupied_indices(piece_bb):
+            if piece == Piece.PAWN and is_promoting(src, board):
+                yield from gen_piece_moves(src, board, piece)
+            else:
+                yield from gen_piece_moves(src, board, piece, opp_bb)
+
+
+def gen_quiets(board):
+    """
+    Generates pseudo-legal moves that are neither captures nor promotions, i.e. the moves gen_captures leaves out
+    """
+    empty_bb = ~board.combined_all
+    for piece in Piece:
+        piece_bb = board.get_piece_bb(piece)
+        for src in bitboard.occupied_indices(piece_bb):
+            if piece == Piece.PAWN and is_promoting(src, board):
+                continue
+            yield from gen_piece_moves(src, board, piece, empty_bb)
+
+
+def is_pseudo_legal(board, move):
+    """
+    Returns True iff move is a pseudo-legal move on board, e.g. to check a move from the transposition table
+    """
+    src = move & 63
+    if tables.SQUARES[src] & board.combined_color[board.color] == tables.EMPTY_BB:
+        return False
+    piece = board.piece_at(src)
+    if tables.SQUARES[(move >> 6) & 63] & get_moves_bb(src, board, piece) == tables.EMPTY_BB:
+        return False
+    promotes = piece == Piece.PAWN and is_promoting(src, board)
+    return promotes == (move >> 12 != 0)
+
+
+def gen_legal_moves(board, stats=None):
+    """
+    Generates legal moves directly: each piece's moveset is masked by the check and pin masks of CheckInfo,
+    so only king moves need an attack test and no move is made to find out if it's legal
+    stats is an optional SearchStats, the time taken is counted as movegen if timing
+    """
+    if stats is None or not stats.timing:
+        return gen_legal(board)
+    t0 = time.perf_counter()
+    moves = list(gen_legal(board))
+    stats.add_time("movegen", time.perf_counter() - t0)
+    return iter(moves)
+
+def gen_legal(board):
+    info = CheckInfo(board)
+    double_check = info.check_mask == tables.EMPTY_BB
+    for piece in Piece:
+        piece_bb = board.get_piece_bb(piece)
+        if piece == Piece.KING:
+            src = info.king
+            for dest in bitboard.occupied_indices(get_king_moves_bb(src, board)):
+                if info.king_move_is_safe(board, dest):
+                    yield src | (dest << 6)
+        elif not double_check:
+            for src in bitboard.occupied_indices(piece_bb):
+                yield from gen_piece_moves(src, board, piece, info.targets(src))
+
+class MoveStack(object):
+    """
+    Move lists for a depth first walk of the tree, one array of 16 bit moves per ply
+    The arrays are reused from node to node, so a node's moves cost no list or object allocations
+    """
+    def __init__(self):
+        self.lists = []
+
+    def gen_legal_moves(self, board, ply):
+        """
+        Returns an array of the legal moves of board, valid until moves are next generated at the same ply
+        """
+        while len(self.lists) <= ply:
+            self.lists.append(array.array("H"))
+        moves = self.lists[ply]
+        del moves[:]
+        moves.extend(gen_legal(board))
+        return moves
+
+def filter_legal_moves(board, moves):
+    """
+    Filters moves by making each one and testing whether it leaves the king in check
+    Much slower than gen_legal_moves, kept as a reference to check it against
+    """
+    return itertools.filterfalse(lambda m: leaves_in_check(board, m), moves)
+
+
+# Check and pin detection
+
+def attackers_bb(board, i, color, occ):
+    """
+    Returns the pieces of color that attack square index i
+    occ is the occupancy sliders are blocked by, which may differ from the board's (e.g. without the king)
+    """
+    pieces = board.pieces[color]
+    queens = pieces[Piece.QUEEN]
+    return ((tables.PAWN_ATTACKS[~color][i] & pieces[Piece.PAWN])
+            | (tables.KNIGHT_MOVES[i] & pieces[Piece.KNIGHT])
+            | (tables.KING_MOVES[i] & pieces[Piece.KING])
+            | (get_bishop_attacks_bb(i, occ) & (pieces[Piece.BISHOP] | queens))
+            | (get_rook_attacks_bb(i, occ) & (pieces[Piece.ROOK] | queens)))
+
+class CheckInfo(object):
+    """
+    Checks and pins against the king of the side to move, computed once per position
+
+    check_mask - squares a non-king move must land on: everything when not in check, the checker and the
+                 squares between it and the king in single check, nothing in double check
+    pinned     - pieces of the side to move pinned to their king
+    pin_rays   - for each pinned piece (by square index), the squares it may move to: its pinner and the
+                 squares between the pinner and the king
+    """
+    def __init__(self, board):
+        color = board.color
+        opp_color = ~color
+        self.king_bb = board.get_piece_bb(Piece.KING)
+        self.king = int(bitboard.lsb_bitscan(self.king_bb))
+        k = self.king
+
+        self.checkers = attackers_bb(board, k, opp_color, board.combined_all)
+        if self.checkers == tables.EMPTY_BB:
+            self.check_mask = backend.FULL_BB
+        elif bitboard.pop_count(self.checkers) == 1:
+            self.check_mask = self.checkers | tables.BETWEEN[k][bitboard.lsb_bitscan(self.checkers)]
+        else:
+            self.check_mask = tables.EMPTY_BB
+
+        # Opposing sliders that would attack the king if none of our pieces were in the way
+        opp_pieces = board.pieces[opp_color]
+        opp_queens = opp_pieces[Piece.QUEEN]
+        opp_bb = board.combined_color[opp_color]
+        snipers = ((get_bishop_attacks_bb(k, opp_bb) & (opp_pieces[Piece.BISHOP] | opp_queens))
+                | (get_rook_attacks_bb(k, opp_bb) & (opp_pieces[Piece.ROOK] | opp_queens)))
+        self.pinned = tables.EMPTY_BB
+        self.pin_rays = {}
+        for i in bitboard.occupied_indices(snipers):
+            ray = tables.BETWEEN[k][i]
+            blockers = ray & board.combined_all
+            # a lone blocker must be ours, since the ray was cast through our pieces only
+            if blockers != tables.EMPTY_BB and bitboard.pop_count(blockers) == 1:
+                self.pinned |= blockers
+                self.pin_rays[int(bitboard.lsb_bitscan(blockers))] = ray | tables.SQUARES[i]
+
+    def targets(self, src):
+        """
+        Returns the squares a non-king piece on square index src may legally move to (as far as checks and pins go)
+        """
+        if tables.SQUARES[src] & self.pinned != tables.EMPTY_BB:
+            return self.check_mask & self.pin_rays[src]
+        return self.check_mask
+
+    def king_move_is_safe(self, board, dest):
+        # the king is taken off the board, so that sliders checking it also attack the squares behind it
+        occ = board.combined_all ^ self.king_bb
+        return attackers_bb(board, dest, ~board.color, occ) == tables.EMPTY_BB
+
+    def is_legal(self, board, move):
+        """
+        Returns True iff pseudo-legal move is legal
+        """
+        src = move & 63
+        dest = (move >> 6) & 63
+        if src == self.king:
+            return self.king_move_is_safe(board, dest)
+        return tables.SQUARES[dest] & self.targets(src) != tables.EMPTY_BB
 
 def leaves_in_check(board, move):
     """
-    Applies move to board and returns True iff king is left in check
+    Makes move on board and returns True iff it leaves the mover's king in check
+    The board is restored before returning
+    """
+    board.make_move(move)
+    board.color = ~board.color
+    check = in_check(board)
+    board.color = ~board.color
+    board.unmake_move()
+    return check
+
+def in_check(board):
+    """
+    Returns True iff the king of the side to move is attacked
 
     Uses symmetry of attack e.g. if white knight attacks black king, then black knight on king sq would attack white knight
     So it suffices to look at attacks of various pieces from king sq; if these hit opponent piece of same type then it's check
     """
-    board = board.apply_move(move)
-    board.color = ~board.color
-    my_king_sq = Square(bitboard.lsb_bitscan(board.get_piece_bb(Piece.KING)))
+    my_king_sq = int(bitboard.lsb_bitscan(board.get_piece_bb(Piece.KING)))
 
     opp_color = ~board.color
     opp_pawns = board.get_piece_bb(Piece.PAWN, color=opp_color)
-    if (tables.PAWN_ATTACKS[board.color][my_king_sq.index] & opp_pawns) != tables.EMPTY_BB: 
+    if (tables.PAWN_ATTACKS[board.color][my_king_sq] & opp_pawns) != tables.EMPTY_BB: 
         return True
 
     opp_knights = board.get_piece_bb(Piece.KNIGHT, color=opp_color)
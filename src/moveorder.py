@@ -0,0 +1,150 @@
+import time
+
+import movegen
+import tables
+
+"""
+Staged move ordering for alpha-beta search
+
+Moves are yielded in the order most likely to cause an early cutoff:
+1. the hash move (best move stored in the transposition table)
+2. captures and promotions, most valuable victim first then least valuable attacker (MVV-LVA)
+3. killer moves (quiet moves that caused a cutoff at the same ply elsewhere in the tree)
+4. remaining quiet moves, ranked by the history heuristic
+
+Each stage is only generated once the previous ones are exhausted, so a cutoff on the hash move
+or a capture saves generating the quiet moves at all.
+"""
+
+KILLERS_PER_PLY = 2
+
+class MoveOrdering(object):
+    """
+    Killer and history tables, which persist across the nodes of a search (and across searches)
+    Killers are indexed by ply, taken as the length of the board's move history
+    """
+    def __init__(self):
+        self.killers = []
+        self.history = [[0] * 4096 for _ in range(2)] # indexed by color, then src | dest << 6
+
+    def clear(self):
+        self.killers = []
+        self.history = [[0] * 4096 for _ in range(2)]
+
+    def new_search(self):
+        # keep the history from earlier searches, but let recent cutoffs outweigh it
+        for color_history in self.history:
+            for i, h in enumerate(color_history):
+                if h:
+                    color_history[i] = h >> 1
+
+    def get_killers(self, ply):
+        if ply < len(self.killers):
+            return self.killers[ply]
+        return []
+
+    def add_cutoff(self, board, move, depth):
+        """
+        Records that quiet move (an int, see move.py) caused a beta cutoff at a node searched to depth
+        """
+        ply = len(board.history)
+        while len(self.killers) <= ply:
+            self.killers.append([])
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[KILLERS_PER_PLY:]
+        self.history[board.color][move & 0xFFF] += depth * depth
+
+
+def is_quiet(board, move):
+    return (move >> 12 == 0
+            and tables.SQUARES[(move >> 6) & 63] & board.combined_color[~board.color] == tables.EMPTY_BB)
+
+def mvv_lva(board, move):
+    victim = board.piece_at((move >> 6) & 63, ~board.color)
+    attacker = board.piece_at(move & 63)
+    score = 0 if victim is None else 8 * (victim + 1) - attacker
+    return score + 8 * (move >> 12) # promo piece
+
+def check_info(board, stats):
+    if stats is not None and stats.timing:
+        t0 = time.perf_counter()
+        info = movegen.CheckInfo(board)
+        stats.add_time("legality", time.perf_counter() - t0)
+        return info
+    return movegen.CheckInfo(board)
+
+def is_legal(board, move, info, stats):
+    """
+    info is the board's movegen.CheckInfo
+    """
+    if stats is None:
+        return info.is_legal(board, move)
+    if stats.timing:
+        t0 = time.perf_counter()
+        legal = info.is_legal(board, move)
+        stats.add_time("legality", time.perf_counter() - t0)
+    else:
+        legal = info.is_legal(board, move)
+    if not legal:
+        stats.legality_rejects += 1
+    return legal
+
+def generate(moves, stats, key=None):
+    """
+    Runs the generator moves into a list, sorted by descending key if given
+    """
+    if stats is not None and stats.timing:
+        t0 = time.perf_counter()
+    moves = list(moves)
+    if key is not None:
+        moves.sort(key=key, reverse=True)
+    if stats is not None and stats.timing:
+        stats.add_time("movegen", time.perf_counter() - t0)
+    return moves
+
+def pick_moves(board, ordering=None, hash_move=None, stats=None):
+    """
+    Generates legal moves of board in staged order (see above)
+    ordering is the MoveOrdering to take killers and history from; without one, quiets come in generation order
+    The board must be restored before asking for the next move
+    """
+    info = check_info(board, stats)
+    tried = set()
+    if hash_move is not None and movegen.is_pseudo_legal(board, hash_move):
+        tried.add(hash_move)
+        if is_legal(board, hash_move, info, stats):
+            yield hash_move
+
+    captures = generate(movegen.gen_captures(board), stats, lambda m: mvv_lva(board, m))
+    for move in captures:
+        if move not in tried and is_legal(board, move, info, stats):
+            yield move
+
+    if ordering is None:
+        for move in generate(movegen.gen_quiets(board), stats):
+            if move not in tried and is_legal(board, move, info, stats):
+                yield move
+        return
+
+    for move in list(ordering.get_killers(len(board.history))):
+        if (move not in tried and is_quiet(board, move) and movegen.is_pseudo_legal(board, move)):
+            tried.add(move)
+            if is_legal(board, move, info, stats):
+                yield move
+
+    history = ordering.history[board.color]
+    quiets = generate(movegen.gen_quiets(board), stats, lambda m: history[m & 0xFFF])
+    for move in quiets:
+        if move not in tried and is_legal(board, move, info, stats):
+            yield move
+
+def pick_captures(board, stats=None):
+    """
+    Generates legal captures and promotions of board, MVV-LVA ordered, for quiescence search
+    """
+    info = check_info(board, stats)
+    for move in generate(movegen.gen_captures(board), stats, lambda m: mvv_lva(board, m)):
+        if is_legal(board, move, info, stats):
+            yield move
@@ -0,0 +1,154 @@
+from concurrent.futures import ProcessPoolExecutor
+import os
+
+from chessboard import ChessBoard
+from transposition import TranspositionTable, SharedTranspositionTable, DEFAULT_SIZE_MB
+import movegen
+import search
+
+"""
+Parallel search over a pool of worker processes
+
+Two modes are supported:
+ROOT_SPLIT - the first root move is searched to get a bound, then the remaining root moves are searched
+             in parallel against it. Each worker keeps its own transposition table.
+LAZY_SMP   - every worker searches the whole tree, each with a different root move order, sharing one
+             transposition table in shared memory so that they pick up each other's results.
+
+Boards are sent to workers with ChessBoard.to_tuple rather than pickling them (moves are plain ints anyway).
+In deterministic mode, root splitting is used with a fresh table for every root move, so the result doesn't
+depend on which worker searched what.
+"""
+
+ROOT_SPLIT = "root"
+LAZY_SMP = "lazy"
+
+# Per process state, set up by init_worker
+_worker_tt = None
+_worker_tt_mb = DEFAULT_SIZE_MB
+_deterministic = False
+
+def init_worker(tt_mb, deterministic, shared_raw):
+    global _worker_tt, _worker_tt_mb, _deterministic
+    _worker_tt_mb = tt_mb
+    _deterministic = deterministic
+    if shared_raw is not None:
+        _worker_tt = SharedTranspositionTable(tt_mb, shared_raw)
+    elif not deterministic:
+        _worker_tt = TranspositionTable(tt_mb)
+
+def get_worker_tt(age):
+    tt = _worker_tt if _worker_tt is not None else TranspositionTable(_worker_tt_mb)
+    tt.age = age
+    return tt
+
+def search_move_task(position, move_code, depth, alpha, age, options):
+    """
+    Searches a single root move, returns its score from the point of view of the side to move at the root
+    Scores <= alpha are only upper bounds
+    """
+    board = ChessBoard.from_tuple(position)
+    board.make_move(move_code)
+    tt = get_worker_tt(age)
+    return -search.negamax(board, depth-1, -search.MAX_SCORE, -alpha, tt, options)
+
+def lazy_smp_task(position, depth, helper, age, options):
+    """
+    Iteratively deepens the whole tree, with root moves rotated by helper so that workers diverge
+    Returns (score, move code)
+    """
+    board = ChessBoard.from_tuple(position)
+    tt = get_worker_tt(age)
+    moves = list(movegen.gen_legal_moves(board))
+    k = helper % len(moves)
+    moves = moves[k:] + moves[:k]
+    score, move = None, None
+    for d in range(1, depth+1):
+        score, move = search.search_root(board, d, moves, tt, options)
+        search.order_moves(moves, move)
+    return score, move
+
+
+class ParallelSearch(object):
+    def __init__(self, workers=None, mode=ROOT_SPLIT, deterministic=False, tt_mb=DEFAULT_SIZE_MB):
+        """
+        workers is the number of worker processes, defaults to the number of CPUs
+        tt_mb is the transposition table size per worker, or in total for LAZY_SMP
+        deterministic makes results reproducible regardless of scheduling (ROOT_SPLIT only)
+        """
+        if mode not in (ROOT_SPLIT, LAZY_SMP):
+            raise ValueError("Unknown parallel search mode: %s" % mode)
+        if deterministic and mode != ROOT_SPLIT:
+            raise ValueError("Deterministic search requires %s mode" % ROOT_SPLIT)
+        self.workers = workers or os.cpu_count() or 1
+        self.mode = mode
+        self.deterministic = deterministic
+        self.shared_tt = SharedTranspositionTable(tt_mb) if mode == LAZY_SMP else None
+        shared_raw = self.shared_tt.raw if self.shared_tt is not None else None
+        self.age = 0
+        self.executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                initializer=init_worker,
+                initargs=(tt_mb, deterministic, shared_raw))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown()
+
+    def best_move(self, board, depth, options=search.DEFAULT_OPTIONS):
+        """
+        Returns the best move for board searched to depth, or None if there are no legal moves
+        """
+        self.age = (self.age + 1) & 0xFF
+        if self.mode == LAZY_SMP:
+            return self.lazy_smp(board, depth, options)
+        return self.root_split(board, depth, options)
+
+    def root_split(self, board, depth, options):
+        moves = list(movegen.gen_legal_moves(board))
+        if not moves:
+            return None
+        if depth > 1:
+            # cheap serial search to pick the move most likely to be best, which gives the tightest bound
+            _, first = search.search_root(board, 1, moves)
+            search.order_moves(moves, first)
+
+        position = board.to_tuple()
+        first = self.executor.submit(search_move_task,
+                position, moves[0], depth, search.MIN_SCORE, self.age, options)
+        alpha = first.result()
+        futures = [self.executor.submit(search_move_task,
+                position, m, depth, alpha, self.age, options)
+                for m in moves[1:]]
+
+        # Ties go to the earlier move, so the result doesn't depend on completion order
+        best, best_score = moves[0], alpha
+        for move, future in zip(moves[1:], futures):
+            score = future.result()
+            if score > best_score:
+                best, best_score = move, score
+        return best
+
+    def lazy_smp(self, board, depth, options):
+        if not any(True for _ in movegen.gen_legal_moves(board)):
+            return None
+        position = board.to_tuple()
+        futures = [self.executor.submit(lazy_smp_task, position, depth, helper, self.age, options)
+                for helper in range(self.workers)]
+        results = [f.result() for f in futures]
+        # The main helper searches moves in the usual order, the others only exist to fill the table
+        _, move = results[0]
+        return move
+
+
+def best_move(board, depth, workers=None, mode=ROOT_SPLIT, deterministic=False, options=search.DEFAULT_OPTIONS):
+    """
+    One-off parallel search, see ParallelSearch to reuse a pool across searches
+    """
+    with ParallelSearch(workers, mode, deterministic) as searcher:
+        return searcher.best_move(board, depth, options)
@@ -0,0 +1,154 @@
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import time
+import numpy as np
+
+from chessboard import ChessBoard
+import move
+import movegen
+
+"""
+Perft: counts the leaf nodes of the legal move tree to a given depth, for checking move generation
+(compare against published values, e.g. https://www.chessprogramming.org/Perft_Results) and measuring its speed
+
+Usage: python perft.py DEPTH [--fen FEN] [--divide] [--workers N] [--hash MB]
+"""
+
+class PerftCache(object):
+    """
+    Fixed-size table of subtree counts keyed by position hash and depth
+    Transpositions are common in perft, so this skips recounting subtrees already seen
+    """
+    ENTRY_BYTES = 8 + 8 + 1 # key, count, depth
+
+    def __init__(self, size_mb):
+        max_entries = int(size_mb * 1024 * 1024) // self.ENTRY_BYTES
+        if max_entries < 1:
+            raise ValueError("Perft cache size too small: %s MB" % size_mb)
+        self.size = 1 << (max_entries.bit_length() - 1)
+        self.mask = self.size - 1
+        self.keys = np.zeros(self.size, dtype=np.uint64)
+        self.counts = np.zeros(self.size, dtype=np.uint64)
+        self.depths = np.zeros(self.size, dtype=np.int8) # 0 marks an empty slot, depth 0 is never stored
+        self.hits = 0
+
+    def slot(self, key, depth):
+        # mix in the depth so that the same position at different depths doesn't fight over a slot
+        return (int(key) ^ (depth * 0x9E3779B97F4A7C15)) & self.mask
+
+    def get(self, key, depth):
+        i = self.slot(key, depth)
+        if self.depths[i] == depth and self.keys[i] == key:
+            self.hits += 1
+            return int(self.counts[i])
+        return None
+
+    def put(self, key, depth, count):
+        i = self.slot(key, depth)
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.counts[i] = count
+
+
+def perft(board, depth, cache=None, stack=None):
+    """
+    Returns number of leaf nodes depth plies below board
+    cache is an optional PerftCache
+    stack is the movegen.MoveStack to generate moves into, created if not given
+    """
+    if depth == 0:
+        return 1
+    if cache is not None and depth > 1:
+        count = cache.get(board.hash, depth)
+        if count is not None:
+            return count
+    if stack is None:
+        stack = movegen.MoveStack()
+    moves = stack.gen_legal_moves(board, depth) # each depth is a different ply, so can have its own list
+    if depth == 1:
+        return len(moves) # no need to make the moves just to count them
+    count = 0
+    for m in moves:
+        board.make_move(m)
+        count += perft(board, depth-1, cache, stack)
+        board.unmake_move()
+    if cache is not None:
+        cache.put(board.hash, depth, count)
+    return count
+
+
+# Per process cache, set up by init_worker
+_worker_cache = None
+
+def init_worker(cache_mb):
+    global _worker_cache
+    _worker_cache = PerftCache(cache_mb) if cache_mb else None
+
+def perft_move_task(position, move_code, depth):
+    board = ChessBoard.from_tuple(position)
+    board.make_move(move_code)
+    return perft(board, depth-1, _worker_cache)
+
+def divide(board, depth, workers=1, cache_mb=0):
+    """
+    Returns a list of (move, count) with the perft count below each legal move of board
+    With more than one worker, the subtrees of the root moves are counted in parallel processes
+    cache_mb is the size of the perft cache (per worker), 0 disables it
+    """
+    if depth < 1:
+        raise ValueError("Divide needs depth >= 1")
+    moves = list(movegen.gen_legal_moves(board))
+    if workers > 1:
+        position = board.to_tuple()
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(cache_mb,)) as executor:
+            futures = [executor.submit(perft_move_task, position, m, depth) for m in moves]
+            return [(m, f.result()) for m, f in zip(moves, futures)]
+
+    cache = PerftCache(cache_mb) if cache_mb else None
+    stack = movegen.MoveStack()
+    counts = []
+    for m in moves:
+        board.make_move(m)
+        counts.append((m, perft(board, depth-1, cache, stack)))
+        board.unmake_move()
+    return counts
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Count leaf nodes of the move tree from a position")
+    parser.add_argument("depth", type=int)
+    parser.add_argument("--fen", help="position to count from (default: the starting position)")
+    parser.add_argument("--divide", action="store_true", help="print the count below each root move")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes to count subtrees in")
+    parser.add_argument("--hash", type=float, default=0, metavar="MB", help="perft cache size per worker (0 = off)")
+    args = parser.parse_args(args)
+
+    if args.fen is not None:
+        try:
+            board = ChessBoard.from_fen(args.fen)
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        board = ChessBoard()
+        board.init_game()
+
+    start = time.perf_counter()
+    if args.depth == 0:
+        counts = []
+        nodes = 1
+    else:
+        counts = divide(board, args.depth, args.workers, args.hash)
+        nodes = sum(c for _, c in counts)
+    elapsed = time.perf_counter() - start
+
+    if args.divide:
+        for m, c in counts:
+            print("%s: %d" % (move.to_str(m), c))
+        print()
+    print("Nodes: %d" % nodes)
+    print("Time: %.3fs" % elapsed)
+    print("NPS: %d" % (nodes / elapsed if elapsed > 0 else 0))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,452 @@
+import time
 import numpy as np
 
+import bitboard
+from constants import Piece
 import movegen
+import moveorder
 import evaluation
+import tablebase
+from stats import SearchStats, SearchAborted
+from transposition import TranspositionTable, Bound
 
-def negamax(board, depth):
-    if depth == 0:
+# Deepest iteration for searches limited by time or nodes instead of depth
+MAX_DEPTH = 64
+
+# A timed search won't start a new iteration once this fraction of its time is used,
+# since the next iteration almost always takes longer than all previous ones together
+ITERATION_TIME_FRACTION = 0.5
+
+# Scores are bounded by checkmate, so these act as -infinity / +infinity for the search window
+MIN_SCORE = evaluation.Score.CHECKMATE.value
+MAX_SCORE = -evaluation.Score.CHECKMATE.value
+
+# Quiescence search skips captures that can't bring the score within this much of alpha
+DELTA_MARGIN = 200
+
+# Tablebase wins score this, less the plies to mate: below a mate found by the search, above any evaluation
+TABLEBASE_WIN = MAX_SCORE - 1000
+# Scores at least this far from 0 are wins or losses (checkmate or from the tablebases), which pruning
+# mustn't claim from a static evaluation or a null move search
+DECISIVE_SCORE = TABLEBASE_WIN - tablebase.MAX_PLIES
+
+# Null move pruning: the null move is searched this many plies shallower than the other moves, and only
+# at nodes of at least NULL_MOVE_MIN_DEPTH
+NULL_MOVE_REDUCTION = 2
+NULL_MOVE_MIN_DEPTH = 3
+
+# Late move reductions: quiet moves after the first LMR_FULL_DEPTH_MOVES are searched a ply shallower,
+# at nodes of at least LMR_MIN_DEPTH
+LMR_FULL_DEPTH_MOVES = 3
+LMR_MIN_DEPTH = 3
+
+# Futility pruning, by remaining depth: at depth d, a node whose static evaluation is FUTILITY_MARGINS[d]
+# above beta fails high (reverse futility), and quiet moves are skipped when it's that much below alpha
+FUTILITY_MARGINS = (0, 200, 500)
+
+class SearchOptions(object):
+    def __init__(self, quiescence=True, batch_eval=False, tablebases=None, null_move=True, reductions=True,
+            futility=True):
+        """
+        quiescence resolves captures and promotions at the horizon before evaluating, see quiesce
+        batch_eval scores all leaves below a depth 1 node with one evaluation.evaluate_batch call
+        (these frontier nodes then skip quiescence search)
+        tablebases is a tablebase.Tablebases, probed for an exact score at the root and interior nodes
+        null_move, reductions (late move reductions) and futility (futility and reverse futility pruning)
+        turn on the selective search techniques described in negamax
+        """
+        self.quiescence = quiescence
+        self.batch_eval = batch_eval
+        self.tablebases = tablebases
+        self.null_move = null_move
+        self.reductions = reductions
+        self.futility = futility
+
+DEFAULT_OPTIONS = SearchOptions()
+
+def order_moves(moves, first):
+    """
+    Moves first (if present) to the front of the list of moves
+    """
+    if first is not None:
+        try:
+            moves.remove(first)
+        except ValueError:
+            return moves
+        moves.insert(0, first)
+    return moves
+
+def evaluate(board, stats=None):
+    if stats is None:
+        return evaluation.evaluate(board)
+    stats.evals += 1
+    if not stats.timing:
         return evaluation.evaluate(board)
+    t0 = time.perf_counter()
+    score = evaluation.evaluate(board)
+    stats.add_time("evaluate", time.perf_counter() - t0)
+    return score
+
+def no_moves_score(board):
+    """
+    Score of a position where the side to move has no legal moves: lost if in check, otherwise stalemate
+    """
+    if movegen.in_check(board):
+        return evaluation.Score.CHECKMATE.value
+    return evaluation.Score.DRAW.value
+
+def has_pieces(board):
+    """
+    Whether the side to move has more than pawns and its king
+    Without pieces zugzwang is common, and passing (see null move pruning) can't be assumed to be the worst move
+    """
+    pieces = board.pieces[board.color]
+    return (pieces[Piece.KNIGHT] | pieces[Piece.BISHOP] | pieces[Piece.ROOK] | pieces[Piece.QUEEN]) != bitboard.EMPTY_BB
+
+def tablebase_score(board, tablebases, stats=None):
+    """
+    Exact score of board from the tablebases, or None if it isn't in them
+    """
+    result = tablebases.probe(board)
+    if result is None:
+        return None
+    if stats is not None:
+        stats.tablebase_hits += 1
+    outcome, plies = result
+    if outcome == tablebase.WIN:
+        return TABLEBASE_WIN - plies
+    if outcome == tablebase.LOSS:
+        return -TABLEBASE_WIN + plies
+    return evaluation.Score.DRAW.value
+
+def tablebase_root(board, moves, tablebases, stats=None):
+    """
+    Returns (score, move) for the best of moves by the tablebases, or None if board or any move isn't in them
+    """
+    root_score = tablebase_score(board, tablebases, stats)
+    if root_score is None:
+        return None
+    best, best_score = None, None
+    for move in moves:
+        board.make_move(move)
+        score = tablebase_score(board, tablebases, stats)
+        board.unmake_move()
+        if score is None:
+            return None
+        if best is None or -score > best_score:
+            best, best_score = move, -score
+    return root_score, best
+
+def negamax(board, depth, alpha=MIN_SCORE, beta=MAX_SCORE, tt=None, options=DEFAULT_OPTIONS, stats=None, ordering=None):
+    """
+    Alpha-beta negamax
+    Returns the score of board from the point of view of the side to move
+    Scores outside of the (alpha, beta) window are only bounds on the true score
+
+    tt is an optional TranspositionTable, probed before expanding a node and updated after
+    options is a SearchOptions
+    stats is an optional SearchStats
+    ordering is an optional MoveOrdering, which supplies killer / history move ordering and is updated on cutoffs
+
+    Unless turned off in options, the search is selective, which gives up exactness for depth:
+    - null move pruning: if the side to move could pass and a reduced search still fails high, a real move
+      would too, so the node fails high without searching any. Not tried in check, twice in a row, or
+      without pieces (see has_pieces)
+    - reverse futility pruning: near the leaves, a node whose static evaluation beats beta by a margin fails high
+    - futility pruning: near the leaves, if the static evaluation is a margin below alpha, quiet moves are
+      skipped, since they're unlikely to make that up
+    - late move reductions: quiet moves ordered late are searched a ply shallower with a null window,
+      and only searched again at full depth if they beat alpha
+    Moves that give check are never pruned or reduced, and nothing is pruned in check or around decisive scores
+    """
+    if stats is not None:
+        stats.visit()
+
+    if options.tablebases is not None:
+        score = tablebase_score(board, options.tablebases, stats)
+        if score is not None:
+            return score
+
+    hash_move = None
+    if tt is not None:
+        entry = tt.probe(board.hash)
+        if entry is not None:
+            tt_depth, bound, tt_score, hash_move = entry
+            if stats is not None:
+                stats.hash_hits += 1
+            if tt_depth >= depth and (bound == Bound.EXACT
+                    or (bound == Bound.LOWER and tt_score >= beta)
+                    or (bound == Bound.UPPER and tt_score <= alpha)):
+                if stats is not None:
+                    stats.hash_cutoffs += 1
+                return tt_score
+
+    if depth == 0:
+        if stats is not None:
+            stats.leaves += 1
+        if options.quiescence:
+            score = quiesce(board, alpha, beta, stats)
+            bound = Bound.UPPER if score <= alpha else Bound.LOWER if score >= beta else Bound.EXACT
+        else:
+            score = evaluate(board, stats)
+            bound = Bound.EXACT
+        if tt is not None:
+            tt.store(board.hash, 0, bound, score)
+        return score
+
+    if depth == 1 and options.batch_eval:
+        score, best = eval_frontier(board, stats)
+        if tt is not None:
+            tt.store(board.hash, 1, Bound.EXACT, score, best)
+        return score
+
+    in_check = (options.null_move or options.reductions or options.futility) and movegen.in_check(board)
+    futile = False
+    if options.futility and not in_check and depth < len(FUTILITY_MARGINS):
+        margin = FUTILITY_MARGINS[depth]
+        static_eval = evaluate(board, stats)
+        if abs(beta) < DECISIVE_SCORE and static_eval - margin >= beta:
+            if stats is not None:
+                stats.pruned += 1
+            return static_eval - margin
+        futile = abs(alpha) < DECISIVE_SCORE and static_eval + margin <= alpha
+
+    if (options.null_move and not in_check and depth >= NULL_MOVE_MIN_DEPTH and abs(beta) < DECISIVE_SCORE
+            and has_pieces(board) and not (board.history and board.history[-1][0] is None)):
+        board.make_null_move()
+        score = -negamax(board, depth-1-NULL_MOVE_REDUCTION, -beta, -beta+1, tt, options, stats, ordering)
+        board.unmake_move()
+        if score >= beta:
+            if stats is not None:
+                stats.null_cutoffs += 1
+            return beta if score >= DECISIVE_SCORE else score
+
+    reduce = options.reductions and not in_check and depth >= LMR_MIN_DEPTH
+    alpha_orig = alpha
     max_score = evaluation.Score.CHECKMATE.value
-    for move in movegen.gen_legal_moves(board):
-        new_board = board.apply_move(move)
-        score = -negamax(new_board, depth-1)
-        max_score = max(score, max_score)
+    best = None
+    generated = 0
+    searched = 0
+    for move in moveorder.pick_moves(board, ordering, hash_move, stats):
+        generated += 1
+        quiet = (futile or reduce) and searched > 0 and moveorder.is_quiet(board, move)
+        board.make_move(move)
+        if quiet and movegen.in_check(board):
+            quiet = False # checks are neither pruned nor reduced
+        if quiet and futile:
+            board.unmake_move()
+            if stats is not None:
+                stats.pruned += 1
+            if static_eval + margin > max_score:
+                max_score = static_eval + margin # the most a skipped move is expected to reach
+            continue
+        if quiet and searched >= LMR_FULL_DEPTH_MOVES:
+            if stats is not None:
+                stats.reductions += 1
+            score = -negamax(board, depth-2, -alpha-1, -alpha, tt, options, stats, ordering)
+            if score > alpha:
+                score = -negamax(board, depth-1, -beta, -alpha, tt, options, stats, ordering)
+        else:
+            score = -negamax(board, depth-1, -beta, -alpha, tt, options, stats, ordering)
+        board.unmake_move()
+        searched += 1
+        if score > max_score:
+            max_score = score
+            best = move
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    if stats is not None:
+                        stats.cutoffs += 1
+                    if ordering is not None and moveorder.is_quiet(board, move):
+                        ordering.add_cutoff(board, move, depth)
+                    break # opponent will never allow this position
+    if generated == 0:
+        max_score = no_moves_score(board)
+
+    if tt is not None:
+        if max_score <= alpha_orig:
+            bound = Bound.UPPER
+        elif max_score >= beta:
+            bound = Bound.LOWER
+        else:
+            bound = Bound.EXACT
+        tt.store(board.hash, depth, bound, max_score, best)
     return max_score
 
-def best_move(board, depth):
+def quiesce(board, alpha, beta, stats=None):
+    """
+    Quiescence search: searches only captures and promotions until the position is quiet, so the
+    evaluation isn't taken in the middle of an exchange (the horizon effect)
+
+    The side to move may "stand pat" on the static evaluation instead of capturing, which bounds the score
+    from below. Captures that can't raise the score to alpha even with DELTA_MARGIN to spare are skipped.
+    In check, standing pat isn't an option, so every evasion is searched instead (which also spots checkmate).
+    """
+    if stats is not None:
+        stats.visit()
+        stats.qnodes += 1
+    if movegen.in_check(board):
+        return quiesce_evasions(board, alpha, beta, stats)
+    stand_pat = evaluate(board, stats)
+    if stand_pat >= beta:
+        return stand_pat
+    if stand_pat + evaluation.Score.QUEEN.value + DELTA_MARGIN < alpha:
+        return stand_pat # nothing can save this position
+    if stand_pat > alpha:
+        alpha = stand_pat
+
+    max_score = stand_pat
+    for move in moveorder.pick_captures(board, stats):
+        if move >> 12 == 0: # not a promotion
+            victim = board.piece_at((move >> 6) & 63, ~board.color)
+            if stand_pat + evaluation.PIECE_SCORES[victim] + DELTA_MARGIN <= alpha:
+                continue
+        board.make_move(move)
+        score = -quiesce(board, -beta, -alpha, stats)
+        board.unmake_move()
+        if score > max_score:
+            max_score = score
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return max_score
+
+def quiesce_evasions(board, alpha, beta, stats=None):
     max_score = evaluation.Score.CHECKMATE.value
-    for move in movegen.gen_legal_moves(board):
-        new_board = board.apply_move(move)
-        score = -negamax(new_board, depth-1)
+    for move in moveorder.pick_moves(board, stats=stats):
+        board.make_move(move)
+        score = -quiesce(board, -beta, -alpha, stats)
+        board.unmake_move()
         if score > max_score:
             max_score = score
-            best_move = move
-    return best_move
+            if score > alpha:
+                alpha = score
+                if alpha >= beta:
+                    break
+    return max_score
+
+def eval_frontier(board, stats=None):
+    """
+    Scores every legal move from board with a single batch evaluation of the resulting positions
+    Returns (score, move) for the best move, or (score, None) if there are no legal moves
+    No cutoffs are possible between leaves, but one vectorized call is much cheaper than many evaluate calls
+    """
+    moves = list(movegen.gen_legal_moves(board, stats))
+    if not moves:
+        return no_moves_score(board), None
+    leaves = np.empty((len(moves), 2, 6), dtype=np.uint64)
+    for i, move in enumerate(moves):
+        board.make_move(move)
+        leaves[i] = board.pieces
+        board.unmake_move()
+    colors = np.full(len(moves), ~board.color, dtype=np.intp)
+    if stats is not None:
+        stats.leaves += len(moves)
+        stats.evals += len(moves)
+        t0 = time.perf_counter() if stats.timing else None
+    scores = -evaluation.evaluate_batch(leaves, colors)
+    if stats is not None and stats.timing:
+        stats.add_time("evaluate", time.perf_counter() - t0)
+    i = int(np.argmax(scores))
+    return scores[i], moves[i]
+
+def search_root(board, depth, moves, tt=None, options=DEFAULT_OPTIONS, stats=None, ordering=None):
+    """
+    Searches each of the given root moves to the given depth, in order
+    Returns (score, move) for the best move found
+    """
+    alpha = MIN_SCORE
+    best = None
+    for move in moves:
+        board.make_move(move)
+        score = -negamax(board, depth-1, -MAX_SCORE, -alpha, tt, options, stats, ordering)
+        board.unmake_move()
+        if best is None or score > alpha:
+            alpha = score
+            best = move
+    if tt is not None:
+        tt.store(board.hash, depth, Bound.EXACT, alpha, best)
+    return alpha, best
+
+def iterative_deepening(board, max_depth, tt=None, options=DEFAULT_OPTIONS, stats=None, ordering=None):
+    """
+    Searches to depth 1, 2, ..., max_depth, yielding (depth, score, move) after each iteration
+    The best move of each iteration is searched first in the next one, which tightens the window early
+    If the tablebases have the root position, their exact result is yielded alone, with depth 0 as nothing was searched
+    """
+    moves = list(movegen.gen_legal_moves(board))
+    if not moves:
+        return
+    if options.tablebases is not None:
+        found = tablebase_root(board, moves, options.tablebases, stats)
+        if found is not None:
+            yield 0, found[0], found[1]
+            return
+    if ordering is not None:
+        ordering.new_search()
+    if tt is not None:
+        tt.new_search()
+        entry = tt.probe(board.hash)
+        if entry is not None:
+            order_moves(moves, entry[3])
+    for depth in range(1, max_depth+1):
+        score, move = search_root(board, depth, moves, tt, options, stats, ordering)
+        yield depth, score, move
+        order_moves(moves, move)
+
+def best_move(board, depth, tt=None, options=DEFAULT_OPTIONS, stats=None, ordering=None):
+    """
+    tt is the TranspositionTable to use, pass the same one across moves of a game to reuse its entries
+    Defaults to a fresh table (likewise ordering, the MoveOrdering)
+    options is a SearchOptions
+    stats is an optional SearchStats to collect node counts and timings in
+    """
+    if tt is None:
+        tt = TranspositionTable()
+    if ordering is None:
+        ordering = moveorder.MoveOrdering()
+    move = None
+    for _, _, move in iterative_deepening(board, depth, tt, options, stats, ordering):
+        pass
+    return move
 
+def limited_search(board, time_limit=None, node_limit=None, max_depth=MAX_DEPTH,
+        tt=None, options=DEFAULT_OPTIONS, stats=None, ordering=None):
+    """
+    Iteratively deepens until time_limit (seconds) or node_limit is reached, or max_depth is completed
+    An iteration cut short by a limit is thrown away, so the result comes from the last completed depth
+    Returns (move, score, depth), with depth 0 if not even depth 1 completed (move is then the first legal move,
+    and score None) or if the move came straight from the tablebases
+    Returns (None, None, 0) if there are no legal moves
+    """
+    if tt is None:
+        tt = TranspositionTable()
+    if stats is None:
+        stats = SearchStats()
+    if ordering is None:
+        ordering = moveorder.MoveOrdering()
+    start = time.perf_counter()
+    deadline = start + time_limit if time_limit is not None else None
+    nodes_start = stats.nodes
+    stats.set_limits(deadline, nodes_start + node_limit if node_limit is not None else None)
 
+    moves = list(movegen.gen_legal_moves(board))
+    if not moves:
+        stats.set_limits()
+        return None, None, 0
+    result = (moves[0], None, 0)
+    history_len = len(board.history)
+    try:
+        for depth, score, move in iterative_deepening(board, max_depth, tt, options, stats, ordering):
+            result = (move, score, depth)
+            if time_limit is not None and time.perf_counter() - start > time_limit * ITERATION_TIME_FRACTION:
+                break
+    except SearchAborted:
+        # unwind the moves made by the interrupted iteration
+        while len(board.history) > history_len:
+            board.unmake_move()
+    finally:
+        stats.set_limits()
+    return result
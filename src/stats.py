@@ -0,0 +1,108 @@
+import time
+
+"""
+Search instrumentation
+
+Search functions take an optional SearchStats. When none is passed, the only cost is an `is not None` check
+per node, so instrumentation can be left in the hot path.
+"""
+
+PHASES = ("movegen", "legality", "evaluate")
+
+class SearchAborted(Exception):
+    """
+    Raised from inside the search when a node or time limit is hit (see SearchStats.set_limits),
+    or when it's stopped with SearchStats.stop
+    """
+    pass
+
+class SearchStats(object):
+    def __init__(self, timing=False, callback=None, interval=10000):
+        """
+        timing also records time spent per phase (see PHASES), at the cost of a few clock reads per node
+        callback is called with the stats every interval nodes, e.g. for progress reporting
+        """
+        self.timing = timing
+        self.callback = callback
+        self.interval = interval
+        self.stopped = False
+        self.set_limits()
+        self.reset()
+
+    def set_limits(self, deadline=None, max_nodes=None):
+        """
+        deadline is a time.perf_counter() value, max_nodes a total node count
+        The search is aborted with SearchAborted once either is reached
+        """
+        self.deadline = deadline
+        self.max_nodes = max_nodes
+        self.limited = deadline is not None or max_nodes is not None or self.stopped
+
+    def stop(self):
+        """
+        Aborts the search at its next node, e.g. from another thread
+        Unlike the limits, this can't be undone
+        """
+        self.stopped = True
+        self.limited = True
+
+    def reset(self):
+        self.nodes = 0 # positions visited by the search (including quiescence search)
+        self.qnodes = 0 # of which, positions visited by quiescence search
+        self.leaves = 0 # positions at the search horizon
+        self.evals = 0 # positions scored by the evaluation function
+        self.cutoffs = 0 # beta cutoffs in the move loop
+        self.hash_hits = 0 # transposition table probes that found an entry
+        self.hash_cutoffs = 0 # of which, entries good enough to return immediately
+        self.legality_rejects = 0 # pseudo-legal moves that left the king in check
+        self.tablebase_hits = 0 # positions scored from the endgame tablebases
+        self.null_cutoffs = 0 # nodes that failed high on a null move search
+        self.reductions = 0 # late moves searched at reduced depth
+        self.pruned = 0 # futile moves skipped, and nodes that failed high by reverse futility
+        self.times = dict.fromkeys(PHASES, 0.0)
+        self.start = time.perf_counter()
+
+    def visit(self):
+        self.nodes += 1
+        if self.callback is not None and self.nodes % self.interval == 0:
+            self.callback(self)
+        if self.limited:
+            if self.stopped:
+                raise SearchAborted()
+            if self.max_nodes is not None and self.nodes > self.max_nodes:
+                raise SearchAborted()
+            if self.deadline is not None and time.perf_counter() >= self.deadline:
+                raise SearchAborted()
+
+    def add_time(self, phase, seconds):
+        self.times[phase] += seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def nps(self):
+        elapsed = self.elapsed()
+        return self.nodes / elapsed if elapsed > 0 else 0.0
+
+    def as_dict(self):
+        d = {
+            "nodes": self.nodes,
+            "qnodes": self.qnodes,
+            "leaves": self.leaves,
+            "evals": self.evals,
+            "cutoffs": self.cutoffs,
+            "hash_hits": self.hash_hits,
+            "hash_cutoffs": self.hash_cutoffs,
+            "legality_rejects": self.legality_rejects,
+            "tablebase_hits": self.tablebase_hits,
+            "null_cutoffs": self.null_cutoffs,
+            "reductions": self.reductions,
+            "pruned": self.pruned,
+            "time": self.elapsed(),
+        }
+        if self.timing:
+            d["phases"] = dict(self.times)
+        return d
+
+    def __str__(self):
+        return " ".join("%s=%s" % (k, v) for k, v in self.as_dict().items() if k != "phases")
@@ -0,0 +1,479 @@
+import argparse
+from array import array
+import itertools
+import os
+import struct
+import sys
+import time
+import numpy as np
+
+import bitboard
+from chessboard import ChessBoard
+from constants import Color, Piece
+import movegen
+import tables
+
+"""
+Endgame tablebases: distance to mate for every position of an ending with few pieces, by retrograde analysis
+
+A table covers one material signature, e.g. KQvK, with the stronger side as white (positions with the
+material the other way round are probed with colors swapped and the board flipped). Each position has
+one signed byte, from the point of view of the side to move:
+    0       draw
+    d > 0   win, mating in d plies (d is odd)
+    d < 0   loss, mated in -d-1 plies (so -1 is checkmate)
+INVALID marks index slots that aren't legal positions. Positions are indexed by side to move, then the
+squares of the pieces: white king first, then the other white pieces, then the black king and pieces. The
+white king is mapped into the a1-d1-d4 triangle by the board's symmetries (or onto files a-d when there are
+pawns), which cuts a table to 10/64 (or 32/64) of its size.
+
+Tables are generated in two passes. The first generates the legal moves of every position with movegen,
+recording moves that stay within the table and the result of those that leave it (captures and
+promotions, looked up in the smaller tables, which are generated first). The second repeatedly assigns a
+win in n plies to positions with a move to a loss in n-1, and a loss in n to positions all of whose moves
+lead to wins, until nothing changes; what's left is drawn. The engine has no castling, en passant or
+fifty move rule, and neither do the tables.
+
+Files are a small header followed by the values, memory mapped when probed.
+
+Usage: python tablebase.py SIGNATURE... [--dir DIR]  e.g. python tablebase.py KQvK KRvK KPvK
+Tables needed by the requested ones are generated as well. 3 piece tables take seconds, 4 piece ones
+are much slower (a few minutes to hours in pure Python).
+"""
+
+MAGIC = b"SFTB"
+TABLEBASE_VERSION = 1
+HEADER = struct.Struct("<4sII") # magic, version, number of positions
+INVALID = -128
+MAX_PLIES = 126 # longest distance to mate that fits in the encoding
+MAX_MEN = 4
+
+DIRECTORY = os.environ.get("SNAKEFISH_TABLEBASES",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases"))
+
+WIN, DRAW, LOSS = 1, 0, -1
+
+ORDER = "KQRBNP" # pieces in slot order, which is also strongest first
+PIECE_OF = {ch: Piece.from_char(ch.lower()) for ch in ORDER}
+LETTER_OF = {p: ch for ch, p in PIECE_OF.items()}
+
+
+# SIGNATURES AND INDEXING
+
+def side_key(side):
+    # more pieces is stronger, then stronger pieces
+    return (len(side), [-ORDER.index(ch) for ch in side])
+
+def side_string(letters):
+    return "".join(sorted(letters, key=ORDER.index))
+
+def is_trivial_draw(white, black):
+    """
+    True for material (strings of piece letters per side) that can't mate: bare kings, or king and minor piece vs king
+    """
+    return ((white == "K" and black in ("K", "KB", "KN")) or (black == "K" and white in ("KB", "KN")))
+
+def parse_signature(signature):
+    """
+    Splits e.g. "KQvK" into ("KQ", "K"), checking that it's in canonical form (stronger side first)
+    """
+    try:
+        white, black = signature.split("v")
+    except ValueError:
+        raise ValueError("Bad tablebase signature: %s" % signature)
+    if (not white or not black or white != side_string(white) or black != side_string(black)
+            or not set(white + black) <= set(ORDER) or white.count("K") != 1 or black.count("K") != 1
+            or side_key(white) < side_key(black)):
+        raise ValueError("Bad tablebase signature: %s" % signature)
+    if len(white) + len(black) > MAX_MEN:
+        raise ValueError("Tablebases have at most %d pieces: %s" % (MAX_MEN, signature))
+    return white, black
+
+def compute_transforms(pawns):
+    """
+    For each white king square, the mapping of all 64 squares that brings the king into the indexed region
+    """
+    transforms = []
+    for k in range(64):
+        ops = []
+        if k & 7 > 3:
+            ops.append(lambda sq: sq ^ 7) # mirror files
+        if not pawns:
+            if k >> 3 > 3:
+                ops.append(lambda sq: sq ^ 56) # mirror ranks
+            k2 = k
+            for op in ops:
+                k2 = op(k2)
+            if k2 >> 3 > k2 & 7:
+                ops.append(lambda sq: ((sq & 7) << 3) | (sq >> 3)) # mirror in the a1-h8 diagonal
+        mapping = []
+        for sq in range(64):
+            for op in ops:
+                sq = op(sq)
+            mapping.append(sq)
+        transforms.append(mapping)
+    return transforms
+
+TRANSFORMS = {False: compute_transforms(False), True: compute_transforms(True)}
+KING_SQUARES = {
+    False: [sq for sq in range(64) if sq & 7 <= 3 and sq >> 3 <= sq & 7], # a1-d1-d4 triangle
+    True: [sq for sq in range(64) if sq & 7 <= 3], # files a-d
+}
+KING_INDEX = {pawns: {sq: i for i, sq in enumerate(squares)} for pawns, squares in KING_SQUARES.items()}
+
+class Layout(object):
+    """
+    The piece slots and index arithmetic of a signature
+    """
+    def __init__(self, signature):
+        white, black = parse_signature(signature)
+        self.signature = signature
+        self.slots = [(Color.WHITE, PIECE_OF[ch]) for ch in white] + [(Color.BLACK, PIECE_OF[ch]) for ch in black]
+        self.men = len(self.slots)
+        self.pawns = "P" in signature
+        self.transforms = TRANSFORMS[self.pawns]
+        self.king_index = KING_INDEX[self.pawns]
+        self.per_side = len(KING_SQUARES[self.pawns]) * 64 ** (self.men - 1)
+        self.size = 2 * self.per_side
+
+    def index(self, squares, color):
+        """
+        squares in slot order, color the side to move
+        """
+        mapping = self.transforms[squares[0]]
+        idx = self.king_index[mapping[squares[0]]]
+        for sq in squares[1:]:
+            idx = idx * 64 + mapping[sq]
+        return color * self.per_side + idx
+
+def canonical(white, black, color):
+    """
+    white and black are lists of (piece, square), color the side to move
+    Returns (signature, squares in slot order, side to move), with colors swapped if black is the stronger side
+    """
+    white_side = side_string(LETTER_OF[p] for p, _ in white)
+    black_side = side_string(LETTER_OF[p] for p, _ in black)
+    if side_key(white_side) < side_key(black_side):
+        white, black = [(p, sq ^ 56) for p, sq in black], [(p, sq ^ 56) for p, sq in white]
+        white_side, black_side = black_side, white_side
+        color = ~Color(color)
+    squares = ([sq for _, sq in sorted(white, key=lambda ps: ORDER.index(LETTER_OF[ps[0]]))]
+            + [sq for _, sq in sorted(black, key=lambda ps: ORDER.index(LETTER_OF[ps[0]]))])
+    return "%sv%s" % (white_side, black_side), squares, Color(color)
+
+def decode(value):
+    """
+    Returns (WIN, DRAW or LOSS, plies to mate) for a table value, None for INVALID
+    """
+    value = int(value)
+    if value == INVALID:
+        return None
+    if value > 0:
+        return WIN, value
+    if value < 0:
+        return LOSS, -value - 1
+    return DRAW, 0
+
+
+# PROBING
+
+def table_path(directory, signature):
+    return os.path.join(directory, "%s.sftb" % signature)
+
+class Tablebases(object):
+    def __init__(self, directory=DIRECTORY):
+        """
+        Tables are opened the first time a position of their signature is probed
+        """
+        self.directory = directory
+        self.tables = {} # signature -> (Layout, values), or None if there's no file
+
+    def __getstate__(self):
+        # the memory maps aren't sent to other processes, they just open the files again
+        return {"directory": self.directory}
+
+    def __setstate__(self, state):
+        self.__init__(state["directory"])
+
+    def available(self):
+        """
+        Returns the signatures of the tables in the directory
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name[:-5] for name in os.listdir(self.directory) if name.endswith(".sftb"))
+
+    def table(self, signature):
+        if signature not in self.tables:
+            path = table_path(self.directory, signature)
+            self.tables[signature] = load_table(path, Layout(signature)) if os.path.exists(path) else None
+        return self.tables[signature]
+
+    def probe_pieces(self, white, black, color):
+        """
+        white and black are lists of (piece, square), color the side to move
+        Returns (WIN, DRAW or LOSS, plies to mate) for the side to move, or None if there's no table
+        """
+        white_side = [LETTER_OF[p] for p, _ in white]
+        black_side = [LETTER_OF[p] for p, _ in black]
+        if is_trivial_draw(side_string(white_side), side_string(black_side)):
+            return DRAW, 0
+        if len(white) + len(black) > MAX_MEN:
+            return None
+        signature, squares, color = canonical(white, black, color)
+        found = self.table(signature)
+        if found is None:
+            return None
+        layout, values = found
+        return decode(values[layout.index(squares, color)])
+
+    def probe(self, board):
+        """
+        Like probe_pieces, for a board
+        """
+        if bitboard.pop_count(board.combined_all) > MAX_MEN:
+            return None
+        sides = ([], [])
+        for c in Color:
+            for p in Piece:
+                for i in bitboard.occupied_indices(board.pieces[c][p]):
+                    sides[c].append((p, i))
+        return self.probe_pieces(sides[Color.WHITE], sides[Color.BLACK], board.color)
+
+def load_tablebases(directory=DIRECTORY):
+    """
+    Returns Tablebases for directory, or None if it has no tables
+    """
+    tablebases = Tablebases(directory)
+    return tablebases if tablebases.available() else None
+
+def load_table(path, layout):
+    """
+    Returns (layout, values) with values memory mapped from path
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ValueError("Not a tablebase: %s" % path)
+    magic, version, size = HEADER.unpack(header)
+    if magic != MAGIC or version != TABLEBASE_VERSION or size != layout.size:
+        raise ValueError("Not a tablebase, or an old format: %s" % path)
+    return layout, np.memmap(path, dtype=np.int8, mode="r", offset=HEADER.size, shape=(size,))
+
+def save_table(path, values):
+    tmp = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, TABLEBASE_VERSION, len(values)))
+        f.write(values.astype(np.int8).tobytes())
+    os.replace(tmp, path)
+
+
+# GENERATION
+
+def dependencies(signature):
+    """
+    Signatures of the tables that captures and promotions lead to, from a signature
+    """
+    white, black = parse_signature(signature)
+    deps = set()
+    def add(w, b):
+        if not is_trivial_draw(w, b):
+            if side_key(w) < side_key(b):
+                w, b = b, w
+            deps.add("%sv%s" % (w, b))
+    for side, is_white in ((white, True), (black, False)):
+        for i, ch in enumerate(side):
+            if ch == "K":
+                continue
+            captured = side[:i] + side[i+1:]
+            if is_white:
+                add(captured, black)
+            else:
+                add(white, captured)
+            if ch == "P":
+                for promo in "QRBN":
+                    promoted = side_string(side[:i] + promo + side[i+1:])
+                    if is_white:
+                        add(promoted, black)
+                    else:
+                        add(white, promoted)
+    return sorted(deps)
+
+def set_position(board, layout, squares, color):
+    pieces = [[tables.EMPTY_BB] * 6, [tables.EMPTY_BB] * 6]
+    combined = [tables.EMPTY_BB, tables.EMPTY_BB]
+    for (c, p), sq in zip(layout.slots, squares):
+        pieces[c][p] |= tables.SQUARES[sq]
+        combined[c] |= tables.SQUARES[sq]
+    board.pieces = pieces
+    board.combined_color = combined
+    board.combined_all = combined[Color.WHITE] | combined[Color.BLACK]
+    board.color = color
+
+def scan_positions(layout, tablebases):
+    """
+    First pass: returns (valid, mated, starts, targets, ext_win, ext_draw, ext_loss), where for each index
+    valid     - the slot is a legal position
+    mated     - the side to move is checkmated
+    starts    - moves within the table of position i are targets[starts[i]:starts[i+1]] (as indices)
+    ext_win   - the shortest win for the side to move through a move that leaves the table (or MAX_PLIES+1)
+    ext_draw  - whether a move that leaves the table draws
+    ext_loss  - the longest loss through a move that leaves the table (or -1)
+    """
+    n = layout.size
+    valid = np.zeros(n, dtype=bool)
+    mated = np.zeros(n, dtype=bool)
+    counts = np.zeros(n, dtype=np.int64)
+    targets = array("i")
+    ext_win = np.full(n, MAX_PLIES + 1, dtype=np.int16)
+    ext_draw = np.zeros(n, dtype=bool)
+    ext_loss = np.full(n, -1, dtype=np.int16)
+
+    board = ChessBoard(mailbox=False)
+    kings = KING_SQUARES[layout.pawns]
+    king_slots = [i for i, (_, p) in enumerate(layout.slots) if p == Piece.KING]
+    idx = 0
+    for color in Color:
+        for king in kings:
+            for others in itertools.product(range(64), repeat=layout.men - 1):
+                squares = (king,) + others
+                i = idx
+                idx += 1
+                if len(set(squares)) < layout.men:
+                    continue
+                if any(p == Piece.PAWN and (sq < 8 or sq >= 56) for (_, p), sq in zip(layout.slots, squares)):
+                    continue
+                set_position(board, layout, squares, color)
+                opp_king = squares[king_slots[~color]]
+                if movegen.attackers_bb(board, opp_king, color, board.combined_all) != tables.EMPTY_BB:
+                    continue # the side not to move is in check
+                valid[i] = True
+
+                moves = list(movegen.gen_legal_moves(board))
+                if not moves:
+                    mated[i] = movegen.in_check(board)
+                    continue
+                slot_of = {sq: s for s, sq in enumerate(squares)}
+                for m in moves:
+                    src, dest, promo = m & 63, (m >> 6) & 63, m >> 12
+                    moved = slot_of[src]
+                    captured = slot_of.get(dest)
+                    child = list(squares)
+                    child[moved] = dest
+                    if captured is None and not promo:
+                        targets.append(layout.index(child, ~color))
+                        counts[i] += 1
+                        continue
+                    white, black = [], []
+                    for s, ((c, p), sq) in enumerate(zip(layout.slots, child)):
+                        if s == captured:
+                            continue
+                        if s == moved and promo:
+                            p = Piece(promo)
+                        (white if c == Color.WHITE else black).append((p, sq))
+                    result = tablebases.probe_pieces(white, black, ~color)
+                    if result is None:
+                        raise ValueError("Missing tablebase needed by %s" % layout.signature)
+                    outcome, plies = result
+                    if outcome == LOSS:
+                        ext_win[i] = min(ext_win[i], plies + 1)
+                    elif outcome == DRAW:
+                        ext_draw[i] = True
+                    else:
+                        ext_loss[i] = max(ext_loss[i], plies + 1)
+    starts = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(counts, out=starts[1:])
+    return valid, mated, starts, np.frombuffer(targets, dtype=np.int32), ext_win, ext_draw, ext_loss
+
+def solve(valid, mated, starts, targets, ext_win, ext_draw, ext_loss):
+    """
+    Second pass: returns the table values (see above) from the output of scan_positions
+    """
+    n = len(valid)
+    counts = np.diff(starts)
+    parents = np.repeat(np.arange(n, dtype=np.int64), counts) # the position each move is made from
+    resolved = ~valid | mated
+    result = np.zeros(n, dtype=np.int8)
+    plies = np.zeros(n, dtype=np.int16)
+    result[mated] = LOSS
+    no_moves = valid & ~mated & (counts == 0) & (ext_win > MAX_PLIES) & ~ext_draw & (ext_loss < 0)
+    resolved |= no_moves # stalemate
+
+    # a loss can only come from moves that all lose: no draws or wins outside the table
+    can_lose = valid & ~ext_draw & (ext_win > MAX_PLIES)
+    last_external = max(int(ext_win[ext_win <= MAX_PLIES].max(initial=0)), int(ext_loss.max(initial=-1)))
+    ply = 0
+    while True:
+        ply += 1
+        if ply > MAX_PLIES:
+            raise ValueError("Distance to mate doesn't fit in the table encoding")
+        child_result = result[targets]
+        child_resolved = resolved[targets]
+
+        lost_child = child_resolved & (child_result == LOSS) & (plies[targets] == ply - 1)
+        wins = np.zeros(n, dtype=bool)
+        wins[parents[lost_child]] = True
+        wins |= ext_win == ply
+        wins &= ~resolved
+
+        won_child = child_resolved & (child_result == WIN)
+        all_won = np.bincount(parents[won_child], minlength=n) == counts
+        longest = np.full(n, -1, dtype=np.int16)
+        np.maximum.at(longest, parents[won_child], plies[targets][won_child])
+        # ext_loss already counts the move out of the table
+        losses = can_lose & ~resolved & all_won & (np.maximum(longest + 1, ext_loss) == ply)
+
+        if not wins.any() and not losses.any():
+            if ply > last_external:
+                break
+            continue
+        result[wins] = WIN
+        plies[wins] = ply
+        result[losses] = LOSS
+        plies[losses] = ply
+        resolved |= wins | losses
+
+    values = np.zeros(n, dtype=np.int8)
+    win = resolved & (result == WIN)
+    loss = resolved & (result == LOSS)
+    values[win] = plies[win]
+    values[loss] = -plies[loss] - 1
+    values[~valid] = INVALID
+    return values
+
+def generate(signature, directory=DIRECTORY, log=None):
+    """
+    Generates the table for signature into directory, after any tables it depends on that are missing
+    log is called with progress messages
+    """
+    os.makedirs(directory, exist_ok=True)
+    for dep in dependencies(signature):
+        if not os.path.exists(table_path(directory, dep)):
+            generate(dep, directory, log)
+    layout = Layout(signature)
+    start = time.perf_counter()
+    scan = scan_positions(layout, Tablebases(directory))
+    values = solve(*scan)
+    save_table(table_path(directory, signature), values)
+    if log is not None:
+        log("%s: %d positions in %.1fs" % (signature, layout.size, time.perf_counter() - start))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Generate endgame tablebases")
+    parser.add_argument("signatures", nargs="+", help="material with the stronger side first, e.g. KQvK KPvK")
+    parser.add_argument("--dir", default=DIRECTORY, help="directory to write the tables to")
+    args = parser.parse_args(args)
+    for signature in args.signatures:
+        try:
+            parse_signature(signature)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+    for signature in args.signatures:
+        generate(signature, args.dir, log=print)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
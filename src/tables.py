@@ -1,12 +1,82 @@
+import os
 import numpy as np
 
+import backend
 import bitboard
-from square import Square
-from constants import Rank, File, Color
+from constants import Rank, File, Color, Piece, Score
 
 """
 This file contains various pre-computed bitboards and bitboard tables for move generation and general use
+
+Tables are always computed with numpy, then converted to the bitboard backend's types at the end of the file
+
+Generating the larger tables element by element is slow, and every worker process would pay for it at import,
+so they are saved to a cache file the first time and loaded from it after that (see cached). The cache is
+regenerated when TABLES_VERSION changes; bump it whenever a cached table is computed differently.
+The SNAKEFISH_TABLE_CACHE environment variable sets the cache path, an empty value disables the cache.
 """
+
+# TABLE CACHE
+
+TABLES_VERSION = 1
+
+CACHE_PATH = os.environ.get("SNAKEFISH_TABLE_CACHE",
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "tables_cache.npz"))
+
+def load_cache(path):
+    """
+    Returns a dict of the tables saved at path, or None if there's no usable cache there
+    """
+    if not path:
+        return None
+    try:
+        with np.load(path) as data:
+            if int(data["version"]) != TABLES_VERSION:
+                return None
+            return {name: data[name] for name in data.files if name != "version"}
+    except (OSError, KeyError, ValueError):
+        return None
+
+def save_cache(path, tables):
+    # Written to a temporary file first, so that processes importing at the same time never see half a file
+    if not path:
+        return
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, version=np.int64(TABLES_VERSION), **tables)
+        os.replace(tmp_path, path)
+    except OSError:
+        # e.g. a read-only install, the tables are just generated on every import
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+
+_cache = load_cache(CACHE_PATH)
+_cache_stale = _cache is None
+_tables = {} if _cache is None else _cache
+
+def cached(names, compute):
+    """
+    Returns the table called names from the cache, or computes it with compute() if it isn't there
+    names may be a tuple, for a compute() that returns a tuple of tables
+    """
+    global _cache_stale
+    single = isinstance(names, str)
+    if single:
+        names = (names,)
+    if all(name in _tables for name in names):
+        tables = tuple(_tables[name] for name in names)
+    else:
+        tables = compute()
+        if single:
+            tables = (tables,)
+        _tables.update(zip(names, tables))
+        _cache_stale = True
+    return tables[0] if single else tables
+
+
 EMPTY_BB = np.uint64(0)
 
 RANKS = np.array(
@@ -16,31 +86,34 @@ FILES = np.array(
             [np.uint64(0x0101010101010101) << np.uint8(i) for i in range(8)],
             dtype=np.uint64)
 
-RANK_MASKS = np.fromiter(
+RANK_MASKS = cached("RANK_MASKS", lambda: np.fromiter(
         (RANKS[i//8] for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
-FILE_MASKS = np.fromiter(
+FILE_MASKS = cached("FILE_MASKS", lambda: np.fromiter(
         (FILES[i%8] for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
 A1H8_DIAG = np.uint64(0x8040201008040201)
 H1A8_ANTIDIAG = np.uint64(0x0102040810204080)
 
 CENTER = np.uint64(0x00003C3C3C3C0000)
 
+# Single square bitboards, indexed by square index
+SQUARES = np.array([1 << i for i in range(64)], dtype=np.uint64)
+
 def compute_diag_mask(i):
     diag = 8*(i & 7) - (i & 56)
     north = -diag & (diag >> 31)
     south = diag & (-diag >> 31)
     return (A1H8_DIAG >> np.uint8(south)) << np.uint8(north)
 
-DIAG_MASKS = np.fromiter(
+DIAG_MASKS = cached("DIAG_MASKS", lambda: np.fromiter(
         (compute_diag_mask(i) for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
 def compute_antidiag_mask(i):
     diag = 56 - 8*(i & 7) - (i & 56)
@@ -48,10 +121,10 @@ def compute_antidiag_mask(i):
     south = diag & (-diag >> 31)
     return (H1A8_ANTIDIAG >> np.uint8(south)) << np.uint8(north)
 
-ANTIDIAG_MASKS = np.fromiter(
+ANTIDIAG_MASKS = cached("ANTIDIAG_MASKS", lambda: np.fromiter(
         (compute_antidiag_mask(i) for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
 
 
@@ -61,8 +134,7 @@ ANTIDIAG_MASKS = np.fromiter(
 # KING
 
 def compute_king_moves(i):
-    sq = Square(i)
-    bb = sq.to_bitboard()
+    bb = np.uint64(1) << np.uint8(i)
 
     nw = (bb & ~FILES[File.A]) << np.uint8(7)
     n  = bb << np.uint8(8)
@@ -75,16 +147,15 @@ def compute_king_moves(i):
 
     return nw | n | ne | e | se | s | sw | w
 
-KING_MOVES = np.fromiter(
+KING_MOVES = cached("KING_MOVES", lambda: np.fromiter(
         (compute_king_moves(i) for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
 # KNIGHT 
 
 def compute_knight_moves(i):
-    sq = Square(i)
-    bb = sq.to_bitboard()
+    bb = np.uint64(1) << np.uint8(i)
 
     m1 = ~(FILES[File.A] | FILES[File.B])
     m2 = ~FILES[File.A]
@@ -103,10 +174,10 @@ def compute_knight_moves(i):
     return s1 | s2 | s3 | s4 | s5 | s6 | s7 | s8
 
 
-KNIGHT_MOVES = np.fromiter(
+KNIGHT_MOVES = cached("KNIGHT_MOVES", lambda: np.fromiter(
         (compute_knight_moves(i) for i in range(64)),
         dtype=np.uint64,
-        count=64)
+        count=64))
 
 # PAWN QUIETS
 # NOTE: MUST BE CHECKED LATER FOR BLOCKERS IN EVENT OF DOUBLE ADVANCE
@@ -116,27 +187,37 @@ def compute_pawn_quiet_moves(color, i):
         bb << np.uint(8*i) if color == Color.WHITE else bb >> np.uint8(8*i)
     starting_rank = RANKS[Rank.TWO] if color == Color.WHITE else RANKS[Rank.SEVEN]
 
-    sq = Square(i)
-    bb = sq.to_bitboard()
+    bb = np.uint64(1) << np.uint8(i)
 
     s1 = shift_forward(bb, color, 1)
     s2 = shift_forward((bb & starting_rank), color, 2)
 
     return s1 | s2
 
-PAWN_QUIETS = np.fromiter(
+PAWN_QUIETS = cached("PAWN_QUIETS", lambda: np.fromiter(
         (compute_pawn_quiet_moves(color, i)
             for color in Color 
             for i in range(64)),
         dtype=np.uint64,
-        count=2*64)
-PAWN_QUIETS.shape = (2,64)
+        count=2*64).reshape(2,64))
+
+# Single pushes only, used to check whether a double advance is blocked
+
+def compute_pawn_push(color, i):
+    bb = np.uint64(1) << np.uint8(i)
+    return bb << np.uint8(8) if color == Color.WHITE else bb >> np.uint8(8)
+
+PAWN_PUSHES = cached("PAWN_PUSHES", lambda: np.fromiter(
+        (compute_pawn_push(color, i)
+            for color in Color
+            for i in range(64)),
+        dtype=np.uint64,
+        count=2*64).reshape(2,64))
 
 # PAWN ATTACKS
 
 def compute_pawn_attack_moves(color, i):
-    sq = Square(i)
-    bb = sq.to_bitboard()
+    bb = np.uint64(1) << np.uint8(i)
 
     if color == Color.WHITE:
         s1 = (bb & ~FILES[File.A]) << np.uint8(7)
@@ -147,13 +228,12 @@ def compute_pawn_attack_moves(color, i):
 
     return s1 | s2
 
-PAWN_ATTACKS = np.fromiter(
+PAWN_ATTACKS = cached("PAWN_ATTACKS", lambda: np.fromiter(
         (compute_pawn_attack_moves(color, i)
             for color in Color 
             for i in range(64)),
         dtype=np.uint64,
-        count=2*64)
-PAWN_ATTACKS.shape = (2,64)
+        count=2*64).reshape(2,64))
 
 # FIRST RANK MOVES
 # Array is indexed by file of square and occupancy of line
@@ -172,14 +252,14 @@ def compute_first_rank_moves(i, occ):
     left_attacks = left_ray(x)
     left_blockers = left_attacks & occ
     if left_blockers != np.uint8(0):
-        leftmost = np.uint8(1) << bitboard.msb_bitscan(np.uint64(left_blockers))
+        leftmost = np.uint8(1) << bitboard.msb_bitscan_numpy(np.uint64(left_blockers))
         left_garbage = left_ray(leftmost)
         left_attacks ^= left_garbage
 
     right_attacks = right_ray(x)
     right_blockers = right_attacks & occ
     if right_blockers != np.uint8(0):
-        rightmost = np.uint8(1) << bitboard.lsb_bitscan(np.uint64(right_blockers))
+        rightmost = np.uint8(1) << bitboard.lsb_bitscan_numpy(np.uint64(right_blockers))
         right_garbage = right_ray(rightmost)
         right_attacks ^= right_garbage
 
@@ -187,10 +267,247 @@ def compute_first_rank_moves(i, occ):
 
 
 
-FIRST_RANK_MOVES = np.fromiter(
+FIRST_RANK_MOVES = cached("FIRST_RANK_MOVES", lambda: np.fromiter(
         (compute_first_rank_moves(i, occ)
             for i in range(8) # 8 squares in a rank 
             for occ in range(256)), # 2^8 = 256 possible occupancies of a rank
         dtype=np.uint8,
-        count=8*256)
-FIRST_RANK_MOVES.shape = (8,256)
+        count=8*256).reshape(8,256))
+
+# BETWEEN
+# Squares strictly between two squares on the same rank, file or diagonal (empty if they aren't aligned)
+# Used for check blocking and pin rays in legal move generation
+
+def compute_between(i):
+    # Returns the between bitboards from square index i to every square, as ints
+    between = [0] * 64
+    r, f = divmod(i, 8)
+    for dr, df in ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (1, -1), (-1, 1), (-1, -1)):
+        ray = 0
+        tr, tf = r + dr, f + df
+        while 0 <= tr < 8 and 0 <= tf < 8:
+            j = 8*tr + tf
+            between[j] = ray
+            ray |= 1 << j
+            tr, tf = tr + dr, tf + df
+    return between
+
+BETWEEN = cached("BETWEEN", lambda: np.array([compute_between(i) for i in range(64)], dtype=np.uint64))
+
+
+# MAGIC BITBOARDS
+# Sliding attacks for every square and occupancy of the squares that can block it, in one table per slider
+# The blockers are hashed into the table by a multiply and shift with a per square magic number:
+# attacks = ROOK_ATTACKS[ROOK_OFFSETS[i] + (((occ & ROOK_MASKS[i]) * ROOK_MAGICS[i]) >> ROOK_SHIFTS[i])]
+
+ROOK_DIRECTIONS = ((1, 0), (-1, 0), (0, 1), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+
+def compute_rays(i, directions):
+    # Returns a list of square indices for each direction from square index i, in order of distance
+    rays = []
+    r, f = divmod(i, 8)
+    for dr, df in directions:
+        ray = []
+        tr, tf = r + dr, f + df
+        while 0 <= tr < 8 and 0 <= tf < 8:
+            ray.append(8*tr + tf)
+            tr, tf = tr + dr, tf + df
+        rays.append(ray)
+    return rays
+
+def compute_blocker_mask(i, directions):
+    # The last square of each ray is left out, since a piece there can't block anything
+    return sum(1 << j for ray in compute_rays(i, directions) for j in ray[:-1])
+
+def compute_occupancies(mask):
+    # Returns every subset of mask, as a uint64 array
+    bits = [b for b in range(64) if (mask >> b) & 1]
+    n = np.arange(1 << len(bits), dtype=np.uint64)
+    occs = np.zeros(1 << len(bits), dtype=np.uint64)
+    for k, b in enumerate(bits):
+        occs |= ((n >> np.uint64(k)) & np.uint64(1)) << np.uint64(b)
+    return occs
+
+def compute_slider_attacks(i, occs, directions):
+    # Returns the attacks from square index i for each occupancy in the array occs
+    attacks = np.zeros_like(occs)
+    for ray in compute_rays(i, directions):
+        blocked = np.zeros(len(occs), dtype=bool)
+        for j in ray:
+            bit = np.uint64(1) << np.uint64(j)
+            attacks[~blocked] |= bit
+            blocked |= (occs & bit) != EMPTY_BB
+    return attacks
+
+def find_magic(i, directions, rng):
+    """
+    Searches for a magic number for square index i that hashes every blocker occupancy without a harmful collision
+    (occupancies may share a slot if their attacks are the same)
+    This takes minutes in Python, so it was run once (with np.random.default_rng(0x5EED), rooks first)
+    to produce the magics below
+    """
+    mask = compute_blocker_mask(i, directions)
+    occs = compute_occupancies(mask)
+    attacks = compute_slider_attacks(i, occs, directions)
+    shift = np.uint64(64 - bin(mask).count("1"))
+    limit = np.iinfo(np.uint64).max
+    while True:
+        # sparse numbers make good magics
+        magic = (rng.integers(0, limit, dtype=np.uint64, endpoint=True)
+                & rng.integers(0, limit, dtype=np.uint64, endpoint=True)
+                & rng.integers(0, limit, dtype=np.uint64, endpoint=True))
+        if bin(int(np.uint64(mask) * magic) >> 56).count("1") < 6:
+            continue
+        index = (occs * magic) >> shift
+        order = np.argsort(index, kind="stable")
+        index, slot_attacks = index[order], attacks[order]
+        shared = index[1:] == index[:-1]
+        if np.all(slot_attacks[1:][shared] == slot_attacks[:-1][shared]):
+            return int(magic)
+
+ROOK_MAGICS = np.array([
+        0x1480012280400032, 0x2240004020001000, 0x4100200008410010, 0x1100100100080420,
+        0x0200020008102004, 0x0900010008140022, 0x1900108A00040100, 0x0200004411008822,
+        0x80848000C0048021, 0x8004804000200281, 0x0080801000802000, 0x1201002008100104,
+        0x2200800800800400, 0x2420800400020080, 0x20A2004200040801, 0x0882000082004104,
+        0x030C410021048000, 0x0400828020004000, 0x00A0010040201104, 0x0201010008100022,
+        0x080A808008000400, 0x5222808004000200, 0x0481040010010208, 0x400202000048890C,
+        0x082082218000400C, 0x0010004540022010, 0x8010002020040800, 0x0080080080801000,
+        0x0006040080080080, 0x0001000900040002, 0x0000420400A81021, 0x00400CE200040081,
+        0x1080002000404000, 0x0022002102004080, 0x0010040020200800, 0x0020100101000820,
+        0x010200040A0010A0, 0x104400101C010860, 0x0000020104001048, 0x1000010882002044,
+        0x0000400080208000, 0x0C40008020088040, 0x1010001020008080, 0xC058018010048008,
+        0x0006005020060018, 0x8002000409820010, 0x0002000100404080, 0x1049091080420004,
+        0x0080802200410200, 0x0020802000400080, 0x000582100A200180, 0x2000100180880280,
+        0x0002801C00080280, 0x8014000200800480, 0x4102020110880400, 0x82002081005C0200,
+        0x0000908006402101, 0x30C0010222104081, 0x2120010040082011, 0x2035001000A08409,
+        0x9002000420081002, 0x0012002148102402, 0x2000080200900104, 0x0041000080221543
+        ], dtype=np.uint64)
+
+BISHOP_MAGICS = np.array([
+        0x4084881240440100, 0x3002122401021408, 0x00840818890A0080, 0x0108084110241804,
+        0x04C4042000024022, 0x0001040240080048, 0x4020440404404011, 0x1027004808841040,
+        0x0480600444868401, 0x4010029012020040, 0x8112900912003050, 0x2000088A0202000C,
+        0x1040071040102005, 0x1400890C60042022, 0x2200011808040459, 0x0280210C00820882,
+        0x2560140504840821, 0x8002000408281912, 0x0010000114428102, 0x0008018C04248801,
+        0x8014040080A00000, 0x043200010080C400, 0xC0411040880530C2, 0x4002202704020200,
+        0x4820A08331844108, 0x1012100C881008B2, 0x0100820010040018, 0x2881004014040102,
+        0x0008848014002000, 0x3004010009300220, 0x07040C00064206A0, 0x00C2220280208200,
+        0x400442401420C430, 0x0046501000028200, 0x1015054052880280, 0x1280020082580081,
+        0x0270008200C02200, 0x00200C0409044100, 0x0001840400088200, 0x2942810210034210,
+        0x0094010908804121, 0x4300809010020828, 0x5002020424000200, 0x0841004200819810,
+        0x2000111122000401, 0x0020200C04400020, 0x0090100105304240, 0x4401020082000108,
+        0x1200420220200008, 0x0002050108030422, 0x2040020209048080, 0x00A0004020884200,
+        0x02406C124202000C, 0x4206200202320028, 0x1020020248010401, 0x40203104010A4143,
+        0x2802220842184000, 0x0000004414010800, 0x0802000100880400, 0x0000500004840404,
+        0x1144418908130408, 0x00000021120E0604, 0x0005401001120090, 0x6408080808002A24
+        ], dtype=np.uint64)
+
+def compute_magic_tables(magics, directions):
+    # Returns (masks, shifts, offsets, attacks), with the attack tables of all squares concatenated
+    masks = np.zeros(64, dtype=np.uint64)
+    shifts = np.zeros(64, dtype=np.uint8)
+    offsets = np.zeros(64, dtype=np.uint32)
+    attack_tables = []
+    offset = 0
+    for i in range(64):
+        mask = compute_blocker_mask(i, directions)
+        bits = bin(mask).count("1")
+        occs = compute_occupancies(mask)
+        table = np.zeros(1 << bits, dtype=np.uint64)
+        table[(occs * magics[i]) >> np.uint64(64 - bits)] = compute_slider_attacks(i, occs, directions)
+        masks[i], shifts[i], offsets[i] = mask, 64 - bits, offset
+        attack_tables.append(table)
+        offset += len(table)
+    return masks, shifts, offsets, np.concatenate(attack_tables)
+
+ROOK_MASKS, ROOK_SHIFTS, ROOK_OFFSETS, ROOK_ATTACKS = cached(
+        ("ROOK_MASKS", "ROOK_SHIFTS", "ROOK_OFFSETS", "ROOK_ATTACKS"),
+        lambda: compute_magic_tables(ROOK_MAGICS, ROOK_DIRECTIONS))
+BISHOP_MASKS, BISHOP_SHIFTS, BISHOP_OFFSETS, BISHOP_ATTACKS = cached(
+        ("BISHOP_MASKS", "BISHOP_SHIFTS", "BISHOP_OFFSETS", "BISHOP_ATTACKS"),
+        lambda: compute_magic_tables(BISHOP_MAGICS, BISHOP_DIRECTIONS))
+
+
+# ZOBRIST KEYS
+# Random bitstrings XOR'd together to hash a position (see ChessBoard.hash)
+# Seeded so that hashes are reproducible across runs and processes
+
+ZOBRIST_SEED = 0x5EED
+
+def compute_zobrist_keys():
+    # Returns (piece keys, black to move key), the latter as a 0-d array so that it can be cached
+    rng = np.random.default_rng(ZOBRIST_SEED)
+    pieces = rng.integers(
+            0, np.iinfo(np.uint64).max,
+            size=(2,6,64), # indexed by color, piece, square index
+            dtype=np.uint64,
+            endpoint=True)
+    black_to_move = rng.integers(
+            0, np.iinfo(np.uint64).max,
+            dtype=np.uint64,
+            endpoint=True)
+    return pieces, np.array(black_to_move)
+
+ZOBRIST_PIECES, ZOBRIST_BLACK_TO_MOVE = cached(("ZOBRIST_PIECES", "ZOBRIST_BLACK_TO_MOVE"), compute_zobrist_keys)
+ZOBRIST_BLACK_TO_MOVE = ZOBRIST_BLACK_TO_MOVE[()]
+
+
+# EVALUATION TABLES
+# Plain int scores that ChessBoard keeps running totals of (see ChessBoard.material / ChessBoard.psq)
+
+PIECE_VALUES = [
+        int(Score.PAWN.value),
+        int(Score.KNIGHT.value),
+        int(Score.BISHOP.value),
+        int(Score.ROOK.value),
+        int(Score.QUEEN.value),
+        0] # indexed by piece, the king is never captured
+
+# Piece-square tables, indexed by piece then square index
+# Currently every piece gets the same bonus for standing in the center
+PIECE_SQUARE = [
+        [int(Score.CENTER.value) if (int(CENTER) >> i) & 1 else 0 for i in range(64)]
+        for _ in Piece]
+
+
+if _cache_stale:
+    save_cache(CACHE_PATH, _tables)
+
+
+# BACKEND CONVERSION
+# Python ints index lists much faster than numpy arrays, so the int backend gets plain lists
+
+if backend.NAME == backend.INT:
+    EMPTY_BB = 0
+    A1H8_DIAG = int(A1H8_DIAG)
+    H1A8_ANTIDIAG = int(H1A8_ANTIDIAG)
+    CENTER = int(CENTER)
+    ZOBRIST_BLACK_TO_MOVE = int(ZOBRIST_BLACK_TO_MOVE)
+
+SQUARES = backend.to_table(SQUARES)
+RANKS = backend.to_table(RANKS)
+FILES = backend.to_table(FILES)
+RANK_MASKS = backend.to_table(RANK_MASKS)
+FILE_MASKS = backend.to_table(FILE_MASKS)
+DIAG_MASKS = backend.to_table(DIAG_MASKS)
+ANTIDIAG_MASKS = backend.to_table(ANTIDIAG_MASKS)
+KING_MOVES = backend.to_table(KING_MOVES)
+KNIGHT_MOVES = backend.to_table(KNIGHT_MOVES)
+PAWN_QUIETS = backend.to_table(PAWN_QUIETS)
+PAWN_PUSHES = backend.to_table(PAWN_PUSHES)
+PAWN_ATTACKS = backend.to_table(PAWN_ATTACKS)
+FIRST_RANK_MOVES = backend.to_table(FIRST_RANK_MOVES)
+BETWEEN = backend.to_table(BETWEEN)
+ROOK_MAGICS = backend.to_table(ROOK_MAGICS)
+ROOK_MASKS = backend.to_table(ROOK_MASKS)
+ROOK_SHIFTS = backend.to_table(ROOK_SHIFTS)
+ROOK_OFFSETS = backend.to_table(ROOK_OFFSETS)
+ROOK_ATTACKS = backend.to_table(ROOK_ATTACKS)
+BISHOP_MAGICS = backend.to_table(BISHOP_MAGICS)
+BISHOP_MASKS = backend.to_table(BISHOP_MASKS)
+BISHOP_SHIFTS = backend.to_table(BISHOP_SHIFTS)
+BISHOP_OFFSETS = backend.to_table(BISHOP_OFFSETS)
+BISHOP_ATTACKS = backend.to_table(BISHOP_ATTACKS)
+ZOBRIST_PIECES = backend.to_table(ZOBRIST_PIECES)
@@ -0,0 +1,151 @@
+from enum import IntEnum
+import multiprocessing
+import numpy as np
+
+from move import NO_MOVE
+
+"""
+Fixed-size transposition table keyed by the Zobrist hash of a position (see ChessBoard.hash)
+
+Entries live in parallel numpy arrays, so the table never grows past the size it was created with.
+Each slot holds a single entry; on collision the new entry replaces the old one if the old one
+is from a previous search, or was searched to a depth no greater than the new one.
+"""
+
+DEFAULT_SIZE_MB = 16
+
+class Bound(IntEnum):
+    EXACT = 0 # score is the true negamax score
+    LOWER = 1 # search failed high, true score >= score
+    UPPER = 2 # search failed low, true score <= score
+
+# Per entry fields, largest first so that arrays packed into a single buffer stay aligned
+FIELDS = [
+    ("keys", np.uint64),
+    ("scores", np.int32),
+    ("moves", np.uint16),
+    ("depths", np.int8),
+    ("bounds", np.uint8),
+    ("ages", np.uint8)]
+
+ENTRY_BYTES = sum(np.dtype(t).itemsize for _, t in FIELDS)
+
+def table_size(size_mb):
+    """
+    Returns the number of slots for a table capped at size_mb megabytes
+    The number of slots is the largest power of 2 that fits in the cap
+    """
+    max_entries = int(size_mb * 1024 * 1024) // ENTRY_BYTES
+    if max_entries < 1:
+        raise ValueError("Transposition table size too small: %s MB" % size_mb)
+    return 1 << (max_entries.bit_length() - 1)
+
+class TranspositionTable(object):
+    def __init__(self, size_mb=DEFAULT_SIZE_MB):
+        """
+        size_mb is the memory cap for the table in megabytes
+        """
+        self.size = table_size(size_mb)
+        self.mask = self.size - 1
+        self.allocate()
+        self.depths.fill(-1) # -1 marks an empty slot
+        self.age = 0
+
+    def allocate(self, buffer=None):
+        """
+        Creates the entry arrays, packed one after another in buffer if one is given
+        """
+        offset = 0
+        for name, dtype in FIELDS:
+            if buffer is None:
+                arr = np.zeros(self.size, dtype=dtype)
+            else:
+                arr = np.frombuffer(buffer, dtype=dtype, count=self.size, offset=offset)
+            setattr(self, name, arr)
+            offset += self.size * np.dtype(dtype).itemsize
+
+    def nbytes(self):
+        return self.size * ENTRY_BYTES
+
+    def clear(self):
+        self.depths.fill(-1)
+        self.age = 0
+
+    def new_search(self):
+        """
+        Marks existing entries as stale, so they get replaced in preference to entries from the current search
+        """
+        self.age = (self.age + 1) & 0xFF
+
+    def probe(self, key):
+        """
+        Returns (depth, bound, score, move) stored for key, or None if there's no entry
+        move is None if no best move was stored
+        """
+        i = int(key) & self.mask
+        if self.depths[i] < 0 or self.keys[i] != key:
+            return None
+        move = int(self.moves[i])
+        return int(self.depths[i]), Bound(self.bounds[i]), self.scores[i], move if move else None
+
+    def store(self, key, depth, bound, score, move=None):
+        i = int(key) & self.mask
+        if (self.depths[i] >= 0 and self.ages[i] == self.age
+                and self.keys[i] != key and self.depths[i] > depth):
+            return # keep the deeper entry from this search
+        self.keys[i] = key
+        self.depths[i] = depth
+        self.bounds[i] = bound
+        self.ages[i] = self.age
+        self.scores[i] = score
+        self.moves[i] = NO_MOVE if move is None else move
+
+
+def pack_entry(depth, bound, score, move_code):
+    return (depth & 0xFF) | (int(bound) << 8) | (move_code << 16) | ((int(score) & 0xFFFFFFFF) << 32)
+
+class SharedTranspositionTable(TranspositionTable):
+    """
+    Transposition table in shared memory, so several processes can probe and store into the same table
+
+    Writes aren't atomic, so two processes storing to the same slot can leave a mix of both entries.
+    To catch this, each key is stored XOR'd with the rest of its entry, and a probe only matches if they agree.
+    """
+    def __init__(self, size_mb=DEFAULT_SIZE_MB, raw=None):
+        """
+        raw is the shared buffer of an existing table (see raw attribute), e.g. passed to a worker process
+        If not given, a new shared buffer is created
+        """
+        self.size = table_size(size_mb)
+        self.mask = self.size - 1
+        create = raw is None
+        if create:
+            raw = multiprocessing.RawArray('b', self.size * ENTRY_BYTES)
+        self.raw = raw
+        self.allocate(raw)
+        if create:
+            self.depths.fill(-1)
+        self.age = 0
+
+    def probe(self, key):
+        i = int(key) & self.mask
+        depth = int(self.depths[i])
+        if depth < 0:
+            return None
+        bound, score, code = self.bounds[i], self.scores[i], int(self.moves[i])
+        if int(self.keys[i]) ^ pack_entry(depth, bound, score, code) != int(key):
+            return None
+        return depth, Bound(bound), score, code if code else None
+
+    def store(self, key, depth, bound, score, move=None):
+        i = int(key) & self.mask
+        if (self.depths[i] >= 0 and self.ages[i] == self.age
+                and self.depths[i] > depth):
+            return # keep the deeper entry from this search
+        code = NO_MOVE if move is None else move
+        self.keys[i] = int(key) ^ pack_entry(depth, bound, score, code)
+        self.depths[i] = depth
+        self.bounds[i] = bound
+        self.ages[i] = self.age
+        self.scores[i] = score
+        self.moves[i] = code
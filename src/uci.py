@@ -0,0 +1,315 @@
+import random
+import sys
+import threading
+import time
+
+from book import load_book
+from chessboard import ChessBoard, START_FEN
+from constants import Color
+from stats import SearchStats, SearchAborted
+from tablebase import load_tablebases
+from transposition import TranspositionTable, DEFAULT_SIZE_MB
+import move
+import movegen
+import moveorder
+import search
+
+"""
+Universal Chess Interface driver, for playing through a chess GUI
+
+Usage: python uci.py (then speak UCI on stdin / stdout)
+
+The search runs on a background thread, so isready and stop are answered while it's thinking. The
+transposition table and move ordering tables are kept from one go command to the next (until ucinewgame),
+so each search starts with what the previous ones found.
+
+go ponder searches the position the GUI sent, which ends with the reply we expect from the opponent,
+with no time limit. If the opponent does play that move the GUI sends ponderhit, and the search carries on
+with the normal time limit counted from then. Otherwise it sends stop, and we search the new position as usual.
+In ponder and infinite mode, bestmove is held back until ponderhit or stop as the protocol requires.
+
+Otherwise, if the position is in the opening book (see book.py), the book move is played without searching.
+Endgame tablebases (see tablebase.py) are probed during the search when there are any.
+"""
+
+NAME = "Snakefish"
+AUTHOR = "the Snakefish authors"
+
+MAX_HASH_MB = 1024
+MOVES_TO_GO = 30 # moves the remaining time is shared between, when the GUI doesn't say
+INCREMENT_FRACTION = 0.8 # part of the increment that's spent on each move
+MIN_TIME = 0.05 # seconds, the least time spent on a move, to allow for overhead
+
+def time_limit(limits, color):
+    """
+    Seconds to spend on the move given the parameters of a go command, or None for no limit
+    """
+    if "movetime" in limits:
+        return max(limits["movetime"] / 1000.0, MIN_TIME)
+    remaining = limits.get("wtime" if color == Color.WHITE else "btime")
+    if remaining is None:
+        return None
+    increment = limits.get("winc" if color == Color.WHITE else "binc", 0)
+    budget = remaining / limits.get("movestogo", MOVES_TO_GO) + increment * INCREMENT_FRACTION
+    return max(min(budget, remaining / 2) / 1000.0, MIN_TIME)
+
+def format_score(score, pv_plies):
+    """
+    The score of an info line: "cp N", or "mate N" for decisive scores, in moves and negative when getting mated
+    The search doesn't count plies to mate, so they're the plies along the principal variation (pv_plies) to the
+    position where the score was found, plus the plies to mate from there for a tablebase score
+    """
+    if abs(score) < search.DECISIVE_SCORE:
+        return "cp %d" % score
+    if abs(score) > search.TABLEBASE_WIN:
+        plies = pv_plies # the principal variation ends in checkmate
+    else:
+        plies = pv_plies + search.TABLEBASE_WIN - abs(score)
+    moves = (plies + 1) // 2
+    return "mate %d" % (moves if score > 0 else -moves)
+
+def parse_go(tokens):
+    """
+    Returns the go command's parameters as a dict, e.g. {"wtime": 60000, "ponder": True}
+    """
+    limits = {}
+    i = 0
+    while i < len(tokens):
+        name = tokens[i]
+        if name in ("ponder", "infinite"):
+            limits[name] = True
+        elif name in ("wtime", "btime", "winc", "binc", "movestogo", "depth", "nodes", "movetime"):
+            if i + 1 < len(tokens):
+                try:
+                    limits[name] = int(tokens[i + 1])
+                except ValueError:
+                    pass
+            i += 1
+        i += 1
+    return limits
+
+
+class UciEngine(object):
+    def __init__(self, output=None):
+        """
+        output is called with each line to send to the GUI, defaults to printing to stdout
+        """
+        self.output = output
+        self.output_lock = threading.Lock()
+        self.board = ChessBoard.from_fen(START_FEN)
+        self.tt = TranspositionTable(DEFAULT_SIZE_MB)
+        self.ordering = moveorder.MoveOrdering()
+        self.options = search.SearchOptions(tablebases=load_tablebases())
+        self.thread = None
+        self.stats = None
+        self.release = threading.Event() # set once bestmove may be sent
+        self.limits = {}
+        self.deadline = None # for the soft time limit, checked between iterations
+        self.book = load_book()
+        self.own_book = True
+        self.rng = random.Random()
+
+    def send(self, line):
+        with self.output_lock:
+            if self.output is None:
+                print(line, flush=True)
+            else:
+                self.output(line)
+
+    def handle(self, line):
+        """
+        Handles one line of input, returns False once it's quit
+        """
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == "uci":
+            self.send("id name %s" % NAME)
+            self.send("id author %s" % AUTHOR)
+            self.send("option name Hash type spin default %d min 1 max %d" % (DEFAULT_SIZE_MB, MAX_HASH_MB))
+            self.send("option name Ponder type check default false")
+            self.send("option name OwnBook type check default true")
+            self.send("uciok")
+        elif command == "isready":
+            self.send("readyok")
+        elif command == "setoption":
+            self.set_option(args)
+        elif command == "ucinewgame":
+            self.stop()
+            self.tt.clear()
+            self.ordering.clear()
+        elif command == "position":
+            self.stop()
+            self.set_position(args)
+        elif command == "go":
+            self.stop()
+            self.go(parse_go(args))
+        elif command == "stop":
+            self.stop()
+        elif command == "ponderhit":
+            self.ponderhit()
+        elif command == "quit":
+            self.stop()
+            return False
+        return True
+
+    def set_option(self, args):
+        # setoption name <id> [value <x>], where the name may have spaces
+        if "name" not in args:
+            return
+        rest = args[args.index("name") + 1:]
+        value = None
+        if "value" in rest:
+            value = " ".join(rest[rest.index("value") + 1:])
+            rest = rest[:rest.index("value")]
+        name = " ".join(rest).lower()
+        if name == "hash" and value is not None:
+            try:
+                size_mb = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                self.send("info string bad Hash value: %s" % value)
+                return
+            self.stop()
+            self.tt = TranspositionTable(size_mb)
+        elif name == "ownbook" and value is not None:
+            self.own_book = value.lower() == "true"
+
+    def set_position(self, args):
+        # position [startpos | fen <fen>] [moves <move> ...]
+        moves = []
+        if "moves" in args:
+            moves = args[args.index("moves") + 1:]
+            args = args[:args.index("moves")]
+        try:
+            if args and args[0] == "fen":
+                board = ChessBoard.from_fen(" ".join(args[1:]))
+            else:
+                board = ChessBoard.from_fen(START_FEN)
+        except ValueError as e:
+            self.send("info string %s" % e)
+            return
+        for uci in moves:
+            try:
+                m = move.from_uci(uci)
+            except ValueError:
+                m = None
+            if m is None or m not in movegen.gen_legal_moves(board):
+                self.send("info string illegal move: %s" % uci)
+                break
+            board.make_move(m)
+        self.board = board
+
+    def go(self, limits):
+        if (self.own_book and self.book is not None
+                and not limits.get("ponder") and not limits.get("infinite")):
+            m = self.book.pick(self.board, self.rng)
+            if m is not None:
+                self.send("info string book move")
+                self.send("bestmove %s" % move.to_uci(m))
+                return
+        self.limits = limits
+        self.stats = SearchStats()
+        self.release.clear()
+        if limits.get("ponder") or limits.get("infinite"):
+            self.deadline = None
+        else:
+            self.start_clock()
+            self.release.set()
+        self.thread = threading.Thread(target=self.think, args=(self.board.copy(), self.stats))
+        self.thread.daemon = True
+        self.thread.start()
+
+    def start_clock(self):
+        """
+        Sets the time and node limits from the go command, counting from now
+        """
+        limit = time_limit(self.limits, self.board.color)
+        now = time.perf_counter()
+        self.deadline = now + limit * search.ITERATION_TIME_FRACTION if limit is not None else None
+        self.stats.set_limits(now + limit if limit is not None else None, self.limits.get("nodes"))
+
+    def ponderhit(self):
+        if self.thread is None or self.release.is_set():
+            return
+        if not self.limits.get("infinite"):
+            self.limits = dict(self.limits, ponder=False)
+            self.start_clock()
+            self.release.set()
+
+    def stop(self):
+        """
+        Stops the search if there's one, and waits for it to send bestmove
+        """
+        if self.thread is None:
+            return
+        self.stats.stop()
+        self.release.set()
+        self.thread.join()
+        self.thread = None
+
+    def principal_variation(self, board, first, depth):
+        """
+        Follows best moves in the transposition table from the position after first, up to depth moves in all
+        """
+        pv = [first]
+        board.make_move(first)
+        while len(pv) < depth:
+            entry = self.tt.probe(board.hash)
+            if entry is None or entry[3] is None:
+                break
+            m = entry[3]
+            if not movegen.is_pseudo_legal(board, m) or not movegen.CheckInfo(board).is_legal(board, m):
+                break
+            pv.append(m)
+            board.make_move(m)
+        for _ in pv:
+            board.unmake_move()
+        return pv
+
+    def think(self, board, stats):
+        """
+        Runs on the search thread: iteratively deepens until a limit is hit or the search is stopped,
+        then sends bestmove once released (see go)
+        """
+        max_depth = self.limits.get("depth", search.MAX_DEPTH)
+        best, pv = None, []
+        try:
+            for depth, score, m in search.iterative_deepening(board, max_depth, self.tt, self.options, stats,
+                    self.ordering):
+                best = m
+                pv = self.principal_variation(board, m, depth)
+                elapsed = stats.elapsed()
+                # at depth 0 the tablebases scored the root itself, so their distance to mate counts from there
+                pv_plies = len(pv) if depth > 0 else 0
+                self.send("info depth %d score %s nodes %d nps %d time %d pv %s" % (depth,
+                        format_score(score, pv_plies), stats.nodes, stats.nps(), elapsed * 1000,
+                        " ".join(move.to_uci(p) for p in pv)))
+                if self.deadline is not None and time.perf_counter() > self.deadline:
+                    break
+        except SearchAborted:
+            # unwind the moves made by the interrupted iteration
+            while board.history:
+                board.unmake_move()
+        if best is None:
+            moves = list(movegen.gen_legal_moves(board))
+            best = moves[0] if moves else None
+        self.release.wait()
+        if best is None:
+            self.send("bestmove 0000")
+        elif len(pv) > 1:
+            self.send("bestmove %s ponder %s" % (move.to_uci(best), move.to_uci(pv[1])))
+        else:
+            self.send("bestmove %s" % move.to_uci(best))
+
+
+def main():
+    engine = UciEngine()
+    for line in sys.stdin:
+        if not engine.handle(line):
+            break
+    engine.stop()
+
+
+if __name__ == "__main__":
+    main()
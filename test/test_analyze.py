@@ -0,0 +1,27 @@
+import io
+
+from chessboard import ChessBoard
+import analyze
+
+POSITIONS = """# mate in one, a stalemate and a bad line
+6k1/5ppp/8/8/8/8/8/R5K1 w - - id "back rank";
+
+7k/5Q2/6K1/8/8/8/8/8 b - - id "stalemate";
+8/8/8 w - - id "bad";
+"""
+
+def run(workers):
+    results = []
+    count, errors = analyze.analyze(io.StringIO(POSITIONS), results.append, depth=2, workers=workers, tt_mb=1)
+    assert (count, errors) == (2, 1)
+    return {ops["id"]: ops for _, ops in map(ChessBoard.from_epd, results)}
+
+def test_analyze():
+    results = run(1)
+    assert results["back rank"]["bm"] == "a1a8"
+    assert results["back rank"]["acd"] == "2"
+    assert int(results["back rank"]["acn"]) > 0
+    assert results["stalemate"] == {"id": "stalemate", "ce": "0"}
+
+def test_analyze_parallel():
+    assert {k: v["bm"] for k, v in run(2).items() if "bm" in v} == {"back rank": "a1a8"}
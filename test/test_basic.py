@@ -1,10 +1,173 @@
+import copy
+import os
+import subprocess
+import sys
 import numpy as np
+import pytest
 
+import backend
 import bitboard
+import movegen
+import tables
+from chessboard import ChessBoard, START_FEN
+import move
+from move import Move
+from constants import Color, Piece
+from square import Square
 
 def test_bitscan():
-    assert bitboard.lsb_bitscan(np.uint64(0xF000000000000000)) == np.uint8(60)
-    assert bitboard.msb_bitscan(np.uint64(0xF000000000000000)) == np.uint8(63)
+    assert bitboard.lsb_bitscan(backend.BB(0xF000000000000000)) == 60
+    assert bitboard.msb_bitscan(backend.BB(0xF000000000000000)) == 63
 
 def test_popcount():
-    assert bitboard.pop_count(np.uint64(0xF0000F00000F0000)) == np.uint8(12)
+    assert bitboard.pop_count(backend.BB(0xF0000F00000F0000)) == 12
+
+def test_primitives_agree():
+    rng = np.random.default_rng(2)
+    values = [int(x) for x in rng.integers(1, 2**64 - 1, size=50, dtype=np.uint64, endpoint=True)]
+    values += [1, 1 << 63, 0xFFFFFFFFFFFFFFFF]
+    for v in values:
+        bb = np.uint64(v)
+        assert bitboard.lsb_bitscan_numpy(bb) == bitboard.lsb_bitscan_via_int(bb) == bitboard.lsb_bitscan_int(v)
+        assert bitboard.msb_bitscan_numpy(bb) == bitboard.msb_bitscan_via_int(bb) == bitboard.msb_bitscan_int(v)
+        assert bitboard.pop_count_numpy(bb) == bitboard.pop_count_via_int(bb) == bitboard.pop_count_int(v)
+
+def test_make_unmake():
+    b = ChessBoard()
+    b.init_game()
+    pieces = copy.deepcopy(b.pieces)
+    combined_color = copy.deepcopy(b.combined_color)
+    combined_all, h, color = b.combined_all, b.hash, b.color
+
+    moves = ["E2E4", "D7D5", "E4D5", "D8D5", "B1C3"]
+    for m in moves:
+        move = Move(Square.from_str(m[:2]), Square.from_str(m[2:])).to_int()
+        expected = b.apply_move(move)
+        b.make_move(move)
+        assert np.array_equal(b.pieces, expected.pieces)
+        assert np.array_equal(b.combined_color, expected.combined_color)
+        assert b.combined_all == expected.combined_all
+        assert b.hash == expected.hash
+        assert b.color == expected.color
+
+    for _ in moves:
+        b.unmake_move()
+    assert np.array_equal(b.pieces, pieces)
+    assert np.array_equal(b.combined_color, combined_color)
+    assert (b.combined_all, b.hash, b.color) == (combined_all, h, color)
+    assert b.history == []
+
+def test_copy_and_hash():
+    b = ChessBoard()
+    b.init_game()
+    c = b.copy()
+    assert c == b and hash(c) == hash(b)
+    assert ChessBoard.from_tuple(b.to_tuple()) == b
+
+    e4 = Move(Square.from_str("E2"), Square.from_str("E4")).to_int()
+    c.make_move(e4)
+    assert c != b and b.piece_on(Square.from_str("E4")) is None
+    assert c == b.apply_move(e4)
+    c.unmake_move()
+    assert c == b and len({b, c}) == 1
+
+def test_null_move():
+    b = ChessBoard()
+    b.init_game()
+    c = b.copy()
+    b.make_null_move()
+    assert b.color == Color.BLACK and b.hash == b.compute_hash() and b != c
+    assert b.unmake_move() is None
+    assert b == c and b.history == []
+
+def test_mailbox():
+    b = ChessBoard()
+    b.init_game()
+    plain = ChessBoard(mailbox=False)
+    plain.init_game()
+    assert plain.mailbox is None
+
+    moves = ["E2E4", "D7D5", "E4D5", "D8D5", "B1C3", "D5A2", "C3B5", "A2A1"]
+    for m in moves:
+        move = Move(Square.from_str(m[:2]), Square.from_str(m[2:])).to_int()
+        b.make_move(move)
+        plain.make_move(move)
+        assert b == plain
+        for c in (b.color, ~b.color):
+            assert [b.piece_at(i, c) for i in range(64)] == [plain.piece_at(i, c) for i in range(64)]
+    for _ in moves:
+        b.unmake_move()
+    fresh = ChessBoard()
+    fresh.init_game()
+    assert b.mailbox == fresh.mailbox
+
+def test_fen():
+    b = ChessBoard()
+    b.init_game()
+    assert ChessBoard.from_fen(START_FEN) == b
+    assert b.to_fen() == START_FEN
+
+    fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R b KQkq - 3 12"
+    b = ChessBoard.from_fen(fen)
+    assert b.color == Color.BLACK and b.piece_on(Square.from_str("E5"), Color.WHITE) == Piece.KNIGHT
+    assert ChessBoard.from_fen(b.to_fen()) == b
+    for bad in ["8/8/8/8/8/8/8/8 w - - 0 1", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP w - - 0 1",
+            "rnbqkbnr/pppppppp/9/8/8/8/PPPPPPPP/RNBQKBNR w - -", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR x - -"]:
+        with pytest.raises(ValueError):
+            ChessBoard.from_fen(bad)
+
+def test_epd():
+    b, ops = ChessBoard.from_epd('4k3/8/8/8/8/8/8/R3K3 w - - bm a1a8 a1a7; id "mate 1"; c0 "a;b"; noop;')
+    assert ops == {"bm": "a1a8 a1a7", "id": "mate 1", "c0": "a;b", "noop": ""}
+    assert b.to_epd(ops) == '4k3/8/8/8/8/8/8/R3K3 w - - bm a1a8 a1a7; id "mate 1"; c0 "a;b"; noop;'
+    assert ChessBoard.from_epd(b.to_epd(ops)) == (b, ops)
+    assert move.from_uci(ops["bm"].split()[0]) == move.encode(0, 56)
+    assert move.to_uci(move.encode(52, 60, Piece.QUEEN)) == "e7e8q"
+
+def test_popcount_array():
+    arr = np.array([[0, 1, 0xFFFFFFFFFFFFFFFF], [0xF0000F00000F0000, 255, 1 << 63]], dtype=np.uint64)
+    assert bitboard.pop_count_array(arr).tolist() == [[0, 1, 64], [12, 8, 1]]
+    assert bitboard.pop_count_array_bytes(arr).tolist() == [[0, 1, 64], [12, 8, 1]]
+    assert bitboard.pop_count_array(arr).dtype == np.int32
+
+def test_magic_attacks():
+    # magic lookups must agree with the per-line FIRST_RANK_MOVES lookups for any occupancy
+    rng = np.random.default_rng(1)
+    random_bbs = rng.integers(0, 2**64 - 1, size=(20, 2), dtype=np.uint64, endpoint=True)
+    occs = [backend.BB(int(a & b)) for a, b in random_bbs] + [backend.BB(0), backend.FULL_BB]
+    for occ in occs:
+        for i in range(64):
+            i = backend.INDEX(i)
+            assert movegen.get_rook_attacks_bb(i, occ) == movegen.get_rank_moves_bb(i, occ) ^ movegen.get_file_moves_bb(i, occ)
+            assert movegen.get_bishop_attacks_bb(i, occ) == movegen.get_diag_moves_bb(i, occ) ^ movegen.get_antidiag_moves_bb(i, occ)
+
+def test_table_cache(tmp_path, monkeypatch):
+    path = str(tmp_path / "tables.npz")
+    assert tables.load_cache(path) is None
+    tables.save_cache(path, {"KING_MOVES": np.asarray(tables.KING_MOVES, dtype=np.uint64)})
+    loaded = tables.load_cache(path)
+    assert list(loaded) == ["KING_MOVES"]
+    assert loaded["KING_MOVES"].tolist() == np.asarray(tables.KING_MOVES, dtype=np.uint64).tolist()
+    monkeypatch.setattr(tables, "TABLES_VERSION", tables.TABLES_VERSION + 1)
+    assert tables.load_cache(path) is None
+
+def test_tables_from_cache(tmp_path):
+    # the first import generates and saves the tables, the second loads them
+    env = dict(os.environ, SNAKEFISH_TABLE_CACHE=str(tmp_path / "tables.npz"))
+    env["PYTHONPATH"] = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    code = ("import tables; print(tables._cache is None, int(tables.ZOBRIST_BLACK_TO_MOVE), "
+            "int(sum(int(x) for x in tables.ROOK_ATTACKS[:1000])))")
+    runs = [subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+            .stdout.split() for _ in range(2)]
+    assert runs[0][0] == "True" and runs[1][0] == "False"
+    assert runs[0][1:] == runs[1][1:] == [str(int(tables.ZOBRIST_BLACK_TO_MOVE)),
+            str(sum(int(x) for x in tables.ROOK_ATTACKS[:1000]))]
+
+def test_move_encoding():
+    m = Move(Square.from_str("B7"), Square.from_str("A8"), Piece.KNIGHT)
+    code = m.to_int()
+    assert code == move.encode(49, 56, Piece.KNIGHT) < 1 << 16
+    assert (move.get_src(code), move.get_dest(code), move.get_promo(code)) == (49, 56, Piece.KNIGHT)
+    assert Move.from_int(code) == m
+    assert move.to_str(code) == str(m) == "B7 -> A8 = KNIGHT"
+    assert move.get_promo(move.encode(12, 28)) is None
@@ -0,0 +1,36 @@
+from chessboard import ChessBoard
+from stats import SearchStats
+import bench
+import search
+
+def test_start_position():
+    b = ChessBoard()
+    b.init_game()
+    start = ChessBoard.from_fen(bench.POSITIONS["start"])
+    assert start.to_tuple() == b.to_tuple()
+    assert start.hash == b.hash
+
+def test_compare():
+    baseline = {"results": {"start": {"perft": {"nps": 1000.0}, "search": {"nps": 10.0}}}}
+    report = {"results": {
+        "start": {"perft": {"nps": 850.0}, "search": {"nps": 9.5}, "evaluate": {"nps": 1.0}},
+        "endgame": {"perft": {"nps": 1.0}}}}
+    assert bench.compare(report, baseline, 0.1) == [("start", "perft", 1000.0, 850.0)]
+    assert bench.compare(report, baseline, 0.2) == []
+
+def test_quick_run():
+    report = bench.run_benchmarks(bench.SETTINGS["quick"], {"endgame": bench.POSITIONS["endgame"]})
+    phases = report["results"]["endgame"]
+    assert set(phases) == {"movegen", "apply_move", "evaluate", "sliders_magic", "sliders_first_rank", "search",
+            "search_full_width", "perft"}
+    assert all(r["nodes"] > 0 and r["time"] > 0 for r in phases.values())
+    assert "pop_count" in report["results"]["primitives"]
+    assert bench.compare(report, report) == []
+
+def test_search_nodes():
+    # the search phase reports the nodes actually searched, so its nps is comparable across runs
+    board = ChessBoard.from_fen(bench.POSITIONS["endgame"])
+    stats = SearchStats()
+    search.best_move(board, 2, stats=stats)
+    assert stats.nodes > 1
+    assert bench.bench_search(board, 2)["nodes"] == stats.nodes
@@ -0,0 +1,65 @@
+import random
+import pytest
+
+from chessboard import ChessBoard, START_FEN
+from move import to_uci, from_uci
+import book
+import uci
+
+PGN = """[Event "one"]
+[Result "1-0"]
+
+1. e4 e5 2. Nf3 {main line} Nc6 (2... d6 3. d4) 3. Bb5 a6 4. O-O Nf6 1-0
+
+1. e4 c5 2. Nf3 d6 3. d4 cxd4 4. Nxd4 Nf6 5. Nc3 a6 *
+1.d4 d5 2.c4 e6 $1 1/2-1/2
+"""
+
+def test_parse_san():
+    b = ChessBoard.from_fen("r3k3/1P6/8/8/8/8/2N1N3/4K3 w - - 0 1")
+    assert to_uci(book.parse_san(b, "bxa8=Q+")) == "b7a8q"
+    assert to_uci(book.parse_san(b, "b8N")) == "b7b8n"
+    assert to_uci(book.parse_san(b, "Ned4")) == "e2d4"
+    assert to_uci(book.parse_san(b, "Nxe3")) == "c2e3"
+    for bad in ["Nd4", "O-O", "Qd1", "e9"]:
+        with pytest.raises(ValueError):
+            book.parse_san(b, bad)
+
+def test_read_pgn():
+    games = list(book.read_pgn(PGN.splitlines()))
+    assert [len(moves) for _, moves in games] == [8, 10, 4]
+    assert games[0][0]["Event"] == "one"
+    assert games[0][1][:4] == ["e4", "e5", "Nf3", "Nc6"]
+
+def test_book(tmp_path):
+    pgn = tmp_path / "games.pgn"
+    pgn.write_text(PGN)
+    epd = tmp_path / "positions.epd"
+    epd.write_text("%s bm d2d4 Nf3;\n" % START_FEN.rsplit(" ", 2)[0])
+    path = str(tmp_path / "book.bin")
+    book.write_book(path, book.build([str(pgn), str(epd)]))
+
+    opening_book = book.load_book(path)
+    start = ChessBoard.from_fen(START_FEN)
+    assert [(to_uci(m), w) for m, w in opening_book.moves(start)] == [("d2d4", 2), ("e2e4", 2), ("g1f3", 1)]
+    assert to_uci(opening_book.pick(start, random.Random(1))) in ("e2e4", "d2d4", "g1f3")
+
+    # the book stops at castling
+    b = ChessBoard.from_fen("r1bqkbnr/1ppp1ppp/p1n5/1B2p3/4P3/5N2/PPPP1PPP/RNBQK2R w - - 0 1")
+    assert opening_book.pick(b) is None
+    assert book.load_book(str(tmp_path / "missing.bin")) is None
+    with pytest.raises(ValueError):
+        book.OpeningBook(str(pgn))
+
+def test_uci_book(tmp_path):
+    path = str(tmp_path / "book.bin")
+    book.write_book(path, {(int(ChessBoard.from_fen(START_FEN).hash), from_uci("e2e4")): 1})
+    out = []
+    engine = uci.UciEngine(out.append)
+    engine.book = book.load_book(path)
+    engine.handle("go wtime 1000 btime 1000")
+    assert engine.thread is None and out[-1] == "bestmove e2e4"
+    engine.handle("position startpos moves e2e4")
+    engine.handle("go depth 1")
+    engine.thread.join()
+    assert out[-1].startswith("bestmove") and out[-1] != "bestmove e2e4"
@@ -0,0 +1,59 @@
+import numpy as np
+
+from chessboard import ChessBoard
+from constants import Color
+from square import Square
+import bench
+import evaluation
+import movegen
+import moveorder
+
+def test_batch_matches_evaluate():
+    # Early in the game no pieces share targets, so the mobility approximation is exact
+    b = ChessBoard()
+    b.init_game()
+    boards = [b]
+    for m in list(movegen.gen_legal_moves(b)):
+        boards.append(b.apply_move(m))
+
+    pieces = np.array([board.pieces for board in boards], dtype=np.uint64)
+    colors = [board.color for board in boards]
+    scores = evaluation.evaluate_batch(pieces, colors)
+    assert scores.shape == (len(boards),)
+    assert list(scores) == [evaluation.evaluate(board) for board in boards]
+
+def test_batch_side_to_move():
+    b = ChessBoard()
+    b.init_game()
+    b.clear_square(Square.from_str("D8"), Color.BLACK)
+    for color in Color:
+        b.color = color
+        assert evaluation.evaluate_batch([b.pieces], [color])[0] == evaluation.evaluate(b)
+
+def test_incremental_scores():
+    def check(b):
+        fresh = ChessBoard.from_tuple(b.to_tuple())
+        assert (b.material, b.psq) == (fresh.material, fresh.psq)
+
+    # promotions, with and without a capture
+    b = ChessBoard.from_fen("rn2k3/1P6/8/8/8/8/8/4K3 w - -")
+    start = (b.material[:], b.psq[:])
+    for m in list(movegen.gen_legal_moves(b)):
+        b.make_move(m)
+        check(b)
+        b.unmake_move()
+    assert (b.material, b.psq) == start
+
+    # kiwipete has captures available for both sides
+    b = ChessBoard.from_fen(bench.POSITIONS["midgame"])
+    start = (b.material[:], b.psq[:])
+    for i in range(40):
+        moves = list(movegen.gen_legal_moves(b))
+        if not moves:
+            break
+        captures = [m for m in moves if not moveorder.is_quiet(b, m)]
+        b.make_move((captures or moves)[i % len(captures or moves)])
+        check(b)
+    while b.history:
+        b.unmake_move()
+    assert (b.material, b.psq) == start
@@ -0,0 +1,50 @@
+from chessboard import ChessBoard
+from move import Move
+from square import Square
+import bench
+import movegen
+import moveorder
+
+def kiwipete():
+    return ChessBoard.from_fen(bench.POSITIONS["midgame"])
+
+def move(st):
+    return Move(Square.from_str(st[:2]), Square.from_str(st[2:])).to_int()
+
+def test_captures_and_quiets_partition_moves():
+    b = kiwipete()
+    captures = list(movegen.gen_captures(b))
+    quiets = list(movegen.gen_quiets(b))
+    assert sorted(captures + quiets) == sorted(movegen.gen_moves(b))
+    assert all(not moveorder.is_quiet(b, m) for m in captures)
+
+def test_staged_order():
+    b = kiwipete()
+    legal = set(movegen.gen_legal_moves(b))
+    hash_move = move("A2A3")
+    killer = move("G2G4")
+    ordering = moveorder.MoveOrdering()
+    ordering.add_cutoff(b, killer, 3)
+    ordering.add_cutoff(b, move("A1B1"), 1)
+    ordering.history[b.color][move("E1D1")] = 100
+
+    picked = list(moveorder.pick_moves(b, ordering, hash_move))
+    assert len(picked) == len(set(picked)) == len(legal)
+    assert set(picked) == legal
+
+    assert picked[0] == hash_move
+    n_captures = sum(1 for m in picked[1:] if not moveorder.is_quiet(b, m))
+    captures = picked[1:1+n_captures]
+    assert all(not moveorder.is_quiet(b, m) for m in captures)
+    scores = [moveorder.mvv_lva(b, m) for m in captures]
+    assert scores == sorted(scores, reverse=True)
+    # most recent killer first, then quiets by history score
+    assert picked[1+n_captures:3+n_captures] == [move("A1B1"), killer]
+    assert picked[3+n_captures] == move("E1D1")
+
+def test_bad_hash_move_skipped():
+    b = ChessBoard()
+    b.init_game()
+    picked = list(moveorder.pick_moves(b, None, move("E2E5")))
+    assert len(picked) == 20
+    assert move("E2E5") not in picked
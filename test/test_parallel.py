@@ -0,0 +1,24 @@
+from chessboard import ChessBoard
+from test_search import back_rank_board
+from move import to_str
+import parallel
+
+def test_board_tuple():
+    b = ChessBoard()
+    b.init_game()
+    b2 = ChessBoard.from_tuple(b.to_tuple())
+    assert b2.to_tuple() == b.to_tuple()
+    assert b2.hash == b.hash
+    assert b2.combined_all == b.combined_all
+
+def test_mate_in_one():
+    b = back_rank_board()
+    for mode, deterministic in [(parallel.ROOT_SPLIT, False), (parallel.ROOT_SPLIT, True), (parallel.LAZY_SMP, False)]:
+        with parallel.ParallelSearch(2, mode, deterministic, tt_mb=1) as searcher:
+            assert to_str(searcher.best_move(b, 2)) == "A1 -> A8"
+
+def test_deterministic():
+    b = ChessBoard()
+    b.init_game()
+    moves = [to_str(parallel.best_move(b, 2, workers=2, deterministic=True)) for _ in range(2)]
+    assert moves[0] == moves[1]
@@ -1,24 +1,93 @@
+import os
+import subprocess
+import sys
 import numpy as np
 
+import backend
+import bench
 from chessboard import ChessBoard
 import movegen
+from move import to_str
+import perft as perft_cli
+from perft import perft, divide, PerftCache
 
-def perft(board, depth):
+def reference_perft(board, depth):
+    # plain walk of the legal move tree, independent of the perft module's shortcuts
     if depth == 0:
         return 1
     count = 0
-    moves = movegen.gen_legal_moves(board)
+    moves = list(movegen.gen_legal_moves(board))
     for m in moves:
-        count += perft(board.apply_move(m), depth-1)
+        board.make_move(m)
+        count += reference_perft(board, depth-1)
+        board.unmake_move()
     return count
 
 def test_new():
     b = ChessBoard()
     b.init_game()
+    assert reference_perft(b, 0) == 1
+    assert reference_perft(b, 1) == 20
+    assert reference_perft(b, 2) == 400
+    assert reference_perft(b, 3) == 8902
     assert perft(b, 0) == 1
     assert perft(b, 1) == 20
     assert perft(b, 2) == 400
     assert perft(b, 3) == 8902
     assert perft(b, 4) == 197281
 
+def test_divide():
+    b = ChessBoard()
+    b.init_game()
+    counts = divide(b, 3)
+    assert len(counts) == 20
+    assert sum(c for _, c in counts) == 8902
+    assert dict((to_str(m), c) for m, c in counts)["G1 -> F3"] == 440
+
+    assert divide(b, 3, workers=2, cache_mb=1) == counts
+
+def test_cache():
+    b = ChessBoard()
+    b.init_game()
+    cache = PerftCache(1)
+    assert perft(b, 3, cache) == 8902
+    assert perft(b, 3, cache) == 8902
+    assert cache.hits > 0
+
+def test_cli(capsys):
+    # published counts for this position, which has no castling, nor en passant this shallow
+    perft_cli.main(["2", "--fen", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - -"])
+    assert "Nodes: 191" in capsys.readouterr().out
+    perft_cli.main(["3"])
+    assert "Nodes: 8902" in capsys.readouterr().out
+
+def test_other_backend():
+    # The backend is fixed at import, so check the other one in a fresh interpreter
+    other = backend.INT if backend.NAME == backend.NUMPY else backend.NUMPY
+    env = dict(os.environ, SNAKEFISH_BACKEND=other)
+    code = ("from chessboard import ChessBoard; from perft import perft; "
+            "b = ChessBoard(); b.init_game(); print(perft(b, 3))")
+    src = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+    env["PYTHONPATH"] = src
+    out = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "8902"
 
+def test_legal_matches_make_and_test():
+    # positions with pins, checks and double checks, walked a few plies to get more of them
+    placements = [
+        bench.POSITIONS["midgame"].split()[0],
+        bench.POSITIONS["endgame"].split()[0],
+        "4k3/8/8/1b6/8/3N4/4R3/r3K2q", # pinned knight, king in check from the rook behind the queen
+        "4k3/8/5n2/8/8/8/3b4/r3K3", # double check
+        "8/8/8/KP5r/8/8/8/7k", # pinned pawn on a rank
+    ]
+    for placement in placements:
+        for color in "wb":
+            b = ChessBoard.from_fen("%s %s - -" % (placement, color))
+            for i in range(8):
+                legal = [to_str(m) for m in movegen.gen_legal_moves(b)]
+                reference = [to_str(m) for m in movegen.filter_legal_moves(b, movegen.gen_moves(b))]
+                assert sorted(legal) == sorted(reference)
+                if not legal:
+                    break
+                b.make_move(list(movegen.gen_legal_moves(b))[(7*i) % len(legal)])
@@ -0,0 +1,173 @@
+import time
+import numpy as np
+
+from chessboard import ChessBoard
+from constants import Color, Piece
+from move import Move, to_str
+from square import Square
+import evaluation
+import movegen
+import search
+from stats import SearchStats
+from transposition import TranspositionTable
+
+# plain alpha-beta, which gives exactly the minimax score
+NO_QUIESCENCE = search.SearchOptions(quiescence=False, null_move=False, reductions=False, futility=False)
+
+def minimax(board, depth):
+    if depth == 0:
+        return evaluation.evaluate(board)
+    moves = list(movegen.gen_legal_moves(board))
+    if not moves:
+        return search.no_moves_score(board)
+    return max(-minimax(board.apply_move(m), depth-1) for m in moves)
+
+def back_rank_board():
+    b = ChessBoard()
+    b.set_square(Square.from_str("G1"), Piece.KING, Color.WHITE)
+    b.set_square(Square.from_str("A1"), Piece.ROOK, Color.WHITE)
+    b.set_square(Square.from_str("H8"), Piece.KING, Color.BLACK)
+    b.set_square(Square.from_str("G7"), Piece.PAWN, Color.BLACK)
+    b.set_square(Square.from_str("H7"), Piece.PAWN, Color.BLACK)
+    return b
+
+def test_alphabeta_matches_minimax():
+    b = ChessBoard()
+    b.init_game()
+    assert search.negamax(b, 2, options=NO_QUIESCENCE) == minimax(b, 2)
+
+    b = back_rank_board()
+    assert search.negamax(b, 2, options=NO_QUIESCENCE) == minimax(b, 2)
+
+def test_mate_in_one():
+    b = back_rank_board()
+    for depth in range(1, 4):
+        m = search.best_move(b, depth)
+        assert to_str(m) == "A1 -> A8"
+
+def test_alphabeta_with_tt_matches_minimax():
+    b = ChessBoard()
+    b.init_game()
+    tt = TranspositionTable(1)
+    assert search.negamax(b, 2, tt=tt, options=NO_QUIESCENCE) == minimax(b, 2)
+    # second search is answered from the table
+    assert search.negamax(b, 2, tt=tt, options=NO_QUIESCENCE) == minimax(b, 2)
+
+def test_mate_in_one_batch_eval():
+    b = back_rank_board()
+    assert to_str(search.best_move(b, 2, options=search.SearchOptions(batch_eval=True))) == "A1 -> A8"
+
+def test_stats():
+    b = ChessBoard()
+    b.init_game()
+    progress = []
+    stats = SearchStats(timing=True, callback=lambda s: progress.append(s.nodes), interval=100)
+    no_futility = search.SearchOptions(futility=False) # which evaluates interior nodes
+    assert (to_str(search.best_move(b, 2, options=no_futility, stats=stats))
+            == to_str(search.best_move(b, 2, options=no_futility)))
+    assert stats.nodes >= stats.leaves > 0
+    assert stats.evals == stats.qnodes >= stats.leaves
+    assert progress == list(range(100, stats.nodes + 1, 100))
+    assert stats.times["evaluate"] > 0 and stats.times["movegen"] > 0
+
+    b = back_rank_board()
+    stats = SearchStats()
+    search.negamax(b, 2, stats=stats)
+    assert stats.legality_rejects > 0 # king can't step into the rook's file
+    assert stats.cutoffs > 0
+
+def test_limited_search():
+    b = ChessBoard()
+    b.init_game()
+    h = b.hash
+    legal = [to_str(m) for m in movegen.gen_legal_moves(b)]
+
+    move, score, depth = search.limited_search(b, node_limit=50)
+    assert to_str(move) in legal
+    assert depth >= 1
+    assert b.hash == h and b.history == []
+
+    start = time.perf_counter()
+    move, score, depth = search.limited_search(b, time_limit=0.2)
+    assert time.perf_counter() - start < 0.5
+    assert to_str(move) in legal
+    assert b.hash == h and b.history == []
+
+    move, score, depth = search.limited_search(back_rank_board(), node_limit=10000, max_depth=3)
+    assert to_str(move) == "A1 -> A8"
+    assert depth == 3
+
+def test_quiescence():
+    # The d5 pawn is defended, so taking it with the queen loses the queen one ply past the horizon
+    b = ChessBoard()
+    b.set_square(Square.from_str("A1"), Piece.KING, Color.WHITE)
+    b.set_square(Square.from_str("D1"), Piece.QUEEN, Color.WHITE)
+    b.set_square(Square.from_str("H8"), Piece.KING, Color.BLACK)
+    b.set_square(Square.from_str("D5"), Piece.PAWN, Color.BLACK)
+    b.set_square(Square.from_str("E6"), Piece.PAWN, Color.BLACK)
+    assert to_str(search.best_move(b, 1, options=NO_QUIESCENCE)) == "D1 -> D5"
+
+    stats = SearchStats()
+    assert to_str(search.best_move(b, 1, stats=stats)) != "D1 -> D5"
+    assert stats.qnodes > 0
+
+def test_stalemate():
+    # Qf7 would be stalemate, Qf8 is mate
+    b = ChessBoard()
+    b.set_square(Square.from_str("G6"), Piece.KING, Color.WHITE)
+    b.set_square(Square.from_str("F1"), Piece.QUEEN, Color.WHITE)
+    b.set_square(Square.from_str("H8"), Piece.KING, Color.BLACK)
+    b.make_move(Move(Square.from_str("F1"), Square.from_str("F7")).to_int())
+    assert search.negamax(b, 1) == evaluation.Score.DRAW.value
+    b.unmake_move()
+    b.make_move(Move(Square.from_str("F1"), Square.from_str("F8")).to_int())
+    assert search.negamax(b, 1) == evaluation.Score.CHECKMATE.value
+    assert search.quiesce(b, search.MIN_SCORE, search.MAX_SCORE) == evaluation.Score.CHECKMATE.value
+
+def test_every_move_loses():
+    # black's only moves, h6 and h5, both allow Rc8#: that's a loss, not a stalemate
+    b = ChessBoard.from_fen("k7/3N3p/1K6/8/8/8/8/2R5 b - - 0 1")
+    for depth in range(2, 5):
+        assert search.negamax(b, depth) == evaluation.Score.CHECKMATE.value
+    assert search.negamax(b, 3, options=NO_QUIESCENCE) == minimax(b, 3) == evaluation.Score.CHECKMATE.value
+
+def test_futility_bound_kept():
+    # both of black's moves allow mate, which the table already knows: the first is searched and loses, the
+    # other is futile and skipped, so the node fails low with the futility bound rather than scoring a stalemate
+    b = ChessBoard.from_fen("k7/3N3p/1K6/8/8/8/8/2R5 b - - 0 1")
+    tt = TranspositionTable(1)
+    for m in movegen.gen_legal_moves(b):
+        b.make_move(m)
+        assert search.negamax(b, 1, tt=tt) == search.MAX_SCORE
+        b.unmake_move()
+    stats = SearchStats()
+    options = search.SearchOptions(null_move=False, reductions=False)
+    score = search.negamax(b, 2, -100, -99, tt=tt, options=options, stats=stats)
+    assert stats.pruned > 0
+    assert score == evaluation.evaluate(b) + search.FUTILITY_MARGINS[2] <= -100
+
+def test_selective_search():
+    fen = "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w - - 0 1"
+    def search_nodes(**options):
+        stats = SearchStats()
+        search.best_move(ChessBoard.from_fen(fen), 4, options=search.SearchOptions(**options), stats=stats)
+        return stats
+    full_width = search_nodes(null_move=False, reductions=False, futility=False).nodes
+    stats = search_nodes(reductions=False, futility=False)
+    assert stats.null_cutoffs > 0 and stats.nodes < full_width
+    stats = search_nodes(null_move=False, futility=False)
+    assert stats.reductions > 0 and stats.nodes < full_width
+    stats = search_nodes(null_move=False, reductions=False)
+    assert stats.pruned > 0 and stats.nodes < full_width
+
+    # no null moves with only pawns left, where zugzwang is common
+    b = ChessBoard.from_fen("8/2p5/3p4/KP6/5p1k/8/4P1P1/8 w - - 0 1")
+    stats = SearchStats()
+    search.best_move(b, 4, options=search.SearchOptions(reductions=False, futility=False), stats=stats)
+    assert stats.null_cutoffs == 0
+
+    # the mate is still found, and the board is restored after null moves
+    b = back_rank_board()
+    h = b.hash
+    assert to_str(search.best_move(b, 4)) == "A1 -> A8"
+    assert b.hash == h and b.history == []
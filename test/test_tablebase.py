@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from chessboard import ChessBoard
+import search
+import tablebase
+
+@pytest.fixture(scope="module")
+def tablebases(tmp_path_factory):
+    directory = str(tmp_path_factory.mktemp("tablebases"))
+    tablebase.generate("KQvK", directory)
+    return tablebase.Tablebases(directory)
+
+def test_signatures():
+    assert tablebase.dependencies("KPvK") == ["KQvK", "KRvK"]
+    assert tablebase.dependencies("KQvKR") == ["KQvK", "KRvK"]
+    for bad in ["KvKQ", "KQK", "QKvK", "KQRvKR"]:
+        with pytest.raises(ValueError):
+            tablebase.parse_signature(bad)
+
+def test_solve_external_moves():
+    # position 1's only move leaves the table into a mate in 1 for the opponent, and position 0's only move is to 1
+    none = tablebase.MAX_PLIES + 1
+    values = tablebase.solve(np.array([True, True]), np.array([False, False]), np.array([0, 1, 1]),
+            np.array([1], dtype=np.int32), np.array([none, none], dtype=np.int16), np.array([False, False]),
+            np.array([-1, 2], dtype=np.int16))
+    assert list(values) == [3, -3] # win in 3 plies, loss in 2
+
+    # a capture into a lost position for the opponent wins in 1
+    values = tablebase.solve(np.array([True]), np.array([False]), np.array([0, 0]), np.array([], dtype=np.int32),
+            np.array([1], dtype=np.int16), np.array([False]), np.array([-1], dtype=np.int16))
+    assert list(values) == [1]
+
+def test_probe(tablebases):
+    def probe(fen):
+        return tablebases.probe(ChessBoard.from_fen(fen))
+    assert probe("7k/6Q1/6K1/8/8/8/8/8 b - -") == (tablebase.LOSS, 0)
+    assert probe("8/8/8/8/8/6k1/6q1/7K w - -") == (tablebase.LOSS, 0) # same, with colors swapped
+    assert probe("7k/Q7/6K1/8/8/8/8/8 w - -") == (tablebase.WIN, 1)
+    assert probe("7k/8/6K1/8/8/8/8/6Q1 w - -") == (tablebase.WIN, 3) # the king blocks Qg7
+    assert probe("7k/8/5K2/8/8/8/8/6Q1 b - -")[0] == tablebase.LOSS
+    assert probe("7k/5Q2/6K1/8/8/8/8/8 b - -") == (tablebase.DRAW, 0) # stalemate
+    assert probe("7k/8/6K1/8/8/8/8/6B1 w - -") == (tablebase.DRAW, 0) # no table needed
+    assert probe("7k/8/6K1/8/8/8/8/5RQ1 w - -") is None # no table
+
+    # the longest mate with king and queen takes 10 moves
+    layout, values = tablebases.table("KQvK")
+    assert values.max() == 19
+
+def test_search(tablebases):
+    options = search.SearchOptions(tablebases=tablebases)
+    b = ChessBoard.from_fen("7k/Q7/6K1/8/8/8/8/8 w - -")
+    m, score, depth = search.limited_search(b, max_depth=5, options=options)
+    assert score == search.TABLEBASE_WIN - 1 # the table's distance, from the root probe
+    assert depth == 0 # without searching
+    assert tablebases.probe(b.apply_move(m)) == (tablebase.LOSS, 0)
+    assert tablebases.probe(b.apply_move(search.best_move(b, 1, options=options))) == (tablebase.LOSS, 0)
+
+    # black takes the queen, after which the tables have it mating
+    b = ChessBoard.from_fen("7k/8/6K1/8/8/8/8/q5Q1 b - -")
+    stats = search.SearchStats()
+    score = search.negamax(b, 2, options=options, stats=stats)
+    assert search.TABLEBASE_WIN - tablebase.MAX_PLIES < score < search.TABLEBASE_WIN
+    assert stats.tablebase_hits > 0
@@ -0,0 +1,51 @@
+import numpy as np
+
+from chessboard import ChessBoard
+from move import Move
+from square import Square
+from transposition import TranspositionTable, Bound, ENTRY_BYTES
+import movegen
+
+def test_incremental_hash():
+    b = ChessBoard()
+    b.init_game()
+    for _ in range(3):
+        for m in list(movegen.gen_legal_moves(b))[:5]:
+            new_board = b.apply_move(m)
+            assert new_board.hash == new_board.compute_hash()
+            assert new_board.hash != b.hash
+        b = new_board
+
+def test_transposition_hash():
+    b = ChessBoard()
+    b.init_game()
+    moves1 = ["G1F3", "G8F6", "B1C3"]
+    moves2 = ["B1C3", "G8F6", "G1F3"]
+    def play(moves):
+        board = b
+        for m in moves:
+            board = board.apply_move(Move(Square.from_str(m[:2]), Square.from_str(m[2:])).to_int())
+        return board
+    assert play(moves1).hash == play(moves2).hash
+
+def test_store_probe():
+    tt = TranspositionTable(1)
+    assert tt.nbytes() <= 1024 * 1024
+    assert tt.size * 2 * ENTRY_BYTES > 1024 * 1024
+
+    m = Move(Square.from_str("E2"), Square.from_str("E4")).to_int()
+    key = np.uint64(0xDEADBEEF12345678)
+    assert tt.probe(key) is None
+    tt.store(key, 3, Bound.LOWER, np.int32(42), m)
+    depth, bound, score, move = tt.probe(key)
+    assert (depth, bound, score, move) == (3, Bound.LOWER, 42, m)
+
+    # a different key in the same slot doesn't replace a deeper entry from this search
+    other = key ^ np.uint64(tt.size)
+    tt.store(other, 1, Bound.EXACT, np.int32(0))
+    assert tt.probe(other) is None
+    # but does once the entry is stale
+    tt.new_search()
+    tt.store(other, 1, Bound.EXACT, np.int32(0))
+    assert tt.probe(other) is not None
+    assert tt.probe(key) is None
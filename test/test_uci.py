@@ -0,0 +1,58 @@
+import time
+
+import search
+import uci
+
+BACK_RANK = "6k1/5ppp/8/8/8/8/8/R5K1 w - - 0 1"
+
+def run(engine, *lines):
+    for line in lines:
+        assert engine.handle(line)
+
+def test_parse_go():
+    assert uci.parse_go("wtime 1000 btime 2000 winc 10 ponder".split()) == \
+        {"wtime": 1000, "btime": 2000, "winc": 10, "ponder": True}
+    assert uci.time_limit({"movetime": 500}, 0) == 0.5
+    assert uci.time_limit({"wtime": 3000, "btime": 1, "movestogo": 10}, 0) == 0.3
+    assert uci.time_limit({}, 0) is None
+
+def test_format_score():
+    assert uci.format_score(35, 3) == "cp 35"
+    assert uci.format_score(search.MAX_SCORE, 1) == "mate 1"
+    assert uci.format_score(search.MAX_SCORE, 3) == "mate 2"
+    assert uci.format_score(search.MIN_SCORE, 2) == "mate -1"
+    assert uci.format_score(search.TABLEBASE_WIN - 1, 0) == "mate 1" # probed at the root
+    assert uci.format_score(-search.TABLEBASE_WIN + 3, 1) == "mate -2" # the reply mates in 2 from the probe
+
+def test_go_depth():
+    out = []
+    engine = uci.UciEngine(out.append)
+    run(engine, "uci", "isready", "position fen %s" % BACK_RANK, "go depth 2")
+    engine.thread.join()
+    assert "uciok" in out and "readyok" in out
+    assert out[-1].startswith("bestmove a1a8")
+    assert any(line.startswith("info depth 2 score mate 1 ") for line in out)
+    assert not engine.handle("quit")
+
+def test_position_moves():
+    engine = uci.UciEngine(lambda line: None)
+    run(engine, "position startpos moves e2e4 e7e5 g1f3")
+    assert engine.board.to_fen() == "rnbqkbnr/pppp1ppp/8/4p3/4P3/5N2/PPPP1PPP/RNBQKB1R b - - 0 1"
+
+def test_ponder_and_stop():
+    out = []
+    engine = uci.UciEngine(out.append)
+    run(engine, "position startpos moves e2e4", "go ponder depth 2")
+    time.sleep(0.2)
+    run(engine, "isready")
+    assert "readyok" in out and not any(line.startswith("bestmove") for line in out)
+    run(engine, "ponderhit")
+    engine.thread.join()
+    assert out[-1].startswith("bestmove")
+
+    del out[:]
+    run(engine, "go infinite")
+    time.sleep(0.2)
+    run(engine, "stop")
+    assert out[-1].startswith("bestmove")
+    assert engine.thread is None